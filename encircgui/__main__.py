@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import multiprocessing
+
 from encirc_GUI import main
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# On the 8-bit scale, see pixelformat.scale_level
+DEFAULT_SATURATION = 250
+DEFAULT_PERCENTILE = 99.0
+
+# Thresholded copy of each region, by region index, reused between frames
+# until the region changes shape
+_bright_buffers: list[np.ndarray] = []
+
+
+@dataclass
+class RegionStats:
+    """Statistics of the pixels in one region of interest."""
+
+    sum: int
+    mean: float
+    max: int
+    percentile: float
+    # Number of pixels at or above the saturation level
+    saturated: int
+    # Intensity weighted centroid (x, y) of the saturated pixels, in frame
+    # coordinates, or None if there are none
+    centroid: Optional[tuple[float, float]]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def get_region(array: np.ndarray, roi) -> np.ndarray:
+    return array[roi["y_low"] : roi["y_high"], roi["x_low"] : roi["x_high"]]
+
+
+def region_sums(frame: np.ndarray, regions) -> list[int]:
+    """Sum of the pixels in each region of interest."""
+    return [int(np.sum(get_region(frame, roi))) for roi in regions]
+
+
+def _histogram(region: np.ndarray) -> np.ndarray:
+    if region.dtype == np.uint8 and region.ndim == 2:
+        hist = cv2.calcHist([region], [0], None, [256], [0, 256])
+        return hist.ravel().astype(np.int64)
+    return np.bincount(region.ravel(), minlength=256)
+
+
+def _bright_buffer(index: int, region: np.ndarray) -> np.ndarray:
+    while len(_bright_buffers) <= index:
+        _bright_buffers.append(np.empty(0, np.uint8))
+    buffer = _bright_buffers[index]
+    if buffer.shape != region.shape or buffer.dtype != region.dtype:
+        buffer = _bright_buffers[index] = np.empty(region.shape, region.dtype)
+    return buffer
+
+
+def _bright_centroid(
+    region: np.ndarray, saturation: int, roi, index: int
+) -> Optional[tuple[float, float]]:
+    if region.dtype not in (np.uint8, np.uint16):
+        region = region.astype(np.float32)
+    buffer = _bright_buffer(index, region)
+    # Keep pixels at or above the saturation level, zero everything else
+    cv2.threshold(region, saturation - 1, 0, cv2.THRESH_TOZERO, dst=buffer)
+    moments = cv2.moments(buffer)
+    if moments["m00"] == 0:
+        return None
+    return (
+        roi["x_low"] + moments["m10"] / moments["m00"],
+        roi["y_low"] + moments["m01"] / moments["m00"],
+    )
+
+
+def _count_from(cumulative: np.ndarray, level: int) -> int:
+    """Number of pixels at or above `level`, from a cumulative histogram."""
+    if level <= 0:
+        return int(cumulative[-1])
+    # The histogram of 16-bit regions only reaches their brightest pixel
+    return int(cumulative[-1] - cumulative[min(level, len(cumulative)) - 1])
+
+
+def region_statistics(
+    frame: np.ndarray,
+    regions,
+    saturation: int = DEFAULT_SATURATION,
+    percentile: float = DEFAULT_PERCENTILE,
+) -> list[RegionStats]:
+    """
+    Computes the statistics of each region of interest. The sum, mean, max,
+    percentile and saturated count all come from a single histogram of the
+    region. The centroid comes from the moments of its saturated pixels, so
+    the region is only scanned again if it has any.
+    """
+    if frame.ndim == 3:
+        # Two channel (dart) cameras, the first channel is the image
+        frame = frame[:, :, 0]
+    stats = []
+    for index, roi in enumerate(regions):
+        region = get_region(frame, roi)
+        if region.size == 0:
+            stats.append(RegionStats(0, 0.0, 0, 0.0, 0, None))
+            continue
+        if not np.issubdtype(region.dtype, np.unsignedinteger):
+            region = np.clip(region, 0, None).astype(np.uint16)
+
+        hist = _histogram(region)
+        levels = np.arange(len(hist))
+        count = int(region.size)
+        total = int(hist @ levels)
+        cumulative = np.cumsum(hist)
+        saturated = _count_from(cumulative, saturation)
+        stats.append(
+            RegionStats(
+                sum=total,
+                mean=total / count,
+                max=int(np.flatnonzero(hist)[-1]),
+                percentile=float(np.searchsorted(cumulative, count * percentile / 100)),
+                saturated=saturated,
+                centroid=_bright_centroid(region, saturation, roi, index) if saturated else None,
+            )
+        )
+    return stats
+
+
+def main():
+    # Example usage:
+    import time
+
+    frame = np.random.randint(0, 200, (400, 1024), dtype=np.uint8)
+    frame[200:210, 600:620] = 255
+    regions = [
+        {"x_low": 300, "y_low": 120, "x_high": 500, "y_high": 320},
+        {"x_low": 500, "y_low": 120, "x_high": 850, "y_high": 320},
+        {"x_low": 850, "y_low": 120, "x_high": 1024, "y_high": 320},
+    ]
+
+    for stats in region_statistics(frame, regions):
+        print(stats)
+
+    n = 200
+    t_start = time.perf_counter()
+    for _ in range(n):
+        region_sums(frame, regions)
+    t_sums = (time.perf_counter() - t_start) / n
+    t_start = time.perf_counter()
+    for _ in range(n):
+        region_statistics(frame, regions)
+    t_stats = (time.perf_counter() - t_start) / n
+    print(f"Sums: {t_sums * 1e3:.3f} ms, statistics: {t_stats * 1e3:.3f} ms per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+import time
+from collections.abc import Mapping
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from analysis import DEFAULT_PERCENTILE, DEFAULT_SATURATION, region_statistics
+from panorama import Panorama
+from pixelformat import scale_level
+
+CHEAP = "cheap"
+EXPENSIVE = "expensive"
+
+# Registered analyzer classes, by name
+ANALYZERS: dict[str, type] = {}
+
+
+def statistics_options(snapshot, bits: int = 8) -> dict:
+    """
+    Options for region_statistics from the analysis section of the config,
+    for pixels with `bits` significant bits.
+    """
+    analysis_config = snapshot.raw.get("analysis", {})
+    return {
+        "saturation": scale_level(analysis_config.get("saturation", DEFAULT_SATURATION), bits),
+        "percentile": analysis_config.get("percentile", DEFAULT_PERCENTILE),
+    }
+
+
+def register_analyzer(cls):
+    """Class decorator making an analyzer available by its `name`."""
+    ANALYZERS[cls.name] = cls
+    return cls
+
+
+class Analyzer:
+    """
+    Base class of the per-frame analyzers.
+
+    An analyzer reads the `inputs` it declares from the frame context (a
+    dict that starts with "frame", "frame_info" and "snapshot") and returns
+    a dict with the `outputs` it declares. Cheap analyzers run on every
+    frame. Expensive analyzers run at most every `every` frames, and only
+    when there is time left in the frame budget.
+    """
+
+    name = ""
+    inputs: tuple = ("frame",)
+    outputs: tuple = ()
+    cost = CHEAP
+    # Outputs that are saved with each record
+    saved: tuple = ()
+
+    def __init__(self, every: int = 1, **options):
+        self.every = every
+
+    def analyze(self, context: dict) -> dict:
+        raise NotImplementedError
+
+    def reset(self):
+        """Called at the start of every session."""
+
+
+@register_analyzer
+class RegionStatisticsAnalyzer(Analyzer):
+    name = "region_statistics"
+    inputs = ("frame", "frame_info", "snapshot")
+    outputs = ("stats",)
+
+    def analyze(self, context):
+        snapshot = context["snapshot"]
+        options = statistics_options(snapshot, context["frame_info"].bit_depth)
+        return {"stats": region_statistics(context["frame"], snapshot.regions, **options)}
+
+
+@register_analyzer
+class PanoramaAnalyzer(Analyzer):
+    name = "panorama"
+    inputs = ("frame", "frame_info")
+    outputs = ("panorama",)
+
+    def __init__(self, every: int = 1, **options):
+        super().__init__(every)
+        self.panorama = Panorama(**options)
+
+    def analyze(self, context):
+        info = context["frame_info"]
+        # The camera time stamp has none of the jitter of the host time
+        t_ns = info.camera_time_ns if info.camera_time_ns is not None else info.host_timestamp_ns
+        self.panorama.add(context["frame"], t_ns)
+        return {"panorama": self.panorama}
+
+    def reset(self):
+        self.panorama.reset()
+
+
+@register_analyzer
+class BottlePresenceAnalyzer(Analyzer):
+    """Decides if a bottle is in view from the mean of a subsampled frame."""
+
+    name = "bottle_presence"
+    inputs = ("frame", "frame_info")
+    outputs = ("bottle_present",)
+    saved = ("bottle_present",)
+
+    def __init__(self, every: int = 1, threshold: float = 20, step: int = 8, **options):
+        super().__init__(every)
+        self.threshold = threshold
+        self.step = step
+
+    def analyze(self, context):
+        frame = context["frame"]
+        mean = float(np.mean(frame[:: self.step, :: self.step]))
+        threshold = scale_level(self.threshold, context["frame_info"].bit_depth)
+        return {"bottle_present": mean >= threshold}
+
+
+@register_analyzer
+class FocusAnalyzer(Analyzer):
+    """Sharpness of the image, as the variance of its Laplacian."""
+
+    name = "focus"
+    outputs = ("focus",)
+    cost = EXPENSIVE
+    saved = ("focus",)
+
+    def __init__(self, every: int = 10, **options):
+        super().__init__(every)
+
+    def analyze(self, context):
+        frame = context["frame"]
+        if frame.ndim == 3:
+            frame = frame[:, :, 0]
+        return {"focus": round(float(cv2.Laplacian(frame, cv2.CV_32F).var()), 3)}
+
+
+class AnalyzerTiming:
+    """Running cost of one analyzer."""
+
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.last = 0.0
+        self.mean = 0.0
+
+    def add(self, seconds: float):
+        self.runs += 1
+        self.last = seconds
+        # Exponential moving average, seeded with the first measurement
+        self.mean = seconds if self.runs == 1 else 0.9 * self.mean + 0.1 * seconds
+
+
+class AnalyzerScheduler:
+    """
+    Runs analyzers on each frame, in dependency order, within a frame budget.
+
+    The frame budget is the time between two camera frames. It is set with
+    `set_frame_rate`, or measured from the frame timestamps otherwise.
+    Expensive analyzers run once they are due (every `every` frames) and
+    their usual cost still fits in what is left of the budget, or early if
+    the frame leaves most of the budget unused. An expensive analyzer that
+    never fits is run anyway after `MAX_DELAY` times its period, and
+    reported, rather than silently slowing every frame down.
+    """
+
+    MAX_DELAY = 10
+    # Expensive analyzers may run early if they fit in this part of the budget
+    IDLE_FRACTION = 0.5
+
+    def __init__(self, analyzers: list[Analyzer], metrics=None):
+        self.analyzers = self._sort(analyzers)
+        self.metrics = metrics
+        self.timings = {analyzer.name: AnalyzerTiming() for analyzer in self.analyzers}
+        self._since_run = {analyzer.name: 0 for analyzer in self.analyzers}
+        self.budget: Optional[float] = None
+        self._fixed_budget = False
+        self._last_frame_ns = None
+        self._over_budget = False
+        self._late: set[str] = set()
+
+    @staticmethod
+    def _sort(analyzers: list[Analyzer]) -> list[Analyzer]:
+        """Orders analyzers so that each runs after those producing its inputs."""
+        ordered = []
+        available = {"frame", "frame_info", "snapshot"}
+        remaining = list(analyzers)
+        while remaining:
+            ready = [a for a in remaining if set(a.inputs) <= available]
+            if not ready:
+                names = ", ".join(a.name for a in remaining)
+                raise ValueError(f"Analyzers with missing or circular inputs: {names}")
+            for analyzer in ready:
+                ordered.append(analyzer)
+                available.update(analyzer.outputs)
+                remaining.remove(analyzer)
+        return ordered
+
+    def get(self, name: str) -> Optional[Analyzer]:
+        for analyzer in self.analyzers:
+            if analyzer.name == name:
+                return analyzer
+        return None
+
+    def set_frame_rate(self, fps: Optional[float]):
+        """Fixes the frame budget to the camera frame rate (None to measure it)."""
+        self._fixed_budget = bool(fps)
+        self.budget = 1 / fps if fps else None
+
+    def _measure_budget(self, frame_info):
+        if self._fixed_budget or frame_info is None:
+            return
+        t_ns = frame_info.host_timestamp_ns
+        if self._last_frame_ns is not None and t_ns > self._last_frame_ns:
+            interval = (t_ns - self._last_frame_ns) / 1e9
+            self.budget = interval if self.budget is None else 0.9 * self.budget + 0.1 * interval
+        self._last_frame_ns = t_ns
+
+    def reset(self):
+        for analyzer in self.analyzers:
+            analyzer.reset()
+        self._last_frame_ns = None
+
+    def _due(self, analyzer: Analyzer, elapsed: float) -> bool:
+        since = self._since_run[analyzer.name]
+        if analyzer.cost == CHEAP:
+            return since + 1 >= analyzer.every
+        if self.budget is None:
+            return since + 1 >= analyzer.every
+        cost = self.timings[analyzer.name].mean
+        if since + 1 >= analyzer.every and elapsed + cost <= self.budget:
+            return True
+        if elapsed + cost <= self.budget * self.IDLE_FRACTION:
+            return True
+        if since + 1 >= analyzer.every * self.MAX_DELAY:
+            if analyzer.name not in self._late:
+                self._late.add(analyzer.name)
+                print(
+                    f"Analyzer {analyzer.name} ({cost * 1e3:.1f} ms) does not fit in the "
+                    f"frame budget ({self.budget * 1e3:.1f} ms), running it every "
+                    f"{analyzer.every * self.MAX_DELAY} frames"
+                )
+            return True
+        return False
+
+    def run(self, context: dict, exclude=()) -> dict:
+        """
+        Runs the analyzers that are due on one frame, adding their outputs to
+        `context`. Analyzers named in `exclude` are skipped (their outputs
+        are produced elsewhere). Returns the context.
+        """
+        self._measure_budget(context.get("frame_info"))
+        t_start = time.perf_counter()
+        for analyzer in self.analyzers:
+            name = analyzer.name
+            if name in exclude:
+                continue
+            elapsed = time.perf_counter() - t_start
+            if not set(analyzer.inputs) <= context.keys() or not self._due(analyzer, elapsed):
+                self._since_run[name] += 1
+                self.timings[name].skipped += 1
+                continue
+            t_analyzer = time.perf_counter()
+            context.update(analyzer.analyze(context))
+            seconds = time.perf_counter() - t_analyzer
+            self.timings[name].add(seconds)
+            self._since_run[name] = 0
+            if self.metrics is not None:
+                self.metrics.analyzer_latency(name).observe(seconds)
+
+        elapsed = time.perf_counter() - t_start
+        over_budget = self.budget is not None and elapsed > self.budget
+        if over_budget and not self._over_budget:
+            print(
+                f"Analysis took {elapsed * 1e3:.1f} ms, more than the "
+                f"{self.budget * 1e3:.1f} ms between camera frames"
+            )
+        if over_budget and self.metrics is not None:
+            self.metrics.analysis_over_budget.inc()
+        self._over_budget = over_budget
+        return context
+
+    def saved_outputs(self, context: dict) -> dict:
+        """The outputs to save with the record of a frame, if they were computed."""
+        return {
+            output: context[output]
+            for analyzer in self.analyzers
+            for output in analyzer.saved
+            if output in context
+        }
+
+    def report(self) -> dict:
+        return {
+            name: {
+                "runs": timing.runs,
+                "skipped": timing.skipped,
+                "mean_ms": timing.mean * 1e3,
+            }
+            for name, timing in self.timings.items()
+        }
+
+
+def create_analyzers(config: dict) -> list[Analyzer]:
+    """
+    Creates the analyzers enabled in the "analyzers" section of a config,
+    e.g. {"focus": {"enabled": true, "every": 10}}. Region statistics are
+    always enabled.
+    """
+    analyzers = [RegionStatisticsAnalyzer()]
+    for name, options in config.items():
+        if not isinstance(options, Mapping):
+            # A setting of the scheduler, e.g. "frame_rate"
+            continue
+        options = dict(options)
+        if not options.pop("enabled", True) or name == RegionStatisticsAnalyzer.name:
+            continue
+        if name not in ANALYZERS:
+            raise ValueError(f"Unknown analyzer {name!r}, expected one of {list(ANALYZERS)}")
+        analyzers.append(ANALYZERS[name](**options))
+    return analyzers
+
+
+def main():
+    # Example usage:
+    from types import SimpleNamespace
+    from camera import FrameInfo
+
+    snapshot = SimpleNamespace(
+        raw={},
+        regions=[{"x_low": 300, "y_low": 120, "x_high": 500, "y_high": 320}],
+    )
+    analyzers = create_analyzers(
+        {"bottle_presence": {"enabled": True}, "focus": {"enabled": True, "every": 5}}
+    )
+    scheduler = AnalyzerScheduler(analyzers)
+    scheduler.set_frame_rate(100)
+    frame = np.random.randint(0, 256, (400, 1024), dtype=np.uint8)
+    for i in range(50):
+        context = {"frame": frame, "frame_info": FrameInfo(time.time_ns()), "snapshot": snapshot}
+        scheduler.run(context)
+    for name, timing in scheduler.report().items():
+        print(f"{name}: {timing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+import argparse
+import concurrent.futures
+import ctypes
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from dataset import DATA_DIR, SESSION_GLOB, MEASUREMENT_GLOB, iter_records
+
+ARCHIVE_DIRNAME = "archive"
+ARCHIVE_VERSION = 1
+# Sessions without a summary.json are only archived once they have not
+# changed for this long, in case they are still being written
+DEFAULT_MIN_AGE = 3600
+
+# Value states stored in the mask of a column
+_PRESENT, _NONE, _MISSING = 0, 1, 2
+
+
+def _checksum(array: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def _file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _column_kind(values: list) -> str:
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add("bool")
+        elif isinstance(value, int):
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, str):
+            kinds.add("str")
+        elif isinstance(value, list) and all(
+            isinstance(item, (int, float)) and not isinstance(item, bool) for item in value
+        ):
+            kinds.add("list")
+        else:
+            kinds.add("json")
+    if kinds == {"int", "float"}:
+        return "float"
+    if len(kinds) == 1:
+        return kinds.pop()
+    return "json" if kinds else "none"
+
+
+def encode_columns(records: list[dict]) -> tuple[list[dict], dict[str, np.ndarray]]:
+    """
+    Converts records to one array per key. Returns the column descriptions
+    and the arrays, named "col:<key>", "mask:<key>" and "cat:<key>".
+    """
+    keys = list(dict.fromkeys(key for record in records for key in record))
+    columns = []
+    arrays = {}
+    for key in keys:
+        values = [record.get(key) for record in records]
+        mask = np.array(
+            [
+                _MISSING if key not in record else _NONE if record[key] is None else _PRESENT
+                for record in records
+            ],
+            dtype=np.uint8,
+        )
+        kind = _column_kind(values)
+        if kind == "json":
+            values = [None if value is None else json.dumps(value) for value in values]
+        if kind in ("str", "json"):
+            # Most string columns (the result) only have a few distinct values
+            categories = sorted({value for value in values if value is not None})
+            codes = {value: i for i, value in enumerate(categories)}
+            data = np.array([codes.get(value, 0) for value in values], dtype=np.int32)
+            arrays[f"cat:{key}"] = np.array(categories, dtype=str)
+        elif kind == "list":
+            width = max(len(value) for value in values if value is not None)
+            data = np.full((len(values), width), np.nan)
+            for i, value in enumerate(values):
+                if value is not None:
+                    data[i, : len(value)] = value
+        elif kind in ("int", "bool"):
+            data = np.array([0 if value is None else value for value in values], dtype=np.int64)
+        elif kind == "float":
+            data = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        else:
+            data = np.zeros(len(values), dtype=np.uint8)
+        arrays[f"col:{key}"] = data
+        if mask.any():
+            arrays[f"mask:{key}"] = mask
+        columns.append({"name": key, "kind": kind})
+    return columns, arrays
+
+
+def _decode_value(kind: str, data, i: int, categories):
+    if kind in ("str", "json"):
+        value = str(categories[data[i]])
+        return json.loads(value) if kind == "json" else value
+    if kind == "list":
+        return [float(item) for item in data[i] if not np.isnan(item)]
+    if kind == "bool":
+        return bool(data[i])
+    if kind == "none":
+        return None
+    return data[i].item()
+
+
+def _load_manifest(archive) -> dict:
+    return json.loads(str(archive["manifest"]))
+
+
+def read_records(path) -> Iterator[dict]:
+    """Yields the records of a session archive, in the order they were saved."""
+    with np.load(path) as archive:
+        manifest = _load_manifest(archive)
+        columns = [
+            (
+                column["name"],
+                column["kind"],
+                archive[f"col:{column['name']}"],
+                archive.get(f"mask:{column['name']}"),
+                archive.get(f"cat:{column['name']}"),
+            )
+            for column in manifest["columns"]
+        ]
+        for i in range(manifest["count"]):
+            record = {}
+            for name, kind, data, mask, categories in columns:
+                state = _PRESENT if mask is None else mask[i]
+                if state == _MISSING:
+                    continue
+                record[name] = None if state == _NONE else _decode_value(kind, data, i, categories)
+            yield record
+
+
+def read_column(path, name: str) -> Optional[np.ndarray]:
+    """
+    Returns a numeric column of a session archive as float64, with NaN where
+    a record has no value, or None if no record has the column.
+    """
+    with np.load(path) as archive:
+        if f"col:{name}" not in archive.files:
+            return None
+        data = archive[f"col:{name}"].astype(np.float64)
+        mask = archive.get(f"mask:{name}")
+    if mask is not None:
+        data[mask != _PRESENT] = np.nan
+    return data
+
+
+def read_file(path, name: str) -> bytes:
+    """Returns the contents of another file of the session, e.g. summary.json."""
+    with np.load(path) as archive:
+        return archive[f"file:{name}"].tobytes()
+
+
+def read_manifest(path) -> dict:
+    with np.load(path) as archive:
+        return _load_manifest(archive)
+
+
+def verify_archive(path, records: Optional[list[dict]] = None) -> bool:
+    """
+    Checks every array of an archive against the checksums in its manifest,
+    and, if `records` is given, that the archive decodes to exactly those records.
+    """
+    try:
+        with np.load(path) as archive:
+            manifest = _load_manifest(archive)
+            for key, checksum in manifest["checksums"].items():
+                if _checksum(archive[key]) != checksum:
+                    return False
+        if records is not None:
+            decoded = read_records(path)
+            if any(a != b for a, b in zip(records, decoded)):
+                return False
+            if manifest["count"] != len(records):
+                return False
+    except (OSError, ValueError, KeyError):
+        return False
+    return True
+
+
+def measurement_files(session_dir: Path) -> list[Path]:
+    return sorted(session_dir.glob(MEASUREMENT_GLOB))
+
+
+def archive_path(session_dir: Path, archive_dir: Optional[Path] = None) -> Path:
+    if archive_dir is None:
+        archive_dir = session_dir.parent / ARCHIVE_DIRNAME
+    return Path(archive_dir) / f"{session_dir.name}.npz"
+
+
+def compact_session(session_dir, archive_dir=None) -> Path:
+    """
+    Converts a session directory into a single compressed, columnar archive
+    with checksums. The archive is written to a temporary file, verified
+    against the original records, and only then renamed into place, so an
+    interrupted run never leaves a partial archive behind.
+    """
+    session_dir = Path(session_dir)
+    path = archive_path(session_dir, archive_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    sources = measurement_files(session_dir)
+    records = [record for source in sources for _, record in iter_records(source)]
+    columns, arrays = encode_columns(records)
+    for other in sorted(session_dir.iterdir()):
+        if other.is_file() and other not in sources:
+            arrays[f"file:{other.name}"] = np.frombuffer(other.read_bytes(), dtype=np.uint8)
+
+    manifest = {
+        "version": ARCHIVE_VERSION,
+        "session": session_dir.name,
+        "count": len(records),
+        "columns": columns,
+        "checksums": {key: _checksum(array) for key, array in arrays.items()},
+        "sources": {source.name: _file_checksum(source) for source in sources},
+    }
+    arrays["manifest"] = np.array(json.dumps(manifest))
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        if not verify_archive(tmp_path, records):
+            raise ValueError(f"Archive of {session_dir} does not match the original")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def _newest_mtime(session_dir: Path) -> float:
+    mtimes = [p.stat().st_mtime for p in session_dir.iterdir() if p.is_file()]
+    return max(mtimes, default=session_dir.stat().st_mtime)
+
+
+def find_sessions(data_dir, exclude=(), min_age: float = DEFAULT_MIN_AGE) -> list[Path]:
+    """
+    Finished session directories that have not been archived yet. A session
+    is finished once it has a summary.json, or has not changed for `min_age`
+    seconds. Directories in `exclude` (e.g. the running session) are skipped.
+    """
+    exclude = {Path(p).resolve() for p in exclude}
+    now = time.time()
+    sessions = []
+    for session_dir in sorted(Path(data_dir).glob(SESSION_GLOB)):
+        if not session_dir.is_dir() or session_dir.resolve() in exclude:
+            continue
+        if archive_path(session_dir).exists() or not measurement_files(session_dir):
+            continue
+        finished = (session_dir / "summary.json").exists()
+        if finished or now - _newest_mtime(session_dir) > min_age:
+            sessions.append(session_dir)
+    return sessions
+
+
+def apply_retention(data_dir, retention_days: float, exclude=()) -> list[Path]:
+    """
+    Deletes the original directories of archived sessions that are older
+    than `retention_days`, after checking the archive once more.
+    Returns the deleted directories.
+    """
+    exclude = {Path(p).resolve() for p in exclude}
+    cutoff = time.time() - retention_days * 86400
+    deleted = []
+    for session_dir in sorted(Path(data_dir).glob(SESSION_GLOB)):
+        if not session_dir.is_dir() or session_dir.resolve() in exclude:
+            continue
+        path = archive_path(session_dir)
+        if not path.exists() or _newest_mtime(session_dir) > cutoff:
+            continue
+        manifest = read_manifest(path)
+        sources = measurement_files(session_dir)
+        unchanged = manifest["sources"] == {s.name: _file_checksum(s) for s in sources}
+        if unchanged and verify_archive(path):
+            shutil.rmtree(session_dir)
+            deleted.append(session_dir)
+        else:
+            print(f"Keeping {session_dir}: it does not match its archive")
+    return deleted
+
+
+def _lower_priority():
+    """Runs the calling (worker) process below normal priority."""
+    if platform.system() == "Windows":
+        BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+    else:
+        os.nice(10)
+
+
+def _remove_partial_archives(archive_dir: Path):
+    for tmp_path in archive_dir.glob("*.npz.tmp"):
+        tmp_path.unlink(missing_ok=True)
+
+
+class ArchiveJob:
+    """
+    Archives every finished session in `data_dir`, using `workers` low
+    priority processes, then applies the retention policy.
+
+    The job can be stopped at any time: sessions that were not started yet
+    are left for the next run, and sessions being archived are finished.
+    Because archives are only renamed into place once verified, a job that
+    was killed simply starts again from the sessions without an archive.
+    """
+
+    def __init__(
+        self,
+        data_dir=None,
+        workers: int = 2,
+        retention_days: Optional[float] = None,
+        exclude=(),
+        min_age: float = DEFAULT_MIN_AGE,
+    ):
+        self.data_dir = Path(data_dir) if data_dir is not None else DATA_DIR
+        self.workers = workers
+        self.retention_days = retention_days
+        self.exclude = list(exclude)
+        self.min_age = min_age
+        self.archived: list[Path] = []
+        self.failed: list[Path] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        archive_dir = self.data_dir / ARCHIVE_DIRNAME
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        _remove_partial_archives(archive_dir)
+        sessions = find_sessions(self.data_dir, self.exclude, self.min_age)
+        if sessions:
+            print(f"Archiving {len(sessions)} sessions")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        ) as executor:
+            futures = {
+                executor.submit(compact_session, session_dir): session_dir
+                for session_dir in sessions
+            }
+            for future in concurrent.futures.as_completed(futures):
+                session_dir = futures[future]
+                try:
+                    path = future.result()
+                except concurrent.futures.CancelledError:
+                    continue
+                except Exception as e:
+                    print(f"Could not archive {session_dir}: {e}")
+                    self.failed.append(session_dir)
+                else:
+                    print(f"Archived {session_dir.name} to {path}")
+                    self.archived.append(session_dir)
+                if self._stop.is_set():
+                    for pending in futures:
+                        pending.cancel()
+        if self.retention_days is not None and not self._stop.is_set():
+            for session_dir in apply_retention(self.data_dir, self.retention_days, self.exclude):
+                print(f"Deleted archived session {session_dir}")
+
+    def start(self):
+        """Runs the job on a background thread."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="archive-job", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = False):
+        """Stops the job after the sessions that are being archived."""
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+
+def main():
+    # Archive workers of a frozen build run their worker instead of this command
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(
+        description="Archive finished ENCIRC sessions into compressed columnar files."
+    )
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="data directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--retention-days",
+        type=float,
+        help="delete the original session directories after this many days",
+    )
+    parser.add_argument(
+        "--min-age",
+        type=float,
+        default=DEFAULT_MIN_AGE,
+        help="seconds a session without a summary must be unchanged before it is archived",
+    )
+    parser.add_argument("--verify", action="store_true", help="only verify existing archives")
+    args = parser.parse_args()
+
+    if args.verify:
+        paths = sorted((Path(args.data_dir) / ARCHIVE_DIRNAME).glob("*.npz"))
+        bad = [path for path in paths if not verify_archive(path)]
+        for path in bad:
+            print(f"Corrupt archive: {path}")
+        print(f"Verified {len(paths) - len(bad)} of {len(paths)} archives")
+        raise SystemExit(1 if bad else 0)
+
+    job = ArchiveJob(args.data_dir, args.workers, args.retention_days, min_age=args.min_age)
+    job.run()
+    print(f"Archived {len(job.archived)} sessions, {len(job.failed)} failed")
+
+
+if __name__ == "__main__":
+    main()
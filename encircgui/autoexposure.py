@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from camera import FrameInfo
+from pixelformat import scale_level
+
+
+def subsampled_percentile(image: np.ndarray, percentile: float, stride: int) -> float:
+    """
+    The `percentile` of the pixel values of every `stride`th row and column
+    of `image`, from a histogram of the subsample.
+    """
+    if image.ndim == 3:
+        # First channel of multi-channel (e.g. dart) images
+        image = image[:, :, 0]
+    sample = image[::stride, ::stride].ravel()
+    histogram = np.bincount(sample, minlength=256)
+    cumulative = np.cumsum(histogram)
+    return float(np.searchsorted(cumulative, cumulative[-1] * percentile / 100))
+
+
+class AutoExposure:
+    """
+    Closed-loop exposure control. Every `every` frames, the `percentile` of
+    a subsample of the image (every `stride`th pixel of every `stride`th row)
+    is compared to a target of `target` × the `saturation` level, leaving
+    headroom below saturation. The saturation level is on the 8-bit scale,
+    and is scaled to the bit depth of each frame.
+
+    Pixel values grow in proportion to the exposure, so the shortest exposure
+    that brings the percentile to the target is the current exposure scaled
+    by target / percentile. That is the exposure chosen, which also lets the
+    camera grab faster. If the percentile is saturated, its true value is
+    unknown and the exposure is cut by the largest step instead. Each
+    adjustment is limited to a factor of `max_step`, and changes of less
+    than `deadband` (a fraction) are not made, so the loop does not hunt.
+    """
+
+    def __init__(
+        self,
+        exposure: float,
+        saturation: int = 250,
+        every: int = 5,
+        stride: int = 8,
+        percentile: float = 99.5,
+        target: float = 0.8,
+        max_step: float = 1.5,
+        deadband: float = 0.05,
+        min_exposure: float = 0.05,
+        max_exposure: float = 10.0,
+    ):
+        self.saturation = saturation
+        self.every = every
+        self.stride = stride
+        self.percentile = percentile
+        self.target = target
+        self.max_step = max_step
+        self.deadband = deadband
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        self.exposure = exposure
+        self._chunks = False
+        self.reset()
+
+    def reset(self, exposure: Optional[float] = None):
+        """
+        Starts a new log of adjustments, from `exposure` or else from the
+        exposure the loop last settled on.
+        """
+        self.exposure = self._clamp(exposure if exposure is not None else self.exposure)
+        self.count = 0
+        self.adjustments: list[dict] = []
+        self._pending: Optional[dict] = None
+
+    def _clamp(self, exposure: float) -> float:
+        return min(max(exposure, self.min_exposure), self.max_exposure)
+
+    def configure_camera(self, camera):
+        """
+        Sets the starting exposure, and asks the camera to send the exposure
+        of each frame with it, if it can.
+        """
+        camera.ExposureTime.SetValue(self.exposure * 1000)
+        try:
+            camera.ChunkModeActive.SetValue(True)
+            camera.ChunkSelector.SetValue("ExposureTime")
+            camera.ChunkEnable.SetValue(True)
+            self._chunks = True
+        except Exception:
+            # Without chunks, a change is assumed to apply from the next frame
+            self._chunks = False
+            try:
+                camera.ChunkModeActive.SetValue(False)
+            except Exception:
+                pass
+
+    def frame_exposure(self, info: FrameInfo, grab_result=None):
+        """
+        Sets the exposure of a grabbed frame, and notes the first frame of a
+        pending adjustment.
+        """
+        exposure = None
+        if self._chunks:
+            try:
+                exposure = grab_result.ChunkExposureTime.Value / 1000
+            except Exception:
+                pass
+        if exposure is None:
+            exposure = self.exposure
+        info.exposure = exposure
+        if self._pending is not None and (
+            # The camera rounds the exposure to its own increments
+            not self._chunks or abs(exposure - self._pending["exposure"]) < 0.01 * exposure
+        ):
+            self._pending["applies_from_frame"] = info.frame_id
+            self._pending = None
+
+    def update(self, image: np.ndarray, info: FrameInfo, camera=None) -> Optional[float]:
+        """
+        Measures every `every`th frame, and sets the camera to a new exposure
+        if needed. Returns the new exposure in ms, or None if unchanged.
+        """
+        self.count += 1
+        if (self.count - 1) % self.every:
+            return None
+        if self._pending is not None:
+            # Wait until the last change has reached the images
+            return None
+        level = subsampled_percentile(image, self.percentile, self.stride)
+        exposure = info.exposure if info.exposure is not None else self.exposure
+        saturation = scale_level(self.saturation, info.bit_depth)
+        goal = self.target * saturation
+        if level >= saturation:
+            wanted = exposure / self.max_step
+        else:
+            wanted = exposure * goal / max(level, 1.0)
+        wanted = min(max(wanted, exposure / self.max_step), exposure * self.max_step)
+        wanted = round(self._clamp(wanted), 3)
+        if abs(wanted - self.exposure) <= self.deadband * self.exposure:
+            return None
+        if camera is not None:
+            camera.ExposureTime.SetValue(wanted * 1000)
+        self._pending = {
+            "measured_frame": info.frame_id,
+            "percentile": level,
+            "exposure_from": exposure,
+            "exposure": wanted,
+            "applies_from_frame": None,
+        }
+        self.adjustments.append(self._pending)
+        self.exposure = wanted
+        return wanted
+
+    def save(self, path: Path) -> Optional[Path]:
+        """Writes the adjustments made since `reset` to a JSON file."""
+        if not self.adjustments:
+            return None
+        with open(path, "w") as f:
+            json.dump(self.adjustments, f, indent=4)
+        return path
+
+
+def main():
+    # Example usage: a scene 3x too bright for the starting exposure
+    controller = AutoExposure(exposure=8.0)
+    rng = np.random.default_rng(0)
+    for frame_id in range(1, 41):
+        info = FrameInfo(0, image_number=frame_id)
+        controller.frame_exposure(info)
+        scene = rng.uniform(0, 60, (400, 1024)) * info.exposure
+        image = np.clip(scene, 0, 255).astype(np.uint8)
+        controller.update(image, info)
+    for adjustment in controller.adjustments:
+        print(adjustment)
+    print(f"Settled at {controller.exposure} ms")
+
+
+if __name__ == "__main__":
+    main()
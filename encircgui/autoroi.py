@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+from typing import Optional
+
+import numpy as np
+
+from pixelformat import scale_level
+from utils import region_dict
+
+
+def image_profiles(image: np.ndarray, stride: int = 4) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Row and column profiles of `image`: the mean of every `stride`th pixel
+    of each row, and of every `stride`th row of each column.
+    """
+    if image.ndim == 3:
+        # First channel of multi-channel (e.g. dart) images
+        image = image[:, :, 0]
+    rows = image[:, ::stride].mean(axis=1, dtype=np.float32)
+    columns = image[::stride, :].mean(axis=0, dtype=np.float32)
+    return rows, columns
+
+
+def find_span(
+    profile: np.ndarray, threshold: float = 0.5, min_contrast: float = 10.0
+) -> Optional[tuple[int, int]]:
+    """
+    The first and last (exclusive) index of a profile that differ from the
+    background by at least `threshold` × the largest difference. The
+    background is the median of the outer 5% at each end, so the bottle can
+    be brighter or darker than it. None if the largest difference is below
+    `min_contrast`.
+    """
+    edge = max(len(profile) // 20, 1)
+    background = np.median(np.concatenate((profile[:edge], profile[-edge:])))
+    contrast = np.abs(profile - background)
+    peak = contrast.max()
+    if peak < min_contrast:
+        return None
+    above = np.flatnonzero(contrast >= threshold * peak)
+    return int(above[0]), int(above[-1]) + 1
+
+
+def split_span(x_low: int, y_low: int, x_high: int, y_high: int, count: int) -> list[dict]:
+    """Splits a box into `count` regions of equal width, side by side."""
+    edges = np.linspace(x_low, x_high, count + 1).round().astype(int)
+    return [
+        region_dict(int(left), y_low, int(right), y_high)
+        for left, right in zip(edges[:-1], edges[1:])
+    ]
+
+
+def _outline(regions) -> tuple[int, int, int, int]:
+    """The box around regions placed side by side."""
+    return (
+        regions[0]["x_low"], regions[0]["y_low"], regions[-1]["x_high"], regions[-1]["y_high"]
+    )
+
+
+class AutoROI:
+    """
+    Places the regions of interest on the bottle. The row and column
+    profiles of `frames` reference frames are averaged, the bottle edges are
+    found in each with `find_span`, and the span between them, less a
+    `margin` of pixels on each side, is split into evenly sized regions.
+
+    `request` places the regions from the next frames. With `every` set, the
+    placement is also re-run every `every` frames to follow the bottle as it
+    drifts, and only moves the regions if an edge moved by more than
+    `tolerance` pixels. Frames in between cost a counter increment.
+
+    `min_contrast` is on the 8-bit scale, and is scaled to the bit depth of
+    the frames.
+    """
+
+    def __init__(
+        self,
+        frames: int = 5,
+        stride: int = 4,
+        threshold: float = 0.5,
+        min_contrast: float = 10.0,
+        margin: int = 8,
+        every: int = 0,
+        tolerance: int = 10,
+    ):
+        self.frames = frames
+        self.stride = stride
+        self.threshold = threshold
+        self.min_contrast = min_contrast
+        self.margin = margin
+        self.every = every
+        self.tolerance = tolerance
+        self.count = 0
+        self._collected = 0
+        self._requested = False
+        self._tracking = False
+        self._rows = None
+        self._columns = None
+
+    @property
+    def collecting(self) -> bool:
+        return self._requested or self._tracking
+
+    def request(self):
+        """Places the regions from the next `frames` frames."""
+        self._requested = True
+        self._collected = 0
+
+    def update(self, image: np.ndarray, regions, bits: int = 8) -> Optional[list[dict]]:
+        """
+        Adds an inspected frame with `bits` significant bits per pixel.
+        Returns the new regions, as many as in `regions`, when they have
+        been placed, else None.
+        """
+        self.count += 1
+        if not self.collecting:
+            if not self.every or self.count % self.every:
+                return None
+            self._tracking = True
+            self._collected = 0
+        rows, columns = image_profiles(image, self.stride)
+        if self._collected == 0 or self._rows.shape != rows.shape:
+            self._rows, self._columns = rows, columns
+            self._collected = 0
+        else:
+            self._rows += rows
+            self._columns += columns
+        self._collected += 1
+        if self._collected < self.frames:
+            return None
+
+        requested = self._requested
+        self._requested = self._tracking = False
+        placed = self.place(
+            self._rows / self._collected, self._columns / self._collected, len(regions), bits
+        )
+        if placed is None or requested:
+            return placed
+        # Tracking: leave the regions alone unless the bottle has moved
+        moved = max(abs(a - b) for a, b in zip(_outline(regions), _outline(placed)))
+        return placed if moved > self.tolerance else None
+
+    def place(
+        self, rows: np.ndarray, columns: np.ndarray, count: int, bits: int = 8
+    ) -> Optional[list[dict]]:
+        """Splits the bottle found in a row and column profile into `count` regions."""
+        min_contrast = scale_level(self.min_contrast, bits)
+        row_span = find_span(rows, self.threshold, min_contrast)
+        column_span = find_span(columns, self.threshold, min_contrast)
+        if row_span is None or column_span is None:
+            print("Auto ROI: no bottle edges found")
+            return None
+        y_low, y_high = row_span[0] + self.margin, row_span[1] - self.margin
+        x_low, x_high = column_span[0] + self.margin, column_span[1] - self.margin
+        if y_high <= y_low or x_high - x_low < count:
+            print(f"Auto ROI: bottle too small ({x_high - x_low} x {y_high - y_low} pixels)")
+            return None
+        return split_span(x_low, y_low, x_high, y_high, count)
+
+
+def main():
+    # Example usage: a bright bottle on a dark background
+    rng = np.random.default_rng(0)
+    auto_roi = AutoROI(frames=3)
+    auto_roi.request()
+    regions = None
+    while regions is None:
+        image = rng.integers(0, 20, (400, 1920), dtype=np.uint8)
+        image[110:330, 290:1610] += 150
+        regions = auto_roi.update(image, [region_dict(0, 0, 1, 1)] * 4)
+    for region in regions:
+        print(region)
+
+
+if __name__ == "__main__":
+    main()
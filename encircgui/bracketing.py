@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+from typing import Optional
+
+from analysis import RegionStats
+from analyzers import Analyzer, register_analyzer
+from camera import FrameInfo
+
+SEQUENCER = "sequencer"
+SOFTWARE = "software"
+
+
+class ExposureBracket:
+    """
+    Grabs frames with a repeating sequence of exposures, e.g. a short one for
+    bright defects and a long one for faint haze.
+
+    Cameras with a sequencer switch exposure themselves from one frame to the
+    next, so bracketing runs at the full camera frame rate. Other cameras (and
+    the emulator) are switched to software triggering, and `trigger` sets the
+    exposure of the next frame before triggering it, one frame per call.
+
+    `tag` records which exposure each frame was taken with.
+    """
+
+    def __init__(self, exposures: list[float]):
+        if not exposures:
+            raise ValueError("Bracketing needs at least one exposure")
+        self.exposures = list(exposures)
+        self.mode: Optional[str] = None
+        self._saved_settings = None
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.exposures)
+
+    def reset(self):
+        self._first_id = None
+        self._count = 0
+        self._next_index = 0
+        self._triggered: list[int] = []
+
+    def configure_camera(self, camera) -> str:
+        """Sets the camera up for bracketing. Returns the mode used."""
+        self._saved_settings = {
+            "ExposureTime": camera.ExposureTime.GetValue(),
+            "TriggerMode": camera.TriggerMode.GetValue(),
+        }
+        try:
+            self._configure_sequencer(camera)
+            self.mode = SEQUENCER
+        except Exception as e:
+            print(f"Camera sequencer not available ({e}), alternating exposures in software")
+            camera.TriggerSelector.SetValue("FrameStart")
+            camera.TriggerMode.SetValue("On")
+            camera.TriggerSource.SetValue("Software")
+            self.mode = SOFTWARE
+        return self.mode
+
+    def _configure_sequencer(self, camera):
+        camera.SequencerMode.SetValue("Off")
+        camera.SequencerConfigurationMode.SetValue("On")
+        for index, exposure in enumerate(self.exposures):
+            camera.SequencerSetSelector.SetValue(index)
+            camera.ExposureTime.SetValue(exposure * 1000)
+            camera.SequencerPathSelector.SetValue(0)
+            camera.SequencerSetNext.SetValue((index + 1) % len(self.exposures))
+            camera.SequencerTriggerSource.SetValue("FrameStart")
+            camera.SequencerSetSave.Execute()
+        camera.SequencerSetStart.SetValue(0)
+        camera.SequencerConfigurationMode.SetValue("Off")
+        camera.SequencerMode.SetValue("On")
+        try:
+            # Lets `tag` read the set of each frame instead of counting frames
+            camera.ChunkModeActive.SetValue(True)
+            camera.ChunkSelector.SetValue("SequencerSetActive")
+            camera.ChunkEnable.SetValue(True)
+        except Exception:
+            pass
+
+    def restore_camera(self, camera):
+        """Turns bracketing off and puts back the exposure and trigger mode."""
+        if self._saved_settings is None:
+            return
+        try:
+            if self.mode == SEQUENCER:
+                camera.SequencerMode.SetValue("Off")
+            camera.TriggerMode.SetValue(self._saved_settings["TriggerMode"])
+            camera.ExposureTime.SetValue(self._saved_settings["ExposureTime"])
+        except Exception:
+            pass
+        self._saved_settings = None
+        self.mode = None
+
+    def trigger(self, camera):
+        """In software mode, sets the exposure of the next frame and triggers it."""
+        if self.mode != SOFTWARE:
+            return
+        index = self._next_index
+        camera.ExposureTime.SetValue(self.exposures[index] * 1000)
+        if camera.WaitForFrameTriggerReady(1000, 0):
+            camera.ExecuteSoftwareTrigger()
+            self._triggered.append(index)
+        self._next_index = (index + 1) % len(self.exposures)
+
+    def tag(self, info: FrameInfo, grab_result=None):
+        """Sets the exposure index and exposure of a grabbed frame."""
+        index = None
+        if self.mode == SOFTWARE:
+            index = self._triggered.pop(0) if self._triggered else None
+        elif self.mode == SEQUENCER:
+            try:
+                index = int(grab_result.ChunkSequencerSetActive.Value)
+            except Exception:
+                # Count frames from the first one, which uses the first set
+                if self._first_id is None:
+                    self._first_id = info.frame_id
+                if info.frame_id is not None and self._first_id is not None:
+                    index = (info.frame_id - self._first_id) % len(self.exposures)
+                else:
+                    index = self._count % len(self.exposures)
+        self._count += 1
+        if index is not None:
+            info.exposure_index = index
+            info.exposure = self.exposures[index]
+
+
+def merge_exposures(
+    stats: list[list[RegionStats]], exposures: list[float], reference: float
+) -> list[int]:
+    """
+    Merges the region statistics of one frame per exposure into a high dynamic
+    range sum per region: the sum the region would have at the `reference`
+    exposure, if no pixel saturated.
+
+    Each exposure gives an estimate of the intensity per millisecond. Regions
+    with saturated pixels underestimate it and are left out, unless every
+    exposure saturates, in which case the shortest one is used. The others
+    are weighted by their exposure, as longer exposures are less noisy.
+    """
+    merged = []
+    shortest = exposures.index(min(exposures))
+    for region in range(len(stats[0])):
+        weighted = 0.0
+        weights = 0.0
+        pixels = 0
+        for regions, exposure in zip(stats, exposures):
+            region_stats = regions[region]
+            if region_stats.mean > 0:
+                pixels = max(pixels, round(region_stats.sum / region_stats.mean))
+            if region_stats.saturated == 0:
+                weighted += region_stats.mean
+                weights += exposure
+        if weights == 0:
+            region_stats = stats[shortest][region]
+            weighted, weights = region_stats.mean, exposures[shortest]
+        merged.append(round(weighted / weights * reference * pixels))
+    return merged
+
+
+@register_analyzer
+class HDRAnalyzer(Analyzer):
+    """
+    Keeps the latest region statistics of every exposure of a bracket. After
+    the last exposure of each bracket it outputs the statistics of the whole
+    bracket ("exposure_stats") and their merge ("hdr"), as sums at the
+    `reference` exposure (by default the exposure set in the config).
+    """
+
+    name = "hdr"
+    inputs = ("stats", "frame_info", "snapshot")
+    outputs = ("exposure_stats", "hdr")
+    saved = ("hdr",)
+
+    def __init__(
+        self, every: int = 1, exposures=(1,), reference: Optional[float] = None, **options
+    ):
+        super().__init__(every)
+        self.exposures = list(exposures)
+        self.reference = reference
+        self.reset()
+
+    def reset(self):
+        self.latest: list[Optional[list[RegionStats]]] = [None] * len(self.exposures)
+
+    def analyze(self, context):
+        index = context["frame_info"].exposure_index
+        if index is None:
+            return {}
+        if index == 0:
+            self.latest = [None] * len(self.exposures)
+        self.latest[index] = context["stats"]
+        if index != len(self.exposures) - 1 or any(stats is None for stats in self.latest):
+            return {}
+        if len({len(stats) for stats in self.latest}) > 1:
+            # The regions changed in the middle of the bracket
+            return {}
+        reference = self.reference
+        if reference is None:
+            reference = context["snapshot"].exposure
+        return {
+            "exposure_stats": list(self.latest),
+            "hdr": merge_exposures(self.latest, self.exposures, reference),
+        }
+
+
+def main():
+    # Example usage: a region that saturates at the longest exposure
+    exposures = [1, 4, 10]
+    analyzer = HDRAnalyzer(exposures=exposures, reference=4)
+    pixels = 10_000
+    for index, exposure in enumerate(exposures):
+        mean = min(20.0 * exposure, 255)
+        saturated = pixels if mean >= 255 else 0
+        stats = RegionStats(round(mean * pixels), mean, round(mean), round(mean), saturated, None)
+        info = FrameInfo(0, exposure_index=index, exposure=exposure)
+        output = analyzer.analyze({"stats": [stats], "frame_info": info})
+    print(f"HDR sum at {analyzer.reference} ms: {output['hdr']}")
+
+
+if __name__ == "__main__":
+    main()
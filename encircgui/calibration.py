@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+import argparse
+import copy
+import json
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from archive import read_column
+from config import DEFAULT_CONFIG_PATH, read_config, validate_config, write_config
+from dataset import DATA_DIR, SessionIndex, iter_records
+from result import Result
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+# Reference data up to this size is read once and kept in memory
+DEFAULT_MEMORY_LIMIT = 256 << 20
+DEFAULT_BINS = 1 << 16
+DEFAULT_ACCEPT_QUANTILE = 0.99
+DEFAULT_INSPECT_QUANTILE = 0.999
+
+
+def _sums_row(record: dict, n_regions: int) -> list[float]:
+    values = (record.get(f"dataSum{i + 1}") for i in range(n_regions))
+    return [np.nan if value is None else value for value in values]
+
+
+class ReferenceData:
+    """
+    Region sums of a set of reference sessions, as chunks of a
+    (frames, regions) float64 array with NaN for missing regions.
+
+    Archived sessions are read a column at a time. Measurement files are
+    streamed. If the data fits in `memory_limit` bytes it is kept after the
+    first pass, otherwise it is read again from disk on every pass.
+    """
+
+    def __init__(
+        self,
+        index: SessionIndex,
+        sessions: list[str],
+        n_regions: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    ):
+        self.paths = index.paths(sessions)
+        self.n_regions = n_regions
+        self.chunk_size = chunk_size
+        self.memory_limit = memory_limit
+        self._cache: Optional[list[np.ndarray]] = None
+
+    def _read(self) -> Iterator[np.ndarray]:
+        for path in self.paths:
+            if path.suffix == ".npz":
+                columns = [read_column(path, f"dataSum{i + 1}") for i in range(self.n_regions)]
+                length = max((len(c) for c in columns if c is not None), default=0)
+                if length:
+                    yield np.column_stack(
+                        [np.full(length, np.nan) if c is None else c for c in columns]
+                    )
+                continue
+            rows = []
+            for _, record in iter_records(path):
+                rows.append(_sums_row(record, self.n_regions))
+                if len(rows) == self.chunk_size:
+                    yield np.array(rows, dtype=np.float64)
+                    rows = []
+            if rows:
+                yield np.array(rows, dtype=np.float64)
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        if self._cache is not None:
+            yield from self._cache
+            return
+        cache = []
+        size = 0
+        for chunk in self._read():
+            if cache is not None:
+                size += chunk.nbytes
+                if size <= self.memory_limit:
+                    cache.append(chunk)
+                else:
+                    cache = None
+            yield chunk
+        self._cache = cache
+
+
+# The values thresholds are set from, for a chunk of region sums
+def _highest_region(chunk: np.ndarray) -> np.ndarray:
+    chunk = chunk[~np.isnan(chunk).all(axis=1)]
+    return np.nanmax(chunk, axis=1) if len(chunk) else chunk[:, 0]
+
+
+def _overall(chunk: np.ndarray) -> np.ndarray:
+    return np.nansum(chunk[~np.isnan(chunk).all(axis=1)], axis=1)
+
+
+def _region(i: int) -> Callable[[np.ndarray], np.ndarray]:
+    return lambda chunk: chunk[:, i][~np.isnan(chunk[:, i])]
+
+
+def streaming_quantiles(
+    data: ReferenceData,
+    series: dict[str, Callable[[np.ndarray], np.ndarray]],
+    quantiles: list[float],
+    bins: int = DEFAULT_BINS,
+) -> dict[str, Optional[list[float]]]:
+    """
+    Quantiles of several series of values derived from the chunks of `data`,
+    in two passes over the data and constant memory: the first pass finds
+    the range of each series, the second counts the values in `bins` equal
+    bins over that range. Quantiles are interpolated within their bin, so
+    they are within (max - min) / bins of the exact ones.
+    """
+    low = {name: math.inf for name in series}
+    high = {name: -math.inf for name in series}
+    for chunk in data.chunks():
+        for name, extract in series.items():
+            values = extract(chunk)
+            if len(values):
+                low[name] = min(low[name], float(values.min()))
+                high[name] = max(high[name], float(values.max()))
+
+    counts = {name: np.zeros(bins, dtype=np.int64) for name in series}
+    for chunk in data.chunks():
+        for name, extract in series.items():
+            values = extract(chunk)
+            if len(values) and high[name] > low[name]:
+                index = ((values - low[name]) * (bins / (high[name] - low[name]))).astype(np.int64)
+                counts[name] += np.bincount(np.minimum(index, bins - 1), minlength=bins)
+            elif len(values):
+                counts[name][0] += len(values)
+
+    results = {}
+    for name in series:
+        total = counts[name].sum()
+        if total == 0:
+            results[name] = None
+            continue
+        width = (high[name] - low[name]) / bins
+        cumulative = np.cumsum(counts[name])
+        ranks = np.asarray(quantiles) * total
+        bin_index = np.minimum(np.searchsorted(cumulative, ranks), bins - 1)
+        before = np.where(bin_index > 0, cumulative[bin_index - 1], 0)
+        inside = counts[name][bin_index]
+        fraction = np.where(inside > 0, (ranks - before) / np.maximum(inside, 1), 0)
+        values = low[name] + (bin_index + np.clip(fraction, 0, 1)) * width
+        results[name] = [float(v) for v in values]
+    return results
+
+
+def predicted_rates(
+    data: ReferenceData, individual: dict, overall: dict
+) -> tuple[dict[str, float], int]:
+    """
+    Fraction of the reference frames that would get each result with these
+    thresholds, and the number of frames.
+    """
+    counts = np.zeros(len(Result), dtype=np.int64)
+    for chunk in data.chunks():
+        highest = _highest_region(chunk)
+        total = _overall(chunk)
+        part = np.where(
+            highest < individual["accept"],
+            Result.ACCEPT,
+            np.where(highest <= individual["inspect"], Result.INSPECT, Result.REJECT),
+        )
+        whole = np.where(
+            total < overall["accept"],
+            Result.ACCEPT,
+            np.where(total <= overall["inspect"], Result.INSPECT, Result.REJECT),
+        )
+        counts += np.bincount(np.maximum(part, whole), minlength=len(Result))
+    frames = int(counts.sum())
+    rates = {
+        result.name: (int(counts[result]) / frames if frames else 0.0)
+        for result in Result
+        if result != Result.NO_BOTTLE
+    }
+    return rates, frames
+
+
+@dataclass
+class Calibration:
+    """Proposed thresholds and what they would do to the reference frames."""
+
+    sessions: list[str]
+    frames: int
+    accept_quantile: float
+    inspect_quantile: float
+    individual: dict
+    overall: dict
+    # Thresholds each region would get on its own, for comparison
+    regions: list[Optional[dict]] = field(default_factory=list)
+    rates: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _thresholds(values: list[float]) -> dict:
+    # Sums are integers, and values equal to "inspect" are still inspected
+    return {"accept": int(math.ceil(values[0])), "inspect": int(math.ceil(values[1]))}
+
+
+def calibrate(
+    data: ReferenceData,
+    sessions: list[str],
+    accept_quantile: float = DEFAULT_ACCEPT_QUANTILE,
+    inspect_quantile: float = DEFAULT_INSPECT_QUANTILE,
+    bins: int = DEFAULT_BINS,
+) -> Calibration:
+    """
+    Sets the "accept" and "inspect" thresholds at the given quantiles of
+    the reference frames: the individual thresholds from the highest region
+    sum of each frame (as every region is classified with them), the
+    overall thresholds from the total of the region sums.
+    """
+    if not 0 < accept_quantile <= inspect_quantile <= 1:
+        raise ValueError("Expected 0 < accept quantile <= inspect quantile <= 1")
+    series = {"highest": _highest_region, "overall": _overall}
+    series.update({f"region{i + 1}": _region(i) for i in range(data.n_regions)})
+    quantiles = streaming_quantiles(data, series, [accept_quantile, inspect_quantile], bins)
+    if quantiles["highest"] is None:
+        raise ValueError(f"No region sums found in sessions {sessions}")
+
+    individual = _thresholds(quantiles["highest"])
+    overall = _thresholds(quantiles["overall"])
+    rates, frames = predicted_rates(data, individual, overall)
+    return Calibration(
+        sessions=list(sessions),
+        frames=frames,
+        accept_quantile=accept_quantile,
+        inspect_quantile=inspect_quantile,
+        individual=individual,
+        overall=overall,
+        regions=[
+            None if region is None else _thresholds(region)
+            for region in (quantiles[f"region{i + 1}"] for i in range(data.n_regions))
+        ],
+        rates=rates,
+    )
+
+
+def quantiles_for_rates(false_reject: float, inspect_rate: float) -> tuple[float, float]:
+    """
+    Quantiles that reject at most `false_reject` and inspect at most
+    `inspect_rate` of the reference frames. A frame is rejected if either its
+    highest region or its total is over the limit, so each gets half the rate.
+    """
+    inspect_quantile = 1 - false_reject / 2
+    accept_quantile = 1 - (false_reject + inspect_rate) / 2
+    return accept_quantile, inspect_quantile
+
+
+def _thresholds_owner(config: dict) -> dict:
+    """The part of `config` whose thresholds are in effect: the active recipe, if it sets them."""
+    recipe = config.get("active_recipe")
+    if recipe is not None and "thresholds" in config["recipes"][recipe]:
+        return config["recipes"][recipe]
+    return config
+
+
+def calibrated_thresholds(config: dict, calibration: Calibration) -> dict:
+    """
+    The thresholds in effect in `config`, with the calibrated ones.
+    Saturation limits are kept.
+    """
+    thresholds = copy.deepcopy(_thresholds_owner(config)["thresholds"])
+    thresholds["individual"].update(calibration.individual)
+    thresholds["overall"] = dict(calibration.overall)
+    return thresholds
+
+
+def with_thresholds(config: dict, calibration: Calibration) -> dict:
+    """Returns a copy of `config` with the calibrated thresholds."""
+    thresholds = calibrated_thresholds(config, calibration)
+    config = copy.deepcopy(config)
+    _thresholds_owner(config)["thresholds"] = thresholds
+    return validate_config(config)
+
+
+def format_calibration(calibration: Calibration) -> str:
+    lines = [
+        f"{calibration.frames} frames from {len(calibration.sessions)} session(s)",
+        f"Quantiles: accept {calibration.accept_quantile:.6g}, "
+        f"inspect {calibration.inspect_quantile:.6g}",
+        f"Individual: accept < {calibration.individual['accept']}, "
+        f"inspect <= {calibration.individual['inspect']}",
+        f"Overall: accept < {calibration.overall['accept']}, "
+        f"inspect <= {calibration.overall['inspect']}",
+    ]
+    for i, region in enumerate(calibration.regions):
+        if region is not None:
+            lines.append(
+                f"  Region {i + 1} on its own: accept < {region['accept']}, "
+                f"inspect <= {region['inspect']}"
+            )
+    lines.append("Predicted results on the reference frames:")
+    for name, rate in calibration.rates.items():
+        lines.append(f"  {name}: {rate:.3%}")
+    return "\n".join(lines)
+
+
+def write_calibration(config: dict, calibration: Calibration, output: Path) -> Path:
+    """
+    Writes the calibrated config to `output` and the report next to it.
+    Returns the report path.
+    """
+    output = Path(output)
+    write_config(with_thresholds(config, calibration), output)
+    report_path = output.with_name(f"{output.stem}_report.json")
+    with open(report_path, "w") as f:
+        json.dump(calibration.to_dict(), f, indent=4)
+    return report_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate thresholds from sessions of good bottles."
+    )
+    parser.add_argument("sessions", nargs="+", help="reference session names")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="data directory")
+    parser.add_argument(
+        "--config", type=Path, default=DEFAULT_CONFIG_PATH, help="config to start from"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="calibrated config to write (default: config_calibrated.json next to --config)",
+    )
+    parser.add_argument("--accept-quantile", type=float, default=DEFAULT_ACCEPT_QUANTILE)
+    parser.add_argument("--inspect-quantile", type=float, default=DEFAULT_INSPECT_QUANTILE)
+    parser.add_argument(
+        "--false-reject",
+        type=float,
+        help="target fraction of good frames rejected, instead of the quantiles",
+    )
+    parser.add_argument(
+        "--inspect-rate",
+        type=float,
+        default=0.01,
+        help="target fraction of good frames inspected, with --false-reject",
+    )
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS, help="histogram bins")
+    args = parser.parse_args()
+
+    accept_quantile, inspect_quantile = args.accept_quantile, args.inspect_quantile
+    if args.false_reject is not None:
+        accept_quantile, inspect_quantile = quantiles_for_rates(
+            args.false_reject, args.inspect_rate
+        )
+
+    config = read_config(args.config)
+    index = SessionIndex(args.data_dir)
+    index.refresh()
+    known = {session.name for session in index.sessions()}
+    missing = [name for name in args.sessions if name not in known]
+    if missing:
+        parser.error(f"Unknown sessions: {', '.join(missing)}")
+
+    data = ReferenceData(index, args.sessions, len(config["regions"]))
+    calibration = calibrate(data, args.sessions, accept_quantile, inspect_quantile, args.bins)
+    print(format_calibration(calibration))
+
+    output = args.output or args.config.with_name("config_calibrated.json")
+    report_path = write_calibration(config, calibration, output)
+    print(f"Saved calibrated config to {output} and report to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+from pathlib import Path
+from typing import Callable, Optional
+
+from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import (
+    QAbstractItemView,
+    QApplication,
+    QDialog,
+    QDoubleSpinBox,
+    QFormLayout,
+    QHBoxLayout,
+    QListWidget,
+    QListWidgetItem,
+    QPlainTextEdit,
+    QPushButton,
+    QVBoxLayout,
+)
+
+from calibration import (
+    Calibration,
+    ReferenceData,
+    calibrate,
+    calibrated_thresholds,
+    format_calibration,
+    quantiles_for_rates,
+    write_calibration,
+)
+from config import ConfigService
+from dataset import DATA_DIR, SessionIndex
+
+
+class CalibrationDialog(QDialog):
+    """
+    Proposes thresholds from sessions of good bottles. The calibration runs
+    on a background thread, so the dialog (and the GUI) stays responsive on
+    long histories. The result can be applied to the running config with
+    `apply`, and is saved as a new config next to the config file of
+    `config_service`. The current config is read each time it is used, so
+    thresholds edited while the dialog is open are kept.
+    """
+
+    def __init__(
+        self,
+        config_service: ConfigService,
+        apply: Optional[Callable[[dict], None]] = None,
+        data_dir: Path = DATA_DIR,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.setWindowTitle("Calibrate thresholds")
+        self.config_service = config_service
+        self.apply = apply
+        self.index = SessionIndex(data_dir)
+        self.calibration: Optional[Calibration] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._future = None
+
+        self.session_list = QListWidget()
+        self.session_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
+        self.false_reject = QDoubleSpinBox()
+        self.false_reject.setDecimals(3)
+        self.false_reject.setRange(0.001, 50)
+        self.false_reject.setValue(0.1)
+        self.false_reject.setSuffix(" %")
+        self.inspect_rate = QDoubleSpinBox()
+        self.inspect_rate.setDecimals(3)
+        self.inspect_rate.setRange(0, 50)
+        self.inspect_rate.setValue(1.0)
+        self.inspect_rate.setSuffix(" %")
+        form = QFormLayout()
+        form.addRow("Good frames rejected", self.false_reject)
+        form.addRow("Good frames inspected", self.inspect_rate)
+
+        self.report = QPlainTextEdit()
+        self.report.setReadOnly(True)
+        self.report.setFont(QFont("Monospace"))
+        self.report.setPlaceholderText("Select the sessions of good bottles to calibrate from")
+
+        self.calibrate_button = QPushButton("Calibrate")
+        self.calibrate_button.clicked.connect(self.start)
+        self.apply_button = QPushButton("Apply")
+        self.apply_button.setEnabled(False)
+        self.apply_button.clicked.connect(self.apply_thresholds)
+        self.close_button = QPushButton("Close")
+        self.close_button.clicked.connect(self.reject)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.calibrate_button)
+        buttons.addWidget(self.apply_button)
+        buttons.addStretch()
+        buttons.addWidget(self.close_button)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.session_list)
+        layout.addLayout(form)
+        layout.addWidget(self.report)
+        layout.addLayout(buttons)
+        self.resize(520, 560)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self._poll)
+        self.load_sessions()
+
+    def load_sessions(self):
+        self.index.refresh()
+        self.session_list.clear()
+        for session in reversed(self.index.sessions()):
+            item = QListWidgetItem(f"{session.name} ({session.count} frames)")
+            item.setData(Qt.UserRole, session.name)
+            self.session_list.addItem(item)
+
+    def selected_sessions(self) -> list[str]:
+        return [item.data(Qt.UserRole) for item in self.session_list.selectedItems()]
+
+    def start(self):
+        sessions = self.selected_sessions()
+        if not sessions:
+            self.report.setPlainText("Select at least one session")
+            return
+        accept_quantile, inspect_quantile = quantiles_for_rates(
+            self.false_reject.value() / 100, self.inspect_rate.value() / 100
+        )
+        regions = self.config_service.snapshot.regions
+        data = ReferenceData(self.index, sessions, len(regions))
+        self._future = self._executor.submit(
+            calibrate, data, sessions, accept_quantile, inspect_quantile
+        )
+        self.calibrate_button.setEnabled(False)
+        self.apply_button.setEnabled(False)
+        self.report.setPlainText(f"Reading {len(sessions)} session(s)...")
+        self.poll_timer.start(100)
+
+    def _poll(self):
+        if not self._future.done():
+            return
+        self.poll_timer.stop()
+        self.calibrate_button.setEnabled(True)
+        # Errors must not escape the Qt slot, which would abort the GUI
+        try:
+            self.calibration = self._future.result()
+        except Exception as e:
+            self.report.setPlainText(f"Calibration failed: {e}")
+            return
+        output = self.config_service.path.with_name("config_calibrated.json")
+        try:
+            report_path = write_calibration(
+                self.config_service.snapshot.to_dict(), self.calibration, output
+            )
+        except Exception as e:
+            self.report.setPlainText(
+                f"{format_calibration(self.calibration)}\n\nCould not save to {output}: {e}"
+            )
+            self.apply_button.setEnabled(self.apply is not None)
+            return
+        self.report.setPlainText(
+            f"{format_calibration(self.calibration)}\n\n"
+            f"Saved to {output}\nReport saved to {report_path}"
+        )
+        self.apply_button.setEnabled(self.apply is not None)
+
+    def apply_thresholds(self):
+        """Applies the calibrated thresholds to the running config."""
+        config = self.config_service.snapshot.to_dict()
+        self.apply({"thresholds": calibrated_thresholds(config, self.calibration)})
+        self.apply_button.setEnabled(False)
+
+    def done(self, result):
+        self.poll_timer.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().done(result)
+
+
+def main():
+    # Example usage:
+    import sys
+
+    app = QApplication(sys.argv)
+    dialog = CalibrationDialog(ConfigService(), print)
+    dialog.show()
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
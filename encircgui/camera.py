@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# Chunk values the camera reports when it does not support them
+_UNAVAILABLE_IDS = (0xFFFFFFFFFFFFFFFF,)
+
+
+@dataclass
+class FrameInfo:
+    """Identity and timing of one grabbed frame."""
+
+    # Host time (time.time_ns) when the frame was retrieved
+    host_timestamp_ns: int
+    # Camera time stamp of the exposure, 0 if the camera does not provide one
+    camera_timestamp: int = 0
+    # Frame counter of the camera (BlockID), None if not supported
+    block_id: Optional[int] = None
+    # Counter of images retrieved by pylon, starting at 1
+    image_number: Optional[int] = None
+    # Images pylon skipped before this one, e.g. because the buffers were full
+    skipped: int = 0
+    # Angle the bottle had turned to, in degrees, when sampling by rotation
+    angle: Optional[float] = None
+    # Position in the exposure bracket, and exposure in ms, when bracketing
+    exposure_index: Optional[int] = None
+    exposure: Optional[float] = None
+    # Camera time stamp in nanoseconds, None if the camera does not provide one
+    camera_time_ns: Optional[int] = None
+    # Significant bits per pixel, from the pixel format
+    bit_depth: int = 8
+
+    @property
+    def frame_id(self) -> Optional[int]:
+        """The best available frame number."""
+        return self.block_id if self.block_id is not None else self.image_number
+
+
+def _read(grab_result, name: str, default=None):
+    try:
+        return getattr(grab_result, name)
+    except Exception:
+        # Not every transport layer supports every field
+        return default
+
+
+def timestamp_tick_ns(camera) -> float:
+    """
+    Nanoseconds per tick of the camera time stamps. GigE cameras report
+    their tick frequency, USB cameras count nanoseconds.
+    """
+    for name in ("GevTimestampTickFrequency", "TimestampTickFrequency"):
+        try:
+            frequency = getattr(camera, name).GetValue()
+        except Exception:
+            continue
+        if frequency > 0:
+            return 1e9 / frequency
+    return 1.0
+
+
+def read_frame_info(
+    grab_result, host_timestamp_ns: Optional[int] = None, tick_ns: float = 1.0
+) -> FrameInfo:
+    """
+    Reads the FrameInfo of a pylon grab result. `tick_ns` is the length of
+    a tick of the camera time stamps, see `timestamp_tick_ns`.
+    """
+    if host_timestamp_ns is None:
+        host_timestamp_ns = time.time_ns()
+    block_id = _read(grab_result, "BlockID")
+    if block_id in _UNAVAILABLE_IDS:
+        block_id = None
+    try:
+        skipped = grab_result.GetNumberOfSkippedImages()
+    except Exception:
+        skipped = 0
+    camera_timestamp = _read(grab_result, "TimeStamp", 0) or 0
+    return FrameInfo(
+        host_timestamp_ns=host_timestamp_ns,
+        camera_timestamp=camera_timestamp,
+        block_id=block_id,
+        image_number=_read(grab_result, "ImageNumber"),
+        skipped=skipped,
+        camera_time_ns=round(camera_timestamp * tick_ns) if camera_timestamp else None,
+    )
+
+
+class DropDetector:
+    """
+    Detects frames that were lost between two grabbed frames.
+
+    The camera's BlockID increases by one for every frame it sends, so a gap
+    counts every frame lost on the way, in the camera, on the wire or on the
+    host. Cameras without a BlockID fall back to the number of images pylon
+    reports as skipped.
+    """
+
+    def __init__(self):
+        self.last_block_id = None
+        self.dropped = 0
+
+    def reset(self):
+        self.last_block_id = None
+        self.dropped = 0
+
+    def check(self, info: FrameInfo) -> int:
+        """Returns the number of frames lost just before `info`."""
+        if info.block_id is not None:
+            if self.last_block_id is None or info.block_id <= self.last_block_id:
+                # First frame, or the camera restarted its counter
+                missing = 0
+            else:
+                missing = info.block_id - self.last_block_id - 1
+            self.last_block_id = info.block_id
+        else:
+            missing = info.skipped
+        self.dropped += missing
+        return missing
+
+
+def main():
+    # Example usage:
+    detector = DropDetector()
+    t0 = time.time_ns()
+    for block_id in [1, 2, 3, 6, 7, 9]:
+        info = FrameInfo(t0 + block_id * 40_000_000, block_id=block_id)
+        missing = detector.check(info)
+        if missing:
+            print(f"Frame {info.frame_id}: {missing} frames lost before it")
+    print(f"{detector.dropped} frames lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,302 @@
 #!/usr/bin/env python
 
 from pathlib import Path
+from types import MappingProxyType
+from dataclasses import dataclass
+from typing import Callable, Optional
+import copy
 import json
+import os
+import tempfile
+import threading
 
 from utils import region_dict, get_config_path
+from pixelformat import BIT_DEPTHS
 
 SCRIPT_DIR = Path(__file__).parent.absolute()
 DEFAULT_CONFIG_PATH = get_config_path()
 
 
+class ConfigError(ValueError):
+    """Raised when a configuration does not match CONFIG_SCHEMA."""
+
+
+_NUMBER = {"type": (int, float)}
+_THRESHOLDS = {
+    "type": dict,
+    "keys": {"accept": _NUMBER, "inspect": _NUMBER},
+    "required": ["accept", "inspect"],
+}
+_INDIVIDUAL_THRESHOLDS = {
+    "type": dict,
+    # Optional limits on the number of saturated pixels in a region
+    "keys": {**_THRESHOLDS["keys"], "saturated": _THRESHOLDS},
+    "required": ["accept", "inspect"],
+}
+_REGION = {
+    "type": dict,
+    "keys": {
+        "x_low": {"type": int, "min": 0},
+        "y_low": {"type": int, "min": 0},
+        "x_high": {"type": int, "min": 0},
+        "y_high": {"type": int, "min": 0},
+    },
+    "required": ["x_low", "y_low", "x_high", "y_high"],
+}
+_INSPECTION_KEYS = {
+    "exposure": {"type": int, "min": 1, "max": 10},
+    "sampletime": {"type": int, "min": 0, "max": 120},
+    # Thresholds on region sums, in the pixel values of the camera's pixel
+    # format: they do not scale with its bit depth
+    "thresholds": {
+        "type": dict,
+        "keys": {"individual": _INDIVIDUAL_THRESHOLDS, "overall": _THRESHOLDS},
+        "required": ["individual", "overall"],
+    },
+    "regions": {"type": list, "items": _REGION, "min_items": 1},
+}
+
+# Schema for config.json. Nodes describe the expected "type", allowed "keys" and
+# "required" keys of objects, "items" of lists and "values" of free-form objects.
+CONFIG_SCHEMA = {
+    "type": dict,
+    "keys": {
+        **_INSPECTION_KEYS,
+        "camera": {
+            "type": dict,
+            "keys": {
+                # Pixel format set on connecting, or null to keep the camera's own
+                "pixel_format": {"type": (str, type(None)), "choices": list(BIT_DEPTHS)},
+            },
+        },
+        "metrics": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                "host": {"type": str},
+                "port": {"type": int, "min": 0, "max": 65535},
+            },
+        },
+        "publisher": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                "transport": {"type": str, "choices": ["udp", "tcp"]},
+                "host": {"type": str},
+                "port": {"type": int, "min": 0, "max": 65535},
+            },
+        },
+        "analysis": {
+            "type": dict,
+            "keys": {
+                "workers": {"type": int, "min": 0},
+                "slots": {"type": int, "min": 1},
+                # On the 8-bit scale, scaled to the bit depth of the pixel format
+                "saturation": {"type": int, "min": 1, "max": 255},
+                "percentile": {"type": (int, float), "min": 0, "max": 100},
+            },
+        },
+        "panorama": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                "rotation_time": {"type": (int, float), "min": 0.1},
+                "columns": {"type": int, "min": 1},
+                "strip_x": {"type": (int, type(None)), "min": 0},
+                "strip_width": {"type": int, "min": 1},
+            },
+        },
+        "rotation_sync": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                "angle_step": {"type": (int, float), "min": 0.01, "max": 360},
+                "rotations": {"type": int, "min": 1},
+                "pacing": {"type": str, "choices": ["camera", "software"]},
+            },
+        },
+        "bracketing": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                # Exposures in ms, cycled through frame by frame
+                "exposures": {
+                    "type": list,
+                    "items": {"type": (int, float), "min": 0.001, "max": 10000},
+                    "min_items": 1,
+                },
+            },
+        },
+        "auto_exposure": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                # Measure every `every` frames, on every `stride`th row and column
+                "every": {"type": int, "min": 1},
+                "stride": {"type": int, "min": 1},
+                # Bring this percentile of the pixels to `target` × the saturation level
+                "percentile": {"type": (int, float), "min": 50, "max": 100},
+                "target": {"type": (int, float), "min": 0.05, "max": 1},
+                # Largest factor of one change, and smallest change made, as a fraction
+                "max_step": {"type": (int, float), "min": 1.01},
+                "deadband": {"type": (int, float), "min": 0, "max": 0.5},
+                # Exposure limits in ms
+                "min_exposure": {"type": (int, float), "min": 0.001},
+                "max_exposure": {"type": (int, float), "min": 0.001},
+            },
+        },
+        "auto_roi": {
+            "type": dict,
+            "keys": {
+                # Re-place the regions every `every` frames to follow the bottle
+                "enabled": {"type": bool},
+                "every": {"type": int, "min": 1},
+                # Reference frames averaged, profiled on every `stride`th row and column
+                "frames": {"type": int, "min": 1},
+                "stride": {"type": int, "min": 1},
+                # Bottle edges: where the profile differs from the background by
+                # `threshold` × its largest difference, of at least `min_contrast`
+                "threshold": {"type": (int, float), "min": 0.05, "max": 1},
+                "min_contrast": {"type": (int, float), "min": 0},
+                # Pixels left between the edges and the regions
+                "margin": {"type": int, "min": 0},
+                # Smallest edge movement, in pixels, that moves the regions when tracking
+                "tolerance": {"type": int, "min": 0},
+            },
+        },
+        "analyzers": {
+            "type": dict,
+            "keys": {
+                # Frame rate of the camera, if it cannot be read from the camera
+                "frame_rate": {"type": (int, float, type(None)), "min": 0.1},
+                "bottle_presence": {
+                    "type": dict,
+                    "keys": {
+                        "enabled": {"type": bool},
+                        "every": {"type": int, "min": 1},
+                        "threshold": {"type": (int, float), "min": 0},
+                        "step": {"type": int, "min": 1},
+                    },
+                },
+                "focus": {
+                    "type": dict,
+                    "keys": {
+                        "enabled": {"type": bool},
+                        "every": {"type": int, "min": 1},
+                    },
+                },
+            },
+        },
+        "service": {
+            "type": dict,
+            "keys": {
+                # Address viewers attach to, see service.py
+                "host": {"type": str},
+                "port": {"type": int, "min": 0, "max": 65535},
+                "preview_fps": {"type": (int, float), "min": 0.1},
+                # Width and height of the preview frames sent to viewers
+                "preview_size": {"type": list, "items": {"type": int, "min": 1}, "min_items": 2},
+            },
+        },
+        "archive": {
+            "type": dict,
+            "keys": {
+                "enabled": {"type": bool},
+                "workers": {"type": int, "min": 1},
+                "retention_days": {"type": (int, float, type(None)), "min": 0},
+                "idle_seconds": {"type": (int, float), "min": 1},
+            },
+        },
+        # Named sets of inspection settings that override the top level ones
+        "recipes": {"type": dict, "values": {"type": dict, "keys": _INSPECTION_KEYS}},
+        "active_recipe": {"type": (str, type(None))},
+    },
+    "required": ["exposure", "sampletime", "thresholds", "regions"],
+}
+
+
+def _validate(value, schema: dict, path: str):
+    expected = schema["type"]
+    # bool is a subclass of int, but is never a valid number here
+    if not isinstance(value, expected) or (
+        isinstance(value, bool) and expected is not bool
+    ):
+        raise ConfigError(f"{path}: expected {expected}, got {value!r}")
+    if value is None:
+        return
+    if "min" in schema and value < schema["min"]:
+        raise ConfigError(f"{path}: {value} is less than {schema['min']}")
+    if "max" in schema and value > schema["max"]:
+        raise ConfigError(f"{path}: {value} is greater than {schema['max']}")
+    if "choices" in schema and value not in schema["choices"]:
+        raise ConfigError(f"{path}: {value!r} is not one of {schema['choices']}")
+    if "keys" in schema:
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ConfigError(f"{path}: missing key {key!r}")
+        for key, item in value.items():
+            if key not in schema["keys"]:
+                raise ConfigError(f"{path}: unknown key {key!r}")
+            _validate(item, schema["keys"][key], f"{path}.{key}")
+    if "values" in schema:
+        for key, item in value.items():
+            _validate(item, schema["values"], f"{path}.{key}")
+    if "items" in schema:
+        if len(value) < schema.get("min_items", 0):
+            raise ConfigError(f"{path}: expected at least {schema['min_items']} items")
+        for i, item in enumerate(value):
+            _validate(item, schema["items"], f"{path}[{i}]")
+
+
+def validate_config(config: dict) -> dict:
+    """Checks `config` against CONFIG_SCHEMA. Raises ConfigError if it is invalid."""
+    _validate(config, CONFIG_SCHEMA, "config")
+
+    sections = [("config", config)]
+    sections += [
+        (f"config.recipes.{name}", recipe)
+        for name, recipe in config.get("recipes", {}).items()
+    ]
+    for path, section in sections:
+        for name, thresholds in section.get("thresholds", {}).items():
+            if thresholds["accept"] > thresholds["inspect"]:
+                raise ConfigError(
+                    f"{path}.thresholds.{name}: accept is greater than inspect"
+                )
+            saturated = thresholds.get("saturated")
+            if saturated is not None and saturated["accept"] > saturated["inspect"]:
+                raise ConfigError(
+                    f"{path}.thresholds.{name}.saturated: accept is greater than inspect"
+                )
+        for i, region in enumerate(section.get("regions", [])):
+            if region["x_low"] > region["x_high"] or region["y_low"] > region["y_high"]:
+                raise ConfigError(f"{path}.regions[{i}]: low corner is above high corner")
+
+    active_recipe = config.get("active_recipe")
+    if active_recipe is not None and active_recipe not in config.get("recipes", {}):
+        raise ConfigError(f"config.active_recipe: unknown recipe {active_recipe!r}")
+    return config
+
+
 def write_config(config: dict, path=None) -> None:
-    """Writes config file. If path is not specified, "config.json" is used."""
+    """
+    Writes config file. If path is not specified, "config.json" is used.
+    The file is written to a temporary file first and then renamed, so readers
+    never see a partially written config.
+    """
     if path is None:
         path = DEFAULT_CONFIG_PATH
-    with open(path, "w") as f:
-        json.dump(config, f, indent=4)
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 def read_config(path=None) -> dict:
@@ -25,6 +307,197 @@ def read_config(path=None) -> dict:
         return json.load(f)
 
 
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Immutable, versioned view of the configuration.
+
+    The inspection settings (exposure, sample time, thresholds, regions) are
+    resolved from the active recipe, falling back to the top level values.
+    """
+
+    version: int
+    raw: MappingProxyType
+    recipe: Optional[str]
+    exposure: int
+    sampletime: int
+    thresholds_individual: MappingProxyType
+    thresholds_overall: MappingProxyType
+    regions: tuple
+
+    @classmethod
+    def from_config(cls, config: dict, version: int) -> "ConfigSnapshot":
+        raw = _freeze(config)
+        recipe = config.get("active_recipe")
+        effective = dict(raw)
+        if recipe is not None:
+            effective.update(raw["recipes"][recipe])
+        return cls(
+            version=version,
+            raw=raw,
+            recipe=recipe,
+            exposure=effective["exposure"],
+            sampletime=effective["sampletime"],
+            thresholds_individual=effective["thresholds"]["individual"],
+            thresholds_overall=effective["thresholds"]["overall"],
+            regions=effective["regions"],
+        )
+
+    @property
+    def recipes(self) -> list[str]:
+        return list(self.raw.get("recipes", {}))
+
+    def to_dict(self) -> dict:
+        return _thaw(self.raw)
+
+
+class ConfigService:
+    """
+    Owns the configuration of a running pipeline.
+
+    The config file is validated when loaded, and watched for changes from a
+    background thread. Every valid change (from the file, from `apply`, or from
+    `select_recipe`) produces a new ConfigSnapshot with a higher version.
+    Readers take `snapshot` once per frame, so a change takes effect atomically
+    at the next frame. Subscribers are called with each new snapshot, from
+    whichever thread made the change. Changes are made one at a time, so
+    subscribers see the snapshots in version order.
+    """
+
+    def __init__(self, path=None, poll_interval: float = 0.5):
+        self.path = Path(path) if path is not None else DEFAULT_CONFIG_PATH
+        self.poll_interval = poll_interval
+        # Held for the whole of each change, including notifying subscribers
+        self._lock = threading.RLock()
+        self._subscribers: list[Callable[[ConfigSnapshot], None]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._file_config = validate_config(read_config(self.path))
+        self._file_signature = self._signature()
+        self._invalid_signature = None
+        self.snapshot = ConfigSnapshot.from_config(self._file_config, 1)
+
+    def _signature(self):
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot], None]):
+        self._subscribers.append(callback)
+
+    def _publish(self, config: dict) -> ConfigSnapshot:
+        with self._lock:
+            snapshot = ConfigSnapshot.from_config(config, self.snapshot.version + 1)
+            self.snapshot = snapshot
+        for callback in self._subscribers:
+            callback(snapshot)
+        return snapshot
+
+    @property
+    def is_modified(self) -> bool:
+        """True if the current snapshot differs from the config file."""
+        return self.snapshot.to_dict() != self._file_config
+
+    def apply(self, changes: dict) -> ConfigSnapshot:
+        """
+        Publishes a snapshot with `changes` applied to the inspection settings,
+        without writing the file. Keys overridden by the active recipe are
+        changed in that recipe. Raises ConfigError if the result is invalid.
+        """
+        with self._lock:
+            config = self.snapshot.to_dict()
+            recipe = config.get("active_recipe")
+            for key, value in changes.items():
+                target = config
+                if recipe is not None and key in config["recipes"][recipe]:
+                    target = config["recipes"][recipe]
+                target[key] = copy.deepcopy(value)
+            if config == self.snapshot.to_dict():
+                return self.snapshot
+            return self._publish(validate_config(config))
+
+    def select_recipe(self, name: Optional[str]) -> ConfigSnapshot:
+        """Switches the active recipe (None for the top level settings)."""
+        with self._lock:
+            config = self.snapshot.to_dict()
+            if config.get("active_recipe") == name:
+                return self.snapshot
+            config["active_recipe"] = name
+            return self._publish(validate_config(config))
+
+    def save(self):
+        """Atomically writes the current snapshot to the config file."""
+        with self._lock:
+            config = self.snapshot.to_dict()
+            write_config(config, self.path)
+            self._file_config = config
+            self._file_signature = self._signature()
+
+    def reload(self) -> bool:
+        """
+        Re-reads the config file if it changed on disk. Invalid files are
+        reported and ignored. Returns True if a new snapshot was published.
+        """
+        try:
+            signature = self._signature()
+        except OSError:
+            # Missing, or being replaced by an editor: try again at the next poll
+            return False
+        with self._lock:
+            if signature in (self._file_signature, self._invalid_signature):
+                return False
+            try:
+                config = validate_config(read_config(self.path))
+            except (OSError, ValueError) as e:
+                # ConfigError and JSONDecodeError are both ValueErrors. The running
+                # config is kept until the file is changed to something valid.
+                print(f"Ignoring invalid config {self.path}: {e}")
+                self._invalid_signature = signature
+                return False
+            self._file_signature = signature
+            unchanged = config == self._file_config
+            self._file_config = config
+            if unchanged:
+                return False
+            print(f"Reloaded config {self.path}")
+            self._publish(config)
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
+
+    def start(self):
+        """Starts watching the config file for changes."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
 def write_default_config():
     # Write default config file
     region1 = region_dict(300, 120, 500, 320)
@@ -42,6 +515,45 @@ def write_default_config():
         "overall": {"accept": 500000, "inspect": 700000}
     }
     data["regions"] = regions
+    data["camera"] = {"pixel_format": None}
+    data["metrics"] = {"enabled": False, "host": "127.0.0.1", "port": 9108}
+    data["publisher"] = {"enabled": False, "transport": "udp", "host": "127.0.0.1", "port": 9200}
+    data["analysis"] = {"workers": 0, "slots": 8, "saturation": 250, "percentile": 99}
+    data["panorama"] = {
+        "enabled": False, "rotation_time": 36.0, "columns": 720, "strip_x": None, "strip_width": 8
+    }
+    data["rotation_sync"] = {"enabled": False, "angle_step": 1.0, "rotations": 1, "pacing": "camera"}
+    data["bracketing"] = {"enabled": False, "exposures": [1, 4, 10]}
+    data["auto_exposure"] = {
+        "enabled": False,
+        "every": 5,
+        "stride": 8,
+        "percentile": 99.5,
+        "target": 0.8,
+        "max_step": 1.5,
+        "deadband": 0.05,
+        "min_exposure": 0.05,
+        "max_exposure": 10,
+    }
+    data["auto_roi"] = {
+        "enabled": False,
+        "every": 1000,
+        "frames": 5,
+        "stride": 4,
+        "threshold": 0.5,
+        "min_contrast": 10,
+        "margin": 8,
+        "tolerance": 10,
+    }
+    data["analyzers"] = {
+        "frame_rate": None,
+        "bottle_presence": {"enabled": False, "every": 1, "threshold": 20, "step": 8},
+        "focus": {"enabled": False, "every": 10},
+    }
+    data["service"] = {
+        "host": "127.0.0.1", "port": 9300, "preview_fps": 15, "preview_size": [768, 160]
+    }
+    data["archive"] = {"enabled": False, "workers": 2, "retention_days": None, "idle_seconds": 60}
     write_config(data)
 
 
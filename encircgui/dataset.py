@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+from result import Result
+from utils import get_data_dir
+
+DATA_DIR = get_data_dir()
+INDEX_FILENAME = ".encirc_index.json"
+# Version 2 buckets the hourly counts on local hours
+INDEX_VERSION = 2
+SESSION_GLOB = "encirc_data_*"
+MEASUREMENT_GLOB = "measurement*.json"
+# Sessions compacted by archive.py
+ARCHIVE_GLOB = "archive/*.npz"
+
+# A seek checkpoint is stored for every CHECKPOINT_EVERY-th record of a file
+CHECKPOINT_EVERY = 256
+
+
+def timestamp_to_ns(value) -> int:
+    """
+    Converts a record timestamp to integer nanoseconds since the epoch.
+    Accepts the "%Y-%m-%d %H:%M:%S.%f" strings written by the GUI, datetimes
+    and integers (already in nanoseconds).
+    """
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    seconds = int(value.replace(microsecond=0).timestamp())
+    return seconds * 10**9 + value.microsecond * 1000
+
+
+def record_timestamp_ns(record: dict) -> int:
+    """Timestamp of a saved record. Older files store it as a string."""
+    if "timestamp_ns" in record:
+        return record["timestamp_ns"]
+    return timestamp_to_ns(record["timestamp"])
+
+
+def ns_to_datetime(value: int) -> datetime.datetime:
+    seconds, ns = divmod(value, 10**9)
+    return datetime.datetime.fromtimestamp(seconds).replace(microsecond=ns // 1000)
+
+
+def hour_start_ns(value: int) -> int:
+    """Start of the local hour containing a timestamp, both in nanoseconds since the epoch."""
+    hour = ns_to_datetime(value).replace(minute=0, second=0, microsecond=0)
+    return int(hour.timestamp()) * 10**9
+
+
+def iter_records(path, offset: Optional[int] = None, chunk_size: int = 1 << 16):
+    """
+    Streams the records of a measurement file (a JSON array of objects) without
+    loading the whole file.
+
+    Yields (offset, record) pairs, where offset is the byte offset of the record
+    in the file. If `offset` is given, parsing starts at that record instead of
+    at the beginning of the array.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "rb") as f:
+        if offset is not None:
+            f.seek(offset)
+        buf_start = f.tell()
+        buf = ""
+        pos = 0
+        eof = False
+        in_array = offset is not None
+
+        while True:
+            # Skip whitespace and separators between records
+            while pos < len(buf) and buf[pos] in " \t\r\n,[":
+                if buf[pos] == "[":
+                    in_array = True
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf) and in_array:
+                try:
+                    record, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield buf_start + pos, record
+                    pos = end
+                    continue
+            elif eof:
+                return
+
+            # Drop the consumed part of the buffer and read the next chunk.
+            # json.dump escapes non-ASCII characters, so characters are bytes.
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf_start += pos
+            buf = buf[pos:] + chunk.decode("ascii")
+            pos = 0
+
+
+def iter_file(path, offset: Optional[int] = None):
+    """
+    Like iter_records, for measurement files or session archives. Records in
+    archives have no offset, as archives are always read whole.
+    """
+    if Path(path).suffix == ".npz":
+        # Imported here, archive.py itself builds on this module
+        from archive import read_records
+
+        return ((None, record) for record in read_records(path))
+    return iter_records(path, offset)
+
+
+@dataclass
+class FileEntry:
+    """Summary of one measurement file, as stored in the index."""
+
+    path: str
+    size: int
+    mtime_ns: int
+    count: int = 0
+    start_ns: Optional[int] = None
+    end_ns: Optional[int] = None
+    results: dict = field(default_factory=dict)
+    # Result counts per hour, keyed by the hour start in nanoseconds
+    hourly: dict = field(default_factory=dict)
+    # [offset, timestamp_ns] pairs used to seek into the file
+    checkpoints: list = field(default_factory=list)
+
+    @property
+    def session(self) -> str:
+        path = Path(self.path)
+        return path.stem if path.suffix == ".npz" else path.parent.name
+
+    def overlaps(self, start_ns: Optional[int], end_ns: Optional[int]) -> bool:
+        if self.count == 0:
+            return False
+        if start_ns is not None and self.end_ns < start_ns:
+            return False
+        if end_ns is not None and self.start_ns > end_ns:
+            return False
+        return True
+
+    def within(self, start_ns: Optional[int], end_ns: Optional[int]) -> bool:
+        if self.count == 0:
+            return False
+        if start_ns is not None and self.start_ns < start_ns:
+            return False
+        if end_ns is not None and self.end_ns > end_ns:
+            return False
+        return True
+
+    def seek_offset(self, start_ns: Optional[int]) -> Optional[int]:
+        """Returns the offset of the last checkpoint at or before `start_ns`."""
+        offset = None
+        if start_ns is None:
+            return offset
+        for checkpoint_offset, checkpoint_ns in self.checkpoints:
+            if checkpoint_ns > start_ns:
+                break
+            offset = checkpoint_offset
+        return offset
+
+
+@dataclass
+class SessionInfo:
+    name: str
+    files: int
+    count: int
+    start: Optional[datetime.datetime]
+    end: Optional[datetime.datetime]
+    results: dict
+
+
+def index_file(path: Path, root: Path) -> FileEntry:
+    """Builds the index entry for a single measurement file in one streaming pass."""
+    stat = path.stat()
+    entry = FileEntry(
+        path=path.relative_to(root).as_posix(),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+    )
+    results = Counter()
+    hourly = {}
+    for offset, record in iter_file(path):
+        ts = record_timestamp_ns(record)
+        if offset is not None and entry.count % CHECKPOINT_EVERY == 0:
+            entry.checkpoints.append([offset, ts])
+        entry.count += 1
+        if entry.start_ns is None or ts < entry.start_ns:
+            entry.start_ns = ts
+        if entry.end_ns is None or ts > entry.end_ns:
+            entry.end_ns = ts
+        result = record.get("result", Result.NO_BOTTLE.name)
+        results[result] += 1
+        hour = str(hour_start_ns(ts))
+        hourly.setdefault(hour, Counter())[result] += 1
+    entry.results = dict(results)
+    entry.hourly = {hour: dict(counts) for hour, counts in hourly.items()}
+    return entry
+
+
+class SessionIndex:
+    """
+    Lightweight index over the measurement sessions in DATA_DIR, including
+    sessions compacted into DATA_DIR/archive.
+
+    The index is cached in DATA_DIR/.encirc_index.json. Calling `refresh`
+    re-stats the measurement files and only re-reads those that were added or
+    changed since the index was last built. Queries use the index to pick the
+    files (and the position within them) that need to be read, and stream the
+    records from those files.
+    """
+
+    def __init__(self, data_dir=None):
+        self.data_dir = Path(data_dir) if data_dir is not None else DATA_DIR
+        self.index_path = self.data_dir / INDEX_FILENAME
+        self.entries: dict[str, FileEntry] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("version") != INDEX_VERSION:
+            return
+        for item in cached.get("files", []):
+            entry = FileEntry(**item)
+            self.entries[entry.path] = entry
+
+    def _save(self):
+        data = {
+            "version": INDEX_VERSION,
+            "files": [entry.__dict__ for entry in self.entries.values()],
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.index_path)
+
+    def refresh(self) -> int:
+        """
+        Brings the index up to date with the files on disk.
+        Returns the number of files that had to be (re)indexed.
+        """
+        if not self.data_dir.exists():
+            return 0
+        seen = set()
+        reindexed = 0
+        paths = sorted(self.data_dir.glob(f"{SESSION_GLOB}/{MEASUREMENT_GLOB}"))
+        # Archived sessions, unless the original files are still there
+        sessions = {path.parent.name for path in paths}
+        paths += [
+            path
+            for path in sorted(self.data_dir.glob(ARCHIVE_GLOB))
+            if path.stem not in sessions
+        ]
+        for path in paths:
+            key = path.relative_to(self.data_dir).as_posix()
+            seen.add(key)
+            stat = path.stat()
+            entry = self.entries.get(key)
+            if (
+                entry is not None
+                and entry.size == stat.st_size
+                and entry.mtime_ns == stat.st_mtime_ns
+            ):
+                continue
+            try:
+                self.entries[key] = index_file(path, self.data_dir)
+            except (ValueError, KeyError) as e:
+                # File is being written or is corrupt, try again next refresh
+                print(f"Could not index {path}: {e}")
+                self.entries.pop(key, None)
+                continue
+            reindexed += 1
+
+        removed = set(self.entries) - seen
+        for key in removed:
+            del self.entries[key]
+
+        if reindexed or removed:
+            self._save()
+        return reindexed
+
+    def _files(self, start_ns=None, end_ns=None, sessions=None) -> list[FileEntry]:
+        files = [
+            entry
+            for entry in self.entries.values()
+            if entry.overlaps(start_ns, end_ns)
+            and (sessions is None or entry.session in sessions)
+        ]
+        return sorted(files, key=lambda entry: (entry.start_ns, entry.path))
+
+    def paths(self, sessions: Optional[list[str]] = None) -> list[Path]:
+        """The files holding the given sessions (all by default), oldest first."""
+        return [self.data_dir / entry.path for entry in self._files(sessions=sessions)]
+
+    def sessions(self) -> list[SessionInfo]:
+        """Summarises every indexed session, oldest first."""
+        grouped: dict[str, list[FileEntry]] = {}
+        for entry in self.entries.values():
+            grouped.setdefault(entry.session, []).append(entry)
+
+        sessions = []
+        for name, entries in sorted(grouped.items()):
+            results = Counter()
+            for entry in entries:
+                results.update(entry.results)
+            starts = [entry.start_ns for entry in entries if entry.count]
+            ends = [entry.end_ns for entry in entries if entry.count]
+            sessions.append(
+                SessionInfo(
+                    name=name,
+                    files=len(entries),
+                    count=sum(entry.count for entry in entries),
+                    start=ns_to_datetime(min(starts)) if starts else None,
+                    end=ns_to_datetime(max(ends)) if ends else None,
+                    results=dict(results),
+                )
+            )
+        return sessions
+
+    def query(
+        self,
+        start=None,
+        end=None,
+        results: Optional[list[str]] = None,
+        sessions: Optional[list[str]] = None,
+    ) -> Iterator[dict]:
+        """
+        Yields the records between `start` and `end` (inclusive), optionally
+        restricted to the given result names and session names.
+
+        Only files whose time range overlaps the query are read, and reading
+        starts from the nearest checkpoint before `start`.
+        """
+        start_ns = timestamp_to_ns(start) if start is not None else None
+        end_ns = timestamp_to_ns(end) if end is not None else None
+        wanted = set(results) if results is not None else None
+
+        for entry in self._files(start_ns, end_ns, sessions):
+            if wanted is not None and not wanted.intersection(entry.results):
+                continue
+            yield from self._read_file(entry, start_ns, end_ns, wanted)
+
+    def _read_file(self, entry: FileEntry, start_ns, end_ns, wanted=None):
+        path = self.data_dir / entry.path
+        for _, record in iter_file(path, entry.seek_offset(start_ns)):
+            ts = record_timestamp_ns(record)
+            if start_ns is not None and ts < start_ns:
+                continue
+            if end_ns is not None and ts > end_ns:
+                # Records within a file are written in time order
+                break
+            if wanted is not None and record.get("result") not in wanted:
+                continue
+            yield record
+
+    def hourly_histogram(
+        self, start=None, end=None, sessions: Optional[list[str]] = None
+    ) -> dict[datetime.datetime, dict[str, int]]:
+        """
+        Counts results per hour between `start` and `end`.
+
+        Files entirely inside the range are answered from the index; only the
+        files at the edges of the range are read.
+        """
+        start_ns = timestamp_to_ns(start) if start is not None else None
+        end_ns = timestamp_to_ns(end) if end is not None else None
+
+        histogram: dict[int, Counter] = {}
+        for entry in self._files(start_ns, end_ns, sessions):
+            if entry.within(start_ns, end_ns):
+                for hour, counts in entry.hourly.items():
+                    histogram.setdefault(int(hour), Counter()).update(counts)
+                continue
+            for record in self._read_file(entry, start_ns, end_ns):
+                ts = record_timestamp_ns(record)
+                hour = hour_start_ns(ts)
+                histogram.setdefault(hour, Counter())[record.get("result")] += 1
+
+        return {
+            ns_to_datetime(hour): dict(counts)
+            for hour, counts in sorted(histogram.items())
+        }
+
+
+def _parse_datetime(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query saved ENCIRC measurement data.")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="data directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("sessions", help="list indexed sessions")
+
+    query_parser = subparsers.add_parser("query", help="print matching records")
+    histogram_parser = subparsers.add_parser("histogram", help="results per hour")
+    for sub in (query_parser, histogram_parser):
+        sub.add_argument("--start", type=_parse_datetime, help="e.g. 2024-10-23T10:00")
+        sub.add_argument("--end", type=_parse_datetime, help="e.g. 2024-10-23T18:00")
+        sub.add_argument("--session", action="append", help="restrict to session")
+    query_parser.add_argument(
+        "--result",
+        action="append",
+        choices=[result.name for result in Result],
+        help="restrict to result (can be repeated)",
+    )
+
+    args = parser.parse_args()
+    index = SessionIndex(args.data_dir)
+    reindexed = index.refresh()
+    print(f"Indexed {len(index.entries)} files ({reindexed} updated)")
+
+    if args.command == "sessions":
+        for session in index.sessions():
+            print(
+                f"{session.name}: {session.count} records, "
+                f"{session.start} - {session.end}, {session.results}"
+            )
+    elif args.command == "query":
+        for record in index.query(args.start, args.end, args.result, args.session):
+            print(json.dumps(record))
+    elif args.command == "histogram":
+        histogram = index.hourly_histogram(args.start, args.end, args.session)
+        for hour, counts in histogram.items():
+            print(f"{hour:%Y-%m-%d %H:00}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
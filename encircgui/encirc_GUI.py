@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import argparse
+import multiprocessing
 import platform
 import ctypes
 import itertools
@@ -8,6 +10,7 @@ import sys
 from pathlib import Path
 import datetime
 import time
+from typing import Optional
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -20,21 +23,44 @@ from pypylon import pylon
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
-from result import Result, combine_results
-from config import read_config, write_config, write_default_config
+from result import Result
+from config import ConfigService, ConfigSnapshot, ConfigError, read_config, write_default_config
 from roi_selector import ROISelector
-from utils import set_qdarkstyle_plot_theme, get_config_path
-from jsonsaver import JSONSaver
+from roi_manager import ROIManager
+from utils import (
+    set_qdarkstyle_plot_theme,
+    get_config_path,
+    get_data_dir,
+    region_color,
+    region_plot_color,
+)
+from trend import TrendView
+from metrics import PipelineMetrics, MetricsServer
+from panorama import Panorama
+from inspection import Inspection
+from pixelformat import to_8bit
+from viewer import RemoteConfig, RemoteRecord, ServiceClient
+from summary import format_summary
+from view_model import ViewModel, ResultLight
+from archive import ArchiveJob
+from profiler import Profiler
+from calibration_dialog import CalibrationDialog
 
 
 SCRIPT_DIR = Path(__file__).parent.absolute()
-DATA_DIR = SCRIPT_DIR.parent / "data"
+DATA_DIR = get_data_dir()
 CONFIG_PATH = get_config_path()
 
 
 class MainApp(QWidget):
-
-    def __init__(self):
+    # Emitted (possibly from the config watcher thread) with each new ConfigSnapshot
+    config_changed = pyqtSignal(object)
+
+    def __init__(
+        self,
+        profile_seconds: Optional[float] = None,
+        service_address: Optional[tuple[str, int]] = None,
+    ):
         super().__init__()
 
         # Set style as qdarkstyle, and set plot them to match
@@ -44,8 +70,17 @@ class MainApp(QWidget):
         if not CONFIG_PATH.exists():
             write_default_config()
 
-        # Read initial config
-        self.initial_config: dict = read_config()
+        # Read initial config. The config service validates it, and publishes a
+        # new snapshot whenever the file or the settings in the GUI change.
+        # When attached to the inspection service, the config belongs to the
+        # service and the GUI only views its results.
+        self.client = None
+        if service_address is not None:
+            self.client = ServiceClient(*service_address)
+            self.config_service = RemoteConfig(self.client)
+        else:
+            self.config_service = ConfigService(CONFIG_PATH)
+        self._applying_config = False
 
         self.video_size = QSize(160, 768)
         self.camera_listbox_size = QSize(120, 400)
@@ -53,35 +88,91 @@ class MainApp(QWidget):
         self.ax = self.canvas.figure.subplots()
         self.setWindowTitle("ENCIRC")
         self.setWindowIcon(QIcon(str(SCRIPT_DIR / "i3dr_logo.png")))
+        # Inspection results are shown through the view model, which only
+        # updates widgets that changed, at most 30 times a second
+        self.view_model = ViewModel(30, self)
         self.setup_ui()
-        self.full_rotation_time = 36.0
-
-        self.camera = None
-        self.inspection_part = Result.NO_BOTTLE
-        self.inspection_ROI = Result.NO_BOTTLE
-        
-        self.max_dataSum1 = 0
-        self.max_dataSum2 = 0
-        self.max_dataSum3 = 0
-        self.max_dataSum4 = 0
 
-        self.jsonsaver = None
+        self._last_roi_image_time = 0.0
+        self._last_panorama_time = 0.0
+
+        # Metrics are always collected, the HTTP endpoint is optional
+        self.metrics = PipelineMetrics()
+        self.metrics_server = None
+        initial_config = self.config_service.snapshot.raw
+        metrics_config = initial_config.get("metrics", {})
+        if metrics_config.get("enabled", False) and self.client is None:
+            self.metrics_server = MetricsServer(
+                self.metrics.registry,
+                metrics_config.get("host", "127.0.0.1"),
+                metrics_config.get("port", 9108),
+            )
+            self.metrics_server.start()
+
+        # Inspect in the GUI process, unless attached to the inspection service
+        self.inspection = None
+        self.pipeline = None
+        self.preview = None
+        if self.client is None:
+            self.inspection = Inspection(self.config_service, self.metrics, DATA_DIR)
+            self.pipeline = self.inspection.pipeline
+            bracket = self.inspection.bracket
+            self.bracket_exposures = None if bracket is None else bracket.exposures
+            self.auto_exposure = self.inspection.auto_exposure is not None
+        else:
+            self.preview = self.client.preview_reader()
+            bracketing_config = initial_config.get("bracketing", {})
+            self.bracket_exposures = None
+            if bracketing_config.get("enabled", False):
+                self.bracket_exposures = list(bracketing_config["exposures"])
+            self.auto_exposure = self.bracket_exposures is None and initial_config.get(
+                "auto_exposure", {}
+            ).get("enabled", False)
+            self.show_service()
+        self.bracket_sums = []
+        if self.bracket_exposures is not None:
+            self.trend_view.set_series(*self.trend_series())
+
+        if self.pipeline is not None and self.pipeline.panorama is not None:
+            self.panorama_label = QLabel()
+            self.panorama_label.setAlignment(Qt.AlignCenter)
+            self.panorama_label.setMinimumSize(1, 1)
+            self.graph_tabs.addTab(self.panorama_label, "Panorama")
+
+        # Archive finished sessions in the background while the camera is idle
+        self.archive_config = initial_config.get("archive", {})
+        self.archive_job = None
+        if self.archive_config.get("enabled", False) and self.inspection is not None:
+            self.archive_timer = QTimer(self)
+            self.archive_timer.timeout.connect(self.archive_when_idle)
+            self.archive_timer.start(int(self.archive_config.get("idle_seconds", 60) * 1000))
+
+        # Profiling on demand, or from the start of the first session
+        self.profiler = Profiler()
+        self.profile_dir = None
+        self.profile_on_start = profile_seconds
+
+        self.config_changed.connect(self.apply_config_snapshot)
+        self.config_service.subscribe(self.config_changed.emit)
+        self.config_service.start()
 
     def setup_ui(self):
         """Initialize widgets."""
         self.image_labelL = QLabel()
         self.image_labelL.setFixedSize(self.video_size)
 
-        initial_exposure = int(self.initial_config["exposure"])
-        initial_sampletime = int(self.initial_config["sampletime"])
-        self.thresholds_individual = self.initial_config["thresholds"]["individual"]
-        self.thresholds_overall = self.initial_config["thresholds"]["overall"]
+        snapshot = self.config_service.snapshot
+        initial_exposure = snapshot.exposure
+        initial_sampletime = snapshot.sampletime
 
         self.slider = QSlider(Qt.Horizontal, self)
         self.slider.setRange(1, 10)
         self.slider.setValue(initial_exposure)
         self.slider.setGeometry(0, 0, 120, 80)
         self.slider.valueChanged[int].connect(self.changeValue)
+        self.slider.valueChanged[int].connect(
+            lambda value: self.apply_config_changes({"exposure": value})
+        )
 
         self.exposureValue = QLabel(self)
         self.exposureValue.setText(str(initial_exposure))
@@ -97,6 +188,7 @@ class MainApp(QWidget):
         )  # Allow expansion
 
         self.getCameraList()
+        self.n_regions = len(snapshot.regions)
         self.reset_graphdata()
 
         self.cameraRefreshBtn = QPushButton("Refresh List")
@@ -107,14 +199,31 @@ class MainApp(QWidget):
         self.cameraConnectBtn.clicked.connect(self.control_camera)
         self.cameraStatusText = QLabel(self)
         self.cameraStatusText.setText("No camera connected")
+        self.exposureUsedText = QLabel(self)
+        self.view_model.bind(
+            "exposure_used",
+            lambda value: self.exposureUsedText.setText(f"Auto-exposure: {value:.3f} ms"),
+        )
+        self.droppedText = QLabel(self)
+        self.view_model.bind(
+            "dropped",
+            lambda value: self.droppedText.setText(f"Dropped frames: {value}" if value else ""),
+        )
         self.processTimerText = QLabel(self)
         self.processTimerText.setText("Time elapsed: 0.00 s")
+        self.view_model.bind(
+            "elapsed",
+            lambda value: self.processTimerText.setText(f"Time elapsed: {value:.2f} s"),
+        )
         self.sampleTimeText = QLabel(self)
         self.sampleTimeText.setText("Set sample time in sec")
         self.sampleTimeValue = QSpinBox(self)
         self.sampleTimeValue.setSingleStep(1)
         self.sampleTimeValue.setRange(0, 120)
         self.sampleTimeValue.setValue(initial_sampletime)
+        self.sampleTimeValue.valueChanged[int].connect(
+            lambda value: self.apply_config_changes({"sampletime": value})
+        )
         self.secondText = QLabel(self)
         self.secondText.setText("seconds")
 
@@ -122,36 +231,7 @@ class MainApp(QWidget):
         self.clearBtn.setStyleSheet("background-color: green")
         self.clearBtn.clicked.connect(self.clear_graph)
 
-        self.bottlePartBtn = QPushButton(" ")
-        self.bottlePartBtn.setFixedSize(QSize(100, 100))
-        self.bottlePart2Btn = QPushButton(" ")
-        self.bottlePart2Btn.setFixedSize(QSize(100, 100))
-        self.bottlePart3Btn = QPushButton(" ")
-        self.bottlePart3Btn.setFixedSize(QSize(100, 100))
-        self.bottlePart4Btn = QPushButton(" ")
-        self.bottlePart4Btn.setFixedSize(QSize(100, 100))
-        self.bottleAllBtn = QPushButton(" ")
-        self.bottleAllBtn.setFixedSize(QSize(100, 100))
-        self.bottlePart1Text = QLabel(self)
-        self.bottlePart1Text.setText("Region 1")
-        self.bottlePart1MaxText = QLabel(self)
-        self.bottlePart1MaxText.setText("Highest Intensity 1")
-        self.bottlePart1MaxValue = QLabel(self)
-        self.bottlePart2Text = QLabel(self)
-        self.bottlePart2Text.setText("Region 2")
-        self.bottlePart2MaxText = QLabel(self)
-        self.bottlePart2MaxText.setText("Highest Intensity 2")
-        self.bottlePart2MaxValue = QLabel(self)
-        self.bottlePart3Text = QLabel(self)
-        self.bottlePart3Text.setText("Region 3")
-        self.bottlePart3MaxText = QLabel(self)
-        self.bottlePart3MaxText.setText("Highest Intensity 3")
-        self.bottlePart3MaxValue = QLabel(self)
-        self.bottlePart4Text = QLabel(self)
-        self.bottlePart4Text.setText("Region 4")
-        self.bottlePart4MaxText = QLabel(self)
-        self.bottlePart4MaxText.setText("Highest Intensity 4")
-        self.bottlePart4MaxValue = QLabel(self)
+        self.bottleAllLight = ResultLight(100)
         self.bottleAllText = QLabel(self)
         self.bottleAllText.setText("Whole Bottle")
         self.recommendationText = QLabel(self)
@@ -160,11 +240,30 @@ class MainApp(QWidget):
         self.targetRegionText = QLabel(self)
         self.targetRegionText.setText("Target Region: ")
         self.regionText = QLabel(self)
+        self.view_model.bind("overall", self.bottleAllLight.set_result)
+        self.view_model.bind(
+            "recommendation",
+            lambda result: self.recommendedText.setText(result.name.replace("_", " ").title()),
+        )
+        self.view_model.bind("target_regions", self.regionText.setText)
 
         self.main_layout = QHBoxLayout()
         self.image_display = QHBoxLayout()
         self.image_display.addWidget(self.image_labelL)
-        self.image_display.addWidget(self.canvas)
+        self.trend_view = TrendView(
+            [f"Region {i + 1}" for i in range(self.n_regions)],
+            [region_plot_color(i) for i in range(self.n_regions)],
+        )
+        self.roi_manager = ROIManager()
+        self.roi_manager.set_rois(snapshot.regions)
+        self.roi_manager.roisChanged.connect(
+            lambda rois: self.apply_config_changes({"regions": rois})
+        )
+        self.graph_tabs = QTabWidget()
+        self.graph_tabs.addTab(self.canvas, "Live")
+        self.graph_tabs.addTab(self.trend_view, "Trend")
+        self.graph_tabs.addTab(self.roi_manager, "ROI Editor")
+        self.image_display.addWidget(self.graph_tabs)
 
         self.devicelist_layout = QVBoxLayout()
         self.devicelist_layout.addWidget(self.cameraRefreshBtn)
@@ -180,12 +279,46 @@ class MainApp(QWidget):
         self.feature_layout = QVBoxLayout()
         self.feature_layout.addLayout(self.exposure_display)
         self.feature_layout.addWidget(self.slider)
+        self.feature_layout.addWidget(self.exposureUsedText)
         self.feature_layout.addWidget(self.clearBtn)
 
         self.show_rois_checkbox = QCheckBox("Show ROIs")
         self.show_rois_checkbox.setChecked(False)  # Default to unchecked
         self.feature_layout.addWidget(self.show_rois_checkbox)
 
+        self.recipeText = QLabel(self)
+        self.recipeText.setText("Recipe")
+        self.recipeCombo = QComboBox(self)
+        self.recipeCombo.addItem("(default)")
+        self.recipeCombo.addItems(snapshot.recipes)
+        if snapshot.recipe is not None:
+            self.recipeCombo.setCurrentText(snapshot.recipe)
+        self.recipeCombo.currentIndexChanged.connect(self.select_recipe)
+        self.recipe_layout = QHBoxLayout()
+        self.recipe_layout.addWidget(self.recipeText)
+        self.recipe_layout.addWidget(self.recipeCombo)
+        self.feature_layout.addLayout(self.recipe_layout)
+
+        self.profileSeconds = QSpinBox(self)
+        self.profileSeconds.setRange(1, 600)
+        self.profileSeconds.setValue(10)
+        self.profileSeconds.setSuffix(" s")
+        self.profileBtn = QPushButton("Profile")
+        self.profileBtn.setToolTip("Profile the next N seconds and save the results")
+        self.profileBtn.clicked.connect(lambda: self.start_profile(self.profileSeconds.value()))
+        self.calibrateBtn = QPushButton("Calibrate thresholds...")
+        self.calibrateBtn.clicked.connect(self.show_calibration)
+        self.feature_layout.addWidget(self.calibrateBtn)
+        self.autoRoiBtn = QPushButton("Auto ROI")
+        self.autoRoiBtn.setToolTip("Place the regions on the bottle, from the next few frames")
+        self.autoRoiBtn.clicked.connect(self.auto_roi)
+        self.feature_layout.addWidget(self.autoRoiBtn)
+
+        self.profile_layout = QHBoxLayout()
+        self.profile_layout.addWidget(self.profileBtn)
+        self.profile_layout.addWidget(self.profileSeconds)
+        self.feature_layout.addLayout(self.profile_layout)
+
         self.devicelist_layout.addLayout(self.feature_layout)
 
         self.time_display_layout = QHBoxLayout()
@@ -196,46 +329,21 @@ class MainApp(QWidget):
 
         self.image_display_layout = QVBoxLayout()
         self.image_display_layout.addWidget(self.cameraStatusText)
+        self.image_display_layout.addWidget(self.droppedText)
         self.image_display_layout.addLayout(self.time_display_layout)
         self.image_display_layout.addLayout(self.image_display)
         self.image_display_layout.addWidget(self.save_msg)
 
         self.inspect_layout = QVBoxLayout()
-        self.part1_layout = QHBoxLayout()
-        self.part1Text_layout = QVBoxLayout()
-        self.part1Text_layout.addWidget(self.bottlePart1MaxText)
-        self.part1Text_layout.addWidget(self.bottlePart1MaxValue)
-        self.part1_layout.addWidget(self.bottlePart1Text)
-        self.part1_layout.addLayout(self.part1Text_layout)
-        self.part1_layout.addWidget(self.bottlePartBtn)
-        self.inspect_layout.addLayout(self.part1_layout)
-        self.part2_layout = QHBoxLayout()
-        self.part2Text_layout = QVBoxLayout()
-        self.part2Text_layout.addWidget(self.bottlePart2MaxText)
-        self.part2Text_layout.addWidget(self.bottlePart2MaxValue)
-        self.part2_layout.addWidget(self.bottlePart2Text)
-        self.part2_layout.addLayout(self.part2Text_layout)
-        self.part2_layout.addWidget(self.bottlePart2Btn)
-        self.inspect_layout.addLayout(self.part2_layout)
-        self.part3_layout = QHBoxLayout()
-        self.part3Text_layout = QVBoxLayout()
-        self.part3Text_layout.addWidget(self.bottlePart3MaxText)
-        self.part3Text_layout.addWidget(self.bottlePart3MaxValue)
-        self.part3_layout.addWidget(self.bottlePart3Text)
-        self.part3_layout.addLayout(self.part3Text_layout)
-        self.part3_layout.addWidget(self.bottlePart3Btn)
-        self.inspect_layout.addLayout(self.part3_layout)
-        self.part4_layout = QHBoxLayout()
-        self.part4Text_layout = QVBoxLayout()
-        self.part4Text_layout.addWidget(self.bottlePart4MaxText)
-        self.part4Text_layout.addWidget(self.bottlePart4MaxValue)
-        self.part4_layout.addWidget(self.bottlePart4Text)
-        self.part4_layout.addLayout(self.part4Text_layout)
-        self.part4_layout.addWidget(self.bottlePart4Btn)
-        self.inspect_layout.addLayout(self.part4_layout)
+        self.regions_layout = QVBoxLayout()
+        self.region_rows = []
+        self.region_lights = []
+        self.region_max_values = []
+        self._build_region_rows(self.n_regions)
+        self.inspect_layout.addLayout(self.regions_layout)
         self.ROI_layout = QHBoxLayout()
         self.ROI_layout.addWidget(self.bottleAllText)
-        self.ROI_layout.addWidget(self.bottleAllBtn)
+        self.ROI_layout.addWidget(self.bottleAllLight)
         self.inspect_layout.addLayout(self.ROI_layout)
         self.recommendation_layout = QHBoxLayout()
         self.recommendation_layout.addWidget(self.recommendationText)
@@ -246,10 +354,13 @@ class MainApp(QWidget):
         self.targetRegion_layout.addWidget(self.regionText)
         self.inspect_layout.addLayout(self.targetRegion_layout)
 
-        self.roi_selector = ROISelector()
+        self.roi_selector = ROISelector(count=self.n_regions)
         self.inspect_layout.addWidget(self.roi_selector)
         # Set default values using the values in self.config
-        self.roi_selector.set_rois(self.initial_config["regions"])
+        self.roi_selector.set_rois(list(snapshot.regions))
+        self.roi_selector.roisChanged.connect(
+            lambda rois: self.apply_config_changes({"regions": rois})
+        )
 
         self.main_layout.addLayout(self.devicelist_layout, 1)
         self.main_layout.addLayout(self.image_display_layout, 4)
@@ -257,7 +368,73 @@ class MainApp(QWidget):
 
         self.setLayout(self.main_layout)
 
+    def _build_region_rows(self, count: int):
+        """(Re)creates the result light and highest intensity for each region."""
+        for i, row in enumerate(self.region_rows):
+            self.view_model.unbind(f"region{i}")
+            self.view_model.unbind(f"max{i}")
+            self.regions_layout.removeWidget(row)
+            row.deleteLater()
+        self.region_rows = []
+        self.region_lights = []
+        self.region_max_values = []
+        for i in range(count):
+            row = QWidget()
+            part_layout = QHBoxLayout()
+            part_layout.setContentsMargins(0, 0, 0, 0)
+            partText_layout = QVBoxLayout()
+            partText = QLabel(f"Region {i + 1}")
+            partMaxText = QLabel(f"Highest Intensity {i + 1}")
+            partMaxValue = QLabel()
+            partLight = ResultLight(100)
+            partText_layout.addWidget(partMaxText)
+            partText_layout.addWidget(partMaxValue)
+            part_layout.addWidget(partText)
+            part_layout.addLayout(partText_layout)
+            part_layout.addWidget(partLight)
+            row.setLayout(part_layout)
+            self.regions_layout.addWidget(row)
+            self.region_rows.append(row)
+            self.region_lights.append(partLight)
+            self.region_max_values.append(partMaxValue)
+            self.view_model.bind(f"region{i}", partLight.set_result)
+            self.view_model.bind(f"max{i}", lambda value, label=partMaxValue: label.setText(str(value)))
+
+    def set_region_count(self, count: int):
+        """Resizes the region display, plots and statistics for `count` regions."""
+        if count == self.n_regions:
+            return
+        self.n_regions = count
+        self._build_region_rows(count)
+        self.reset_graphdata()
+        self.canvas.draw()
+        self.trend_view.set_series(*self.trend_series())
+
+    def trend_series(self) -> tuple[list, list, list]:
+        """
+        Labels, colors and line styles of the trend series: the sum of each
+        region, or when bracketing, its sum at each exposure and its HDR sum.
+        """
+        regions = range(self.n_regions)
+        if self.bracket_exposures is None:
+            labels = [f"Region {i + 1}" for i in regions]
+            return labels, [region_plot_color(i) for i in regions], ["-"] * len(labels)
+        labels, colors, styles = [], [], []
+        for exposure, style in zip(self.bracket_exposures, itertools.cycle([":", "--", "-."])):
+            labels += [f"Region {i + 1} @ {exposure} ms" for i in regions]
+            colors += [region_plot_color(i) for i in regions]
+            styles += [style] * self.n_regions
+        labels += [f"Region {i + 1} HDR" for i in regions]
+        colors += [region_plot_color(i) for i in regions]
+        styles += ["-"] * self.n_regions
+        return labels, colors, styles
+
     def control_camera(self):
+        if self.client is not None:
+            # The button follows the session messages of the service
+            self.cameraConnectBtn.setChecked(not self.cameraConnectBtn.isChecked())
+            self.client.send("stop" if self.cameraConnectBtn.isChecked() else "start")
+            return
         if not self.device_list:
             self.cameraStatusText.setText("No devices to connect to.")
             return
@@ -275,201 +452,239 @@ class MainApp(QWidget):
         else:
             self.cameraConnectBtn.setText("Start")
             self.cameraConnectBtn.setStyleSheet("background-color: green")
-            self.max_dataSum1 = 0
-            self.max_dataSum2 = 0
-            self.max_dataSum3 = 0
-            self.max_dataSum4 = 0
+            self.max_sums = [0] * self.n_regions
 
     def setup_camera(self):
         """Initialize camera."""
-        if self.camera is not None:
+        if self.inspection.connected:
             self.cameraStatusText.setText("Camera already connected.")
             return
         device_info = self.device_connected
         camera_name = device_info.GetUserDefinedName()
         self.cameraStatusText.setText(camera_name + " Connected")
 
-        # Create stereo camera device information from parameters
-        self.camera = pylon.InstantCamera(self.tlFactory.CreateDevice(device_info))
-        self.camera.Open()
-        self.camera.StartGrabbing()
+        if self.archive_job is not None:
+            # Leave the CPU to the inspection, the job resumes when idle again
+            self.archive_job.stop()
+        # Opens the camera, starts grabbing and starts the saving
+        self.inspection.connect(device_info)
+        self.bracket_sums = [None] * len(self.bracket_exposures or ())
 
         self.timer = QTimer()
-        self.start = time.time()
         self.timer.timeout.connect(self.display_video_stream)
         self.timer.start(0)
 
-        # Start the saving
-        now = datetime.datetime.now().strftime(r"%Y%m%d_%H%M%S")
-        path = DATA_DIR / f"encirc_data_{now}" / "measurement"
-        self.jsonsaver = JSONSaver(str(path))
-
-    @staticmethod
-    def _get_region(array: np.ndarray, roi: dict) -> np.ndarray:
-        return array[roi["y_low"] : roi["y_high"], roi["x_low"] : roi["x_high"]]
+        if self.profile_on_start:
+            self.start_profile(self.profile_on_start)
+            self.profile_on_start = None
 
     def _plot_canvas(self):
-        (line1,) = self.ax.plot(self.t, self.s1, color="red", label="Region 1")
-        (line2,) = self.ax.plot(self.t, self.s2, color="green", label="Region 2")
-        (line3,) = self.ax.plot(self.t, self.s3, color="blue", label="Region 3")
-        (line4,) = self.ax.plot(self.t, self.s4, color="yellow", label="Region 4")
-        self.ax.legend(
-            handles=[line1, line2, line3, line4], loc="upper right"
-        ).set_visible(True)
+        lines = []
+        for i, series in enumerate(self.series):
+            (line,) = self.ax.plot(
+                self.t, series, color=region_plot_color(i), label=f"Region {i + 1}"
+            )
+            lines.append(line)
+        self.ax.legend(handles=lines, loc="upper right").set_visible(True)
 
         self.canvas.draw()
 
     def display_video_stream(self):
         """Read frame from camera and repaint QLabel widget."""
-
-        # Create variables to store save data
-        data_dict = {}
-        
-        time_elapsed = float(time.time()-self.start)
-        self.processTimerText.setText("Time elapsed: "+str("%.2f" % time_elapsed)+" s")
+        self.view_model.set("elapsed", round(self.inspection.elapsed, 2))
 
         try:
-            timestamp = datetime.datetime.now().strftime(r"%Y-%m-%d %H:%M:%S.%f")
-
-            exposure_slider = self.slider.value()
-            self.camera.ExposureTime.SetValue(exposure_slider * 1000)
-
-            sample_time = self.sampleTimeValue.value()
-
-            read_result = self.camera.RetrieveResult(
-                5000
-            )
-
-            if read_result.GrabSucceeded():
-                self.ax.cla()
-                self.ax = self.insert_ax(self.ax)
-                frame = read_result.Array
-
-                if not read_result.IsValid:
+            grab = self.inspection.grab()
+            if grab is not None:
+                t_inspected = time.perf_counter()
+                self.view_model.set("dropped", self.pipeline.summary.dropped)
+                if not grab.valid:
                     self.cameraStatusText.setText("Failed to read from camera")
 
-                frameROI = frame[400:800, :]
-
-                # get ROI from the selector
-                rois = self.roi_selector.get_rois()
-
-                self.sample1 = self._get_region(frameROI, rois[0])
-                self.sample2 = self._get_region(frameROI, rois[1])
-                self.sample3 = self._get_region(frameROI, rois[2])
-                self.sample4 = self._get_region(frameROI, rois[3])
-
-                # Convert to BGR if the image is grayscale
-                if (
-                    len(frameROI.shape) == 2
-                ):  # Check if the image is grayscale (single channel)
-                    frameROI_display = cv2.cvtColor(
-                        frameROI, cv2.COLOR_GRAY2BGR
-                    )  # Convert to BGR
-                elif(
-                    frameROI.shape[2] == 2
-                ): # Check if it is a dart camera
-                    frameROI_display = cv2.cvtColor(
-                        frameROI[:,:,0], cv2.COLOR_GRAY2BGR
-                    )  #Convert 1st channel to BGR
-                else:
-                    frameROI_display = frameROI.copy()
-
-                # Draw the rectangles for each ROI (using the coordinates from rois)
-                if self.show_rois_checkbox.isChecked():
-                    colors = [
-                        (0, 0, 255),
-                        (0, 255, 0),
-                        (255, 0, 0),
-                        (0, 255, 255),
-                    ]  # Red, Green, Blue, Yellow
-                    thickness = 2
-                    rois = self.roi_selector.get_rois()
-
-                    for i, roi in enumerate(rois):
-                        cv2.rectangle(
-                            frameROI_display,
-                            (roi["x_low"], roi["y_low"]),
-                            (roi["x_high"], roi["y_high"]),
-                            colors[i],
-                            thickness,
-                        )
-                frameROI_display = cv2.resize(frameROI_display, (768, 160))
-                frame_display = np.rot90(frameROI_display, 1)
-                frame_display_rgb = cv2.cvtColor(frame_display, cv2.COLOR_BGR2RGB)
-                image = qimage2ndarray.array2qimage(frame_display_rgb)
-                self.image_labelL.setPixmap(QPixmap.fromImage(image))
-
-                self.s1, dataSum1 = self.shiftdata(self.s1, self.sample1)
-                self.s2, dataSum2 = self.shiftdata(self.s2, self.sample2)
-                self.s3, dataSum3 = self.shiftdata(self.s3, self.sample3)
-                self.s4, dataSum4 = self.shiftdata(self.s4, self.sample4)
-                
-                self.max_dataSum1 = self.maxData(dataSum1, self.max_dataSum1)
-                self.max_dataSum2 = self.maxData(dataSum2, self.max_dataSum2)
-                self.max_dataSum3 = self.maxData(dataSum3, self.max_dataSum3)
-                self.max_dataSum4 = self.maxData(dataSum4, self.max_dataSum4)
-
-                self.bottlePart1MaxValue.setText(str(self.max_dataSum1))
-                self.bottlePart2MaxValue.setText(str(self.max_dataSum2))
-                self.bottlePart3MaxValue.setText(str(self.max_dataSum3))
-                self.bottlePart4MaxValue.setText(str(self.max_dataSum4))
-
-                self._plot_canvas()
-
-                region1_result = self.part_inspection(dataSum1)
-                region2_result = self.part_inspection(dataSum2)
-                region3_result = self.part_inspection(dataSum3)
-                region4_result = self.part_inspection(dataSum4)
-
-                self.part_inspection_display(
-                    np.max(
-                        [
-                            region1_result.value,
-                            region2_result.value,
-                            region3_result.value,
-                            region4_result.value,
-                        ]
-                    )
-                )
-                self.target_region_display(
-                    region1_result, region2_result, region3_result, region4_result
-                )
-
-                self.ROI_inspection(dataSum1 + dataSum2 + dataSum3 + dataSum4)
-                inspection_result = combine_results(
-                    [self.inspection_part, self.inspection_ROI]
-                )
-                self.recommendedText.setText(
-                    inspection_result.name.replace("_", " ").title()
-                )
-
-                # Add data to dict to be saved as json
+                self.show_image(grab.image, grab.snapshot.regions)
+                self.show_records(grab.records)
+                t_displayed = time.perf_counter()
+                self.metrics.observe_stage("display", t_displayed - t_inspected)
 
-                data_dict["timestamp"] = timestamp
-                data_dict["exposure"] = exposure_slider
-                data_dict["sampletime"] = sample_time
-                data_dict["dataSum1"] = int(dataSum1)
-                data_dict["dataSum2"] = int(dataSum2)
-                data_dict["dataSum3"] = int(dataSum3)
-                data_dict["dataSum4"] = int(dataSum4)
-                data_dict["result"] = inspection_result.name
-                self.jsonsaver.add_data(data_dict)
+                self.refresh_views(grab.image)
+                self.metrics.observe_stage("plot", time.perf_counter() - t_displayed)
 
-                if time_elapsed > float(sample_time):
-                    self.disconnect_camera()
-                    self.set_connect_button(connected=False)
-
-            read_result.Release()
+            if self.inspection.sampling_finished():
+                self.disconnect_camera()
+                self.set_connect_button(connected=False)
 
         except pylon.RuntimeException as e:
             # Disconnected while running
             self.timer.stop()
-            self.camera = None
+            self.show_final_records()
+            self.show_summary(self.inspection.camera_lost())
             self.image_labelL.clear()
             self.cameraStatusText.setText("No camera connected")
             self.getCameraList()
             self.set_connect_button(connected=False)
 
+    def show_image(self, image: np.ndarray, rois, scale: tuple[float, float] = (1.0, 1.0)):
+        """
+        Shows the inspected part of a frame, with the regions drawn on it.
+        `scale` is the size of `image` relative to the frame, for previews.
+        """
+        if self.inspection is not None:
+            # Previews from the service are already 8-bit
+            image = to_8bit(image, self.inspection.bit_depth)
+        # Convert to BGR if the image is grayscale
+        if (
+            len(image.shape) == 2
+        ):  # Check if the image is grayscale (single channel)
+            image_display = cv2.cvtColor(
+                image, cv2.COLOR_GRAY2BGR
+            )  # Convert to BGR
+        elif(
+            image.shape[2] == 2
+        ): # Check if it is a dart camera
+            image_display = cv2.cvtColor(
+                image[:,:,0], cv2.COLOR_GRAY2BGR
+            )  #Convert 1st channel to BGR
+        else:
+            image_display = image.copy()
+
+        # Draw the rectangles for each ROI (using the coordinates from rois)
+        if self.show_rois_checkbox.isChecked():
+            thickness = 2
+            sx, sy = scale
+
+            for i, roi in enumerate(rois):
+                cv2.rectangle(
+                    image_display,
+                    (round(roi["x_low"] * sx), round(roi["y_low"] * sy)),
+                    (round(roi["x_high"] * sx), round(roi["y_high"] * sy)),
+                    region_color(i)[::-1],  # BGR
+                    thickness,
+                )
+        image_display = cv2.resize(image_display, (768, 160))
+        frame_display = np.rot90(image_display, 1)
+        frame_display_rgb = cv2.cvtColor(frame_display, cv2.COLOR_BGR2RGB)
+        qimage = qimage2ndarray.array2qimage(frame_display_rgb)
+        self.image_labelL.setPixmap(QPixmap.fromImage(qimage))
+
+    def show_records(self, records):
+        """Shows the results of newly inspected frames."""
+        for record in records:
+            self.add_to_history(record)
+            for i, data_sum in enumerate(record.sums):
+                self.max_sums[i] = self.maxData(data_sum, self.max_sums[i])
+
+        if records:
+            record = records[-1]
+            for i, max_sum in enumerate(self.max_sums):
+                self.view_model.set(f"max{i}", max_sum)
+            self.target_region_display(record.region_results)
+            self.ROI_inspection(record.overall_result)
+            self.view_model.set("recommendation", record.result)
+            if self.auto_exposure:
+                # The slider sets the exposure the thresholds are for
+                self.view_model.set("exposure_used", record.exposure)
+
+    def refresh_views(self, image: Optional[np.ndarray]):
+        """Redraws the plot, and occasionally the ROI editor and the panorama."""
+        # Refresh the ROI editor background occasionally, but never mid-drag
+        if (
+            image is not None
+            and self.graph_tabs.currentWidget() is self.roi_manager
+            and not self.roi_manager.dragging
+            and time.time() - self._last_roi_image_time > 1.0
+        ):
+            self.roi_manager.set_image(image)
+            self._last_roi_image_time = time.time()
+
+        panorama = None if self.pipeline is None else self.pipeline.panorama
+        if (
+            panorama is not None
+            and self.graph_tabs.currentWidget() is self.panorama_label
+            and time.time() - self._last_panorama_time > 0.5
+        ):
+            self.display_panorama(panorama)
+            self._last_panorama_time = time.time()
+
+        self.ax.cla()
+        self.ax = self.insert_ax(self.ax)
+        self._plot_canvas()
+
+    def add_to_history(self, record):
+        """
+        Adds the sums of a record to the live plot and the trend. When
+        bracketing, the sums of each exposure are kept until the bracket is
+        complete, and the plot shows the HDR sums.
+        """
+        if self.bracket_exposures is None:
+            sums = record.sums
+            trend = record.sums
+        else:
+            if record.exposure_index is not None:
+                self.bracket_sums[record.exposure_index] = record.sums
+            if "hdr" not in record.extras or any(
+                len(sums or ()) != len(record.sums) for sums in self.bracket_sums
+            ):
+                return
+            sums = record.extras["hdr"]
+            trend = list(itertools.chain(*self.bracket_sums, sums))
+        self.series = np.roll(self.series, 1, axis=1)
+        self.series[:, 0] = sums
+        if len(trend) == len(self.trend_view.lines):
+            self.trend_view.append(record.timestamp_ns, trend)
+
+    def show_service(self):
+        """Shows the inspection service in place of the camera list."""
+        host, port = self.client.address
+        self.cameraListBox.clear()
+        self.cameraListBox.addItem(f"Inspection service at {host}:{port}")
+        self.cameraRefreshBtn.setEnabled(False)
+        running = self.client.hello["running"]
+        self.cameraConnectBtn.setChecked(running)
+        self.set_connect_button(running)
+        self.service_timer = QTimer(self)
+        self.service_timer.timeout.connect(self.poll_service)
+        self.service_timer.start(30)
+
+    def poll_service(self):
+        """Shows what the inspection service sent since the last call."""
+        records = []
+        for message in self.client.receive():
+            kind = message["type"]
+            if kind == "record":
+                records.append(RemoteRecord.from_message(message))
+            elif kind == "status":
+                self.view_model.set("elapsed", message["elapsed"])
+                self.view_model.set("dropped", message["dropped"])
+            elif kind == "config":
+                self.config_service.update(message)
+            elif kind == "session":
+                running = message["running"]
+                self.cameraConnectBtn.setChecked(running)
+                self.set_connect_button(running)
+                if running:
+                    self.bracket_sums = [None] * len(self.bracket_exposures or ())
+                    self.cameraStatusText.setText("Inspecting")
+                else:
+                    self.image_labelL.clear()
+                    self.cameraStatusText.setText("No camera connected")
+                    self.show_summary(message["summary"])
+            elif kind == "error":
+                self.save_msg.setText(message["message"])
+
+        image = self.preview.read()
+        if image is not None:
+            height, width = self.preview.source_shape
+            scale = (image.shape[1] / width, image.shape[0] / height)
+            self.show_image(image, self.config_service.snapshot.regions, scale)
+        self.show_records(records)
+        if image is not None or records:
+            self.refresh_views(None)
+
+        if not self.client.connected:
+            self.service_timer.stop()
+            self.cameraConnectBtn.setEnabled(False)
+            self.cameraStatusText.setText("Inspection service disconnected")
+
     def insert_ax(self, ax):
         # self.ax.set_ylim([0,260])
         ax.set_xlim([0, 850])
@@ -481,21 +696,35 @@ class MainApp(QWidget):
         self.canvas.draw()
 
     def disconnect_camera(self):
-        if self.camera is None:
+        if self.inspection is None or not self.inspection.connected:
             print("No camera connected.")
             return
-        if self.camera.IsCameraDeviceRemoved():
-            print("Camera already removed.")
-            self.camera = None
-            return
-        # self.phaseCam.stopCapture()
-        self.camera.Close()
         self.timer.stop()
+        self.show_final_records()
+        # Save any remaining data
+        summary = self.inspection.disconnect()
         self.image_labelL.clear()
         self.cameraStatusText.setText("No camera connected")
-        self.camera = None
-
-        self.jsonsaver.close() # Save any remaining data
+        self.show_summary(summary)
+
+    def show_final_records(self):
+        """Shows the frames that were still being analysed when the session ended."""
+        records = self.inspection.flush()
+        if records:
+            self.show_records(records)
+            self.refresh_views(None)
+
+    def show_summary(self, summary: dict):
+        """Shows the summary of the session that just ended, without blocking."""
+        if summary is None:
+            return
+        dialog = QMessageBox(self)
+        dialog.setWindowTitle("Session Summary")
+        dialog.setText(format_summary(summary))
+        dialog.setStandardButtons(QMessageBox.Ok)
+        dialog.setModal(False)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
 
     def getCameraList(self):
         self.cameraListBox.clear()
@@ -549,89 +778,40 @@ class MainApp(QWidget):
             result = str(number)
         return result
 
-    @staticmethod
-    def shiftdata(data_array, data):
-        """
-        Shifts `data_array` to the right by one element, and inserts the sum of
-        `data` at the front of `data_array`.
-
-        Returns the new value of `data_array` as well as the sum of `data`.
-        """
-        data_array = np.roll(data_array, 1)
-        data_sum = np.sum(data)
-        data_array[0] = data_sum
-        return data_array, data_sum
+    def display_panorama(self, panorama: Panorama):
+        image = panorama.to_8bit()
+        width, height = self.panorama_label.width(), self.panorama_label.height()
+        if image is None or width < 1 or height < 1:
+            return
+        image = cv2.resize(
+            image,
+            (width, height),
+            interpolation=cv2.INTER_AREA,
+        )
+        self.panorama_label.setPixmap(
+            QPixmap.fromImage(qimage2ndarray.gray2qimage(image))
+        )
+        self.panorama_label.setToolTip(f"{panorama.coverage:.0%} of a rotation")
 
     def reset_graphdata(self):
         self.ax.cla()
         # self.ax.set_ylim([0,260])
         self.ax = self.insert_ax(self.ax)
-        self.s1 = np.zeros(850)
-        self.s2 = np.zeros(850)
-        self.s3 = np.zeros(850)
-        self.s4 = np.zeros(850)
+        self.series = np.zeros((self.n_regions, 850))
         self.t = np.arange(850)
+        self.max_sums = [0] * self.n_regions
 
-    def part_inspection(self, sumValue):
-        inspection_result = Result.NO_BOTTLE
-        if sumValue < self.thresholds_individual["accept"]:
-            # self.bottlePartBtn.setStyleSheet("background-color: green")
-            inspection_result = Result.ACCEPT
-        elif sumValue <= self.thresholds_individual["inspect"]:
-            # self.bottlePartBtn.setStyleSheet("background-color: orange")
-            inspection_result = Result.INSPECT
-        else:
-            # self.bottlePartBtn.setStyleSheet("background-color: red")
-            inspection_result = Result.REJECT
-        return inspection_result
-
-    def part_inspection_display(self, inspectIndex):
-        if inspectIndex == 1:
-            # self.bottlePartBtn.setStyleSheet("background-color: green")
-            self.inspection_part = Result.ACCEPT
-        elif inspectIndex == 2:
-            # self.bottlePartBtn.setStyleSheet("background-color: orange")
-            self.inspection_part = Result.INSPECT
-        else:
-            # self.bottlePartBtn.setStyleSheet("background-color: red")
-            self.inspection_part = Result.REJECT
+    def target_region_display(self, region_results: list[Result]):
+        target_regions = ""
+        for i, result in enumerate(region_results):
+            self.view_model.set(f"region{i}", result)
+            if result.value > 1:
+                target_regions = target_regions + f"Region {i + 1}  "
 
-    def target_region_display(self, r1, r2, r3, r4):
-        self.inspection_light(r1.value, self.bottlePartBtn)
-        self.inspection_light(r2.value, self.bottlePart2Btn)
-        self.inspection_light(r3.value, self.bottlePart3Btn)
-        self.inspection_light(r4.value, self.bottlePart4Btn)
+        self.view_model.set("target_regions", target_regions)
 
-        target_regions = ""
-        if r1.value > 1:
-            target_regions = target_regions + "Region 1  "
-        if r2.value > 1:
-            target_regions = target_regions + "Region 2  "
-        if r3.value > 1:
-            target_regions = target_regions + "Region 3  "
-        if r4.value > 1:
-            target_regions = target_regions + "Region 4  "
-
-        self.regionText.setText(target_regions)
-
-    def inspection_light(self, inspect_index, btn):
-        if inspect_index == 1:
-            btn.setStyleSheet("background-color: green")
-        elif inspect_index == 2:
-            btn.setStyleSheet("background-color: orange")
-        elif inspect_index == 3:
-            btn.setStyleSheet("background-color: red")
-
-    def ROI_inspection(self, sumValue):
-        if sumValue < self.thresholds_overall["accept"]:
-            self.bottleAllBtn.setStyleSheet("background-color: green")
-            self.inspection_ROI = Result.ACCEPT
-        elif sumValue <= self.thresholds_overall["inspect"]:
-            self.bottleAllBtn.setStyleSheet("background-color: orange")
-            self.inspection_ROI = Result.INSPECT
-        else:
-            self.bottleAllBtn.setStyleSheet("background-color: red")
-            self.inspection_ROI = Result.REJECT
+    def ROI_inspection(self, overall_result: Result):
+        self.view_model.set("overall", overall_result)
 
     def changeValue(self, value):
         self.exposureValue.setText(str(value))
@@ -642,25 +822,102 @@ class MainApp(QWidget):
         # print(index)
         self.device_connected = self.device_list[index]
 
-    def get_current_config(self) -> dict:
-        config_dict = {}
-        current_exposure = self.slider.value()
-        current_sampletime = self.sampleTimeValue.value()
-        current_rois = self.roi_selector.get_rois()
-        config_dict["exposure"] = current_exposure
-        config_dict["sampletime"] = current_sampletime
-        config_dict["thresholds"] = {"individual": self.thresholds_individual, "overall": self.thresholds_overall}
-        config_dict["regions"] = current_rois
-        return config_dict
+    def apply_config_changes(self, changes: dict):
+        """Publishes settings edited in the GUI to the running pipeline."""
+        if self._applying_config:
+            return
+        try:
+            self.config_service.apply(changes)
+        except ConfigError as e:
+            self.save_msg.setText(f"Invalid setting: {e}")
+
+    def select_recipe(self, index: int):
+        if self._applying_config:
+            return
+        name = None if index == 0 else self.recipeCombo.itemText(index)
+        self.config_service.select_recipe(name)
+
+    def apply_config_snapshot(self, snapshot: ConfigSnapshot):
+        """Updates the widgets to show a new config snapshot."""
+        self._applying_config = True
+        try:
+            self.slider.setValue(snapshot.exposure)
+            self.sampleTimeValue.setValue(snapshot.sampletime)
+            self.set_region_count(len(snapshot.regions))
+            self.roi_selector.set_rois(list(snapshot.regions))
+            if not self.roi_manager.dragging:
+                self.roi_manager.set_rois(snapshot.regions)
+            if [self.recipeCombo.itemText(i) for i in range(1, self.recipeCombo.count())] != snapshot.recipes:
+                self.recipeCombo.clear()
+                self.recipeCombo.addItem("(default)")
+                self.recipeCombo.addItems(snapshot.recipes)
+            self.recipeCombo.setCurrentIndex(
+                0 if snapshot.recipe is None else self.recipeCombo.findText(snapshot.recipe)
+            )
+        finally:
+            self._applying_config = False
+        recipe = snapshot.recipe if snapshot.recipe is not None else "default"
+        self.save_msg.setText(f"Config version {snapshot.version} ({recipe} recipe)")
+
+    def show_calibration(self):
+        dialog = CalibrationDialog(self.config_service, self.apply_config_changes, DATA_DIR, self)
+        dialog.show()
+
+    def auto_roi(self):
+        """
+        Places the regions on the bottle from the next frames inspected. The
+        new regions reach the ROI widgets as a config change.
+        """
+        if self.client is not None:
+            self.client.send("auto_roi")
+        else:
+            self.inspection.auto_roi.request()
+        self.save_msg.setText("Placing the regions from the next frames")
+
+    def start_profile(self, seconds: float):
+        """
+        Profiles the GUI thread for `seconds`. The results go to the session
+        folder, or to a folder of their own when no session is running.
+        """
+        if self.profiler.running:
+            return
+        if self.pipeline is not None and self.pipeline.session_dir is not None:
+            self.profile_dir = self.pipeline.session_dir / "profile"
+        else:
+            now = datetime.datetime.now().strftime(r"%Y%m%d_%H%M%S")
+            self.profile_dir = DATA_DIR / f"profile_{now}"
+        self.profiler.start()
+        self.profileBtn.setEnabled(False)
+        self.profileBtn.setText("Profiling...")
+        QTimer.singleShot(int(seconds * 1000), self.stop_profile)
+
+    def stop_profile(self):
+        path = self.profiler.stop(self.profile_dir)
+        self.profileBtn.setEnabled(True)
+        self.profileBtn.setText("Profile")
+        if path is not None:
+            print(f"Saved profile to {path}")
+            self.save_msg.setText(f"Profile saved to {path}")
+
+    def archive_when_idle(self):
+        if self.inspection.connected:
+            return
+        if self.archive_job is not None and self.archive_job.running:
+            return
+        self.archive_job = ArchiveJob(
+            DATA_DIR,
+            self.archive_config.get("workers", 2),
+            self.archive_config.get("retention_days"),
+        )
+        self.archive_job.start()
 
     def check_config_dialog(self):
         """
-        Checks if the current configuration is different from the initial configuration.
+        Checks if the current configuration is different from the config file.
         If it is, pops up a dialog asking if the user wants to save the changes.
         If the user chooses to save the changes, writes the current configuration to the config file.
         """
-        current_config = self.get_current_config()
-        if current_config == self.initial_config:
+        if not self.config_service.is_modified:
             return
         qm = QMessageBox()
         ret = qm.question(
@@ -671,16 +928,28 @@ class MainApp(QWidget):
         )
         if ret == qm.Yes:
             print("Saving config")
-            write_config(current_config)
+            self.config_service.save()
 
     def closeEvent(self, event):
+        self.config_service.stop()
         self.check_config_dialog()
-        # self.jsonsaver.close()
-        try:
-            self.disconnect_camera()
-            print("Camera disconnected.")
-        except:
-            pass
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.inspection is not None:
+            try:
+                self.disconnect_camera()
+                print("Camera disconnected.")
+            except:
+                pass
+            self.inspection.close()
+        else:
+            # The service carries on inspecting
+            self.service_timer.stop()
+            self.client.close()
+            self.preview.close()
+        self.stop_profile()
+        if self.archive_job is not None:
+            self.archive_job.stop(wait=True)
         print("Closing...")
         event.accept()
         
@@ -691,8 +960,42 @@ class MainApp(QWidget):
 
 
 def main():
-    app = QApplication(sys.argv)
-    win = MainApp()
+    # In the frozen (PyInstaller) build, worker processes start this executable
+    # again: run the worker instead of another GUI
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Encirc bottle inspection GUI")
+    parser.add_argument(
+        "--profile",
+        type=float,
+        metavar="SECONDS",
+        help="profile the first SECONDS of the first session and save the results in its folder",
+    )
+    parser.add_argument(
+        "--attach",
+        nargs="?",
+        const="",
+        metavar="HOST:PORT",
+        help="view the inspection service (service.py) instead of inspecting in the GUI, "
+        "by default at the address in the service section of the config",
+    )
+    # Leave the rest of the arguments to Qt
+    args, qt_args = parser.parse_known_args()
+
+    service_address = None
+    if args.attach is not None:
+        config = read_config(CONFIG_PATH) if CONFIG_PATH.exists() else {}
+        service_config = config.get("service", {})
+        host = service_config.get("host", "127.0.0.1")
+        port = service_config.get("port", 9300)
+        if args.attach:
+            host, _, port = args.attach.rpartition(":")
+        service_address = (host or "127.0.0.1", int(port))
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    try:
+        win = MainApp(args.profile, service_address)
+    except OSError as e:
+        parser.exit(1, f"Cannot attach to the inspection service: {e}\n")
     win.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+
+import datetime
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from pypylon import pylon
+
+from config import ConfigService, ConfigSnapshot
+from metrics import PipelineMetrics
+from publisher import ResultPublisher
+from pipeline import FrameRecord, InspectionPipeline
+from parallel import ParallelAnalyzer
+from analyzers import PanoramaAnalyzer, create_analyzers
+from sampling import RotationSampler
+from bracketing import ExposureBracket, HDRAnalyzer
+from autoexposure import AutoExposure
+from autoroi import AutoROI
+from camera import FrameInfo, read_frame_info, timestamp_tick_ns
+from pixelformat import PACKED_FORMATS, Unpacker, bit_depth
+from utils import get_data_dir
+
+DATA_DIR = get_data_dir()
+# Rows of each frame that are inspected
+INSPECTED_ROWS = (400, 800)
+
+
+@dataclass
+class Grab:
+    """One frame grabbed and inspected by an Inspection."""
+
+    # The part of the frame that was inspected. Unpacked from packed pixel
+    # formats into a buffer that the next grab overwrites.
+    image: np.ndarray
+    frame_info: FrameInfo
+    snapshot: ConfigSnapshot
+    # Records completed by this frame. With analysis workers, these can be
+    # the records of earlier frames.
+    records: list[FrameRecord] = field(default_factory=list)
+    # False if the camera reported the frame as invalid
+    valid: bool = True
+
+
+class Inspection:
+    """
+    The acquisition and inspection core: grabs frames from a camera, inspects
+    them with an InspectionPipeline, and saves each sample period as a
+    session. It has no user interface, so the GUI drives it from a timer and
+    the headless service drives it from a loop of its own.
+
+    The optional parts of the pipeline (result publisher, analysis workers,
+    analyzers, panorama, rotation sampling, bracketing, auto-exposure and
+    region tracking) are set up from the config when it is created.
+    """
+
+    def __init__(
+        self,
+        config_service: ConfigService,
+        metrics: Optional[PipelineMetrics] = None,
+        data_dir: Path = DATA_DIR,
+    ):
+        self.config_service = config_service
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.data_dir = Path(data_dir)
+        self.camera = None
+        self._camera_exposure = None
+        self._tick_ns = 1.0
+        self.t_start = None
+        # Pixel values have `bit_depth` significant bits, see pixelformat.py
+        self.bit_depth = 8
+        self.unpacker = None
+
+        initial_config = config_service.snapshot.raw
+        self.pixel_format = initial_config.get("camera", {}).get("pixel_format")
+        panorama_config = initial_config.get("panorama", {})
+        self.full_rotation_time = float(panorama_config.get("rotation_time", 36.0))
+
+        self.publisher = None
+        publisher_config = initial_config.get("publisher", {})
+        if publisher_config.get("enabled", False):
+            self.publisher = ResultPublisher(
+                publisher_config.get("transport", "udp"),
+                publisher_config.get("host", "127.0.0.1"),
+                publisher_config.get("port", 9200),
+            )
+
+        # Optionally analyse frames in worker processes. Bracketing merges the
+        # region statistics in-process, before the worker results would arrive.
+        analyzer = None
+        analysis_config = initial_config.get("analysis", {})
+        bracketing_config = initial_config.get("bracketing", {})
+        if analysis_config.get("workers", 0) > 0 and bracketing_config.get("enabled", False):
+            print("Analysis workers are not supported with bracketing, analysing in-process")
+        elif analysis_config.get("workers", 0) > 0:
+            analyzer = ParallelAnalyzer(
+                analysis_config["workers"], analysis_config.get("slots", 8)
+            )
+
+        # Per-frame analyzers, run within the time between camera frames
+        self.analyzers_config = initial_config.get("analyzers", {})
+        analyzers = create_analyzers(self.analyzers_config)
+
+        # Optionally unwrap the bottle into a panorama over each rotation
+        if panorama_config.get("enabled", False):
+            analyzers.append(
+                PanoramaAnalyzer(
+                    rotation_time=self.full_rotation_time,
+                    columns=panorama_config.get("columns", 720),
+                    strip_x=panorama_config.get("strip_x"),
+                    strip_width=panorama_config.get("strip_width", 8),
+                )
+            )
+
+        # Optionally cycle through several exposures, merged per region into HDR sums
+        self.bracket = None
+        if bracketing_config.get("enabled", False):
+            self.bracket = ExposureBracket(bracketing_config["exposures"])
+            analyzers.append(HDRAnalyzer(exposures=self.bracket.exposures))
+
+        self.pipeline = InspectionPipeline(
+            config_service, self.metrics, self.publisher, analyzer, analyzers
+        )
+
+        # Optionally grab a fixed number of evenly spaced frames per rotation
+        self.rotation_sampler = None
+        self.rotation_config = initial_config.get("rotation_sync", {})
+        if self.rotation_config.get("enabled", False) and self.bracket is not None:
+            print("Rotation-synchronised sampling is not supported with bracketing, ignoring it")
+        elif self.rotation_config.get("enabled", False):
+            self.rotation_sampler = RotationSampler(
+                self.full_rotation_time,
+                self.rotation_config.get("angle_step", 1.0),
+                self.rotation_config.get("rotations", 1),
+            )
+
+        # Optionally let the exposure follow the brightness of the images.
+        # The thresholds stay set for the exposure in the config.
+        self.auto_exposure = None
+        auto_exposure_config = dict(initial_config.get("auto_exposure", {}))
+        auto_exposure_enabled = auto_exposure_config.pop("enabled", False)
+        if auto_exposure_enabled and self.bracket is not None:
+            print("Auto-exposure is not supported with bracketing, ignoring it")
+        elif auto_exposure_enabled:
+            self.auto_exposure = AutoExposure(
+                config_service.snapshot.exposure,
+                analysis_config.get("saturation", 250),
+                **auto_exposure_config,
+            )
+
+        # Places the regions on the bottle when requested, and optionally
+        # every so often to follow it
+        auto_roi_config = dict(initial_config.get("auto_roi", {}))
+        if not auto_roi_config.pop("enabled", False):
+            auto_roi_config["every"] = 0
+        self.auto_roi = AutoROI(**auto_roi_config)
+
+    @property
+    def connected(self) -> bool:
+        return self.camera is not None
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the camera was connected."""
+        return 0.0 if self.t_start is None else time.time() - self.t_start
+
+    def connect(self, device_info=None):
+        """
+        Opens the camera (by default the first one found), starts grabbing and
+        starts a session.
+        """
+        if device_info is None:
+            devices = pylon.TlFactory.GetInstance().EnumerateDevices()
+            if not devices:
+                raise RuntimeError("No camera found")
+            device_info = devices[0]
+        self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateDevice(device_info))
+        self.camera.Open()
+        self._camera_exposure = None
+        self._tick_ns = timestamp_tick_ns(self.camera)
+        self.configure_pixel_format()
+        if self.rotation_sampler is not None:
+            self.rotation_sampler.reset()
+            if self.rotation_config.get("pacing", "camera") == "camera":
+                self.rotation_sampler.configure_camera(self.camera)
+            else:
+                self.rotation_sampler.hardware = False
+        if self.bracket is not None:
+            self.bracket.reset()
+            self.bracket.configure_camera(self.camera)
+        if self.auto_exposure is not None:
+            # Carries on from the exposure the last session settled on
+            self.auto_exposure.reset()
+            self.auto_exposure.configure_camera(self.camera)
+        self.pipeline.scheduler.set_frame_rate(self.camera_frame_rate())
+        self.camera.StartGrabbing()
+        self.t_start = time.time()
+
+        now = datetime.datetime.now().strftime(r"%Y%m%d_%H%M%S")
+        self.pipeline.start_session(self.data_dir / f"encirc_data_{now}")
+
+    def configure_pixel_format(self):
+        """
+        Sets the configured pixel format, and prepares to unpack frames of a
+        packed format.
+        """
+        if self.pixel_format is not None:
+            self.camera.PixelFormat.SetValue(self.pixel_format)
+        pixel_format = self.camera.PixelFormat.GetValue()
+        self.bit_depth = bit_depth(pixel_format)
+        if pixel_format not in PACKED_FORMATS:
+            self.unpacker = None
+        elif self.unpacker is None or self.unpacker.pixel_format != pixel_format:
+            self.unpacker = Unpacker(pixel_format)
+
+    def camera_frame_rate(self) -> Optional[float]:
+        """
+        Frame rate the analyzers must keep up with: the configured one, else
+        the one the camera reports. None if neither is known, in which case
+        the scheduler measures it.
+        """
+        if self.rotation_sampler is not None:
+            # Only the sampled frames are analysed, however fast the camera is
+            return self.rotation_sampler.frame_rate
+        if self.analyzers_config.get("frame_rate"):
+            return float(self.analyzers_config["frame_rate"])
+        try:
+            return float(self.camera.ResultingFrameRate.GetValue())
+        except Exception:
+            # Not every camera (or the emulator) provides it
+            return None
+
+    def grab(self) -> Optional[Grab]:
+        """
+        Grabs and inspects one frame. Returns None if the grab failed or the
+        frame was not sampled. Raises pylon.RuntimeException if the camera
+        was disconnected.
+        """
+        # Use one config snapshot for the whole frame
+        snapshot = self.config_service.snapshot
+        automatic = self.bracket is not None or self.auto_exposure is not None
+        if not automatic and snapshot.exposure != self._camera_exposure:
+            # Otherwise the bracket or the auto-exposure sets the exposure
+            self.camera.ExposureTime.SetValue(snapshot.exposure * 1000)
+            self._camera_exposure = snapshot.exposure
+
+        t_start = time.perf_counter()
+        if self.bracket is not None:
+            self.bracket.trigger(self.camera)
+        read_result = self.camera.RetrieveResult(5000)
+        try:
+            t_grabbed = time.perf_counter()
+            grabbed_ns = time.time_ns()
+            self.metrics.observe_stage("grab", t_grabbed - t_start)
+
+            frame_info = read_frame_info(read_result, grabbed_ns, self._tick_ns)
+            frame_info.bit_depth = self.bit_depth
+            if self.bracket is not None:
+                self.bracket.tag(frame_info, read_result)
+            if self.auto_exposure is not None:
+                self.auto_exposure.frame_exposure(frame_info, read_result)
+            exposure = frame_info.exposure
+            self.metrics.exposure.set(exposure if exposure is not None else snapshot.exposure)
+            if not read_result.GrabSucceeded():
+                self.pipeline.frame_dropped()
+                return None
+            if not self.sample_frame(frame_info):
+                # Not one of the frames sampled by rotation
+                self.pipeline.skip(frame_info)
+                return None
+            self.metrics.frames_grabbed.inc()
+            image = self.inspected_image(read_result)
+
+            # Inspect and publish the result before anything is displayed.
+            # With analysis workers, records can arrive a few frames late.
+            records = self.pipeline.submit(
+                image,
+                frame_info=frame_info,
+                t_grabbed=t_grabbed,
+                snapshot=snapshot,
+            )
+            if self.auto_exposure is not None:
+                self.auto_exposure.update(image, frame_info, self.camera)
+            self.place_regions(image, frame_info, snapshot)
+            return Grab(image, frame_info, snapshot, records, bool(read_result.IsValid))
+        finally:
+            read_result.Release()
+
+    def place_regions(self, image: np.ndarray, frame_info: FrameInfo, snapshot: ConfigSnapshot):
+        """Applies the regions placed by auto ROI to the config, once they are placed."""
+        regions = self.auto_roi.update(image, snapshot.regions, frame_info.bit_depth)
+        if regions is not None and regions != [dict(region) for region in snapshot.regions]:
+            first, last = regions[0]["x_low"], regions[-1]["x_high"]
+            print(f"Auto ROI: placed {len(regions)} regions from x = {first} to {last}")
+            self.config_service.apply({"regions": regions})
+
+    def inspected_image(self, read_result) -> np.ndarray:
+        """The inspected rows of a grabbed frame."""
+        first, last = INSPECTED_ROWS
+        if self.unpacker is None:
+            return read_result.Array[first:last, :]
+        # Only the inspected rows are unpacked, without copying the frame first
+        return self.unpacker.unpack_result(read_result, INSPECTED_ROWS)
+
+    def sample_frame(self, frame_info: FrameInfo) -> bool:
+        """
+        Returns True if the frame should be inspected. When sampling by
+        rotation, this also sets the angle of the frame.
+        """
+        if self.rotation_sampler is None:
+            return True
+        index = self.rotation_sampler.accept(frame_info)
+        if index is None:
+            return False
+        frame_info.angle = self.rotation_sampler.angle(index)
+        return True
+
+    def sampling_finished(self) -> bool:
+        """True when the sample period, or every rotation when sampling by rotation, is over."""
+        sampler = self.rotation_sampler
+        if sampler is None:
+            return self.elapsed > float(self.config_service.snapshot.sampletime)
+        if sampler.complete:
+            return True
+        if sampler.timed_out(self.elapsed):
+            print(f"Only {sampler.used} of {sampler.total_frames} rotation frames arrived")
+            return True
+        return False
+
+    def flush(self) -> list[FrameRecord]:
+        """
+        Returns the records of the frames still being analysed, once they
+        are done. Call before ending the session to show them.
+        """
+        return self.pipeline.flush()
+
+    def disconnect(self) -> Optional[dict]:
+        """
+        Stops grabbing, closes the camera and ends the session. Returns the
+        session summary.
+        """
+        if self.camera is None:
+            return None
+        if self.camera.IsCameraDeviceRemoved():
+            print("Camera already removed.")
+            return self.camera_lost()
+        if self.rotation_sampler is not None or self.bracket is not None:
+            self.camera.StopGrabbing()
+        if self.rotation_sampler is not None:
+            self.rotation_sampler.restore_camera(self.camera)
+        if self.bracket is not None:
+            self.bracket.restore_camera(self.camera)
+        self.camera.Close()
+        self.camera = None
+        self.t_start = None
+
+        # Save any remaining data
+        return self.end_session()
+
+    def camera_lost(self) -> Optional[dict]:
+        """Ends the session after the camera was disconnected while running."""
+        self.camera = None
+        self.t_start = None
+        return self.end_session()
+
+    def end_session(self) -> Optional[dict]:
+        session_dir = self.pipeline.session_dir
+        if self.auto_exposure is not None and session_dir is not None:
+            path = self.auto_exposure.save(session_dir / "exposure_adjustments.json")
+            if path is not None:
+                print(f"Saved {len(self.auto_exposure.adjustments)} exposure adjustments to {path}")
+        return self.pipeline.end_session()
+
+    def close(self):
+        try:
+            self.disconnect()
+        except pylon.RuntimeException:
+            self.camera_lost()
+        self.pipeline.close()
+
+
+def main():
+    # Example usage: inspect one sample period with the first camera
+    from summary import format_summary
+
+    inspection = Inspection(ConfigService())
+    inspection.connect()
+    while not inspection.sampling_finished():
+        grab = inspection.grab()
+        for record in [] if grab is None else grab.records:
+            print(f"Frame {record.frame_id}: {record.result.name}")
+    print(format_summary(inspection.disconnect()))
+    inspection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from result import Result
+
+# Latency buckets in seconds, from 0.5 ms to 1 s
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0
+)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonic counter. Metrics have a single writer (the inspection loop);
+    the server thread only reads the current values, so no locking is needed.
+    """
+
+    kind = "counter"
+
+    def __init__(self, labels: dict):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self, name: str):
+        yield f"{name}_total{_format_labels(self.labels)}", self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, labels: dict):
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, name: str):
+        yield f"{name}{_format_labels(self.labels)}", self.value
+
+
+class RollingGauge(Gauge):
+    """Gauge reporting the mean of the last `window` values that were set."""
+
+    def __init__(self, labels: dict, window: int = 50):
+        super().__init__(labels)
+        self.window = [0.0] * window
+        self.index = 0
+        self.filled = 0
+        self.total = 0.0
+
+    def set(self, value: float):
+        self.total += value - self.window[self.index]
+        self.window[self.index] = value
+        self.index = (self.index + 1) % len(self.window)
+        self.filled = min(self.filled + 1, len(self.window))
+        self.value = self.total / self.filled
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, labels: dict, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # One extra slot for observations above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str):
+        # Copy first so the cumulative counts are consistent with each other
+        counts = list(self.counts)
+        total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = dict(self.labels, le=str(bound))
+            yield f"{name}_bucket{_format_labels(labels)}", cumulative
+        cumulative += counts[-1]
+        labels = dict(self.labels, le="+Inf")
+        yield f"{name}_bucket{_format_labels(labels)}", cumulative
+        yield f"{name}_sum{_format_labels(self.labels)}", total
+        yield f"{name}_count{_format_labels(self.labels)}", cumulative
+
+
+class MetricsRegistry:
+    """Collection of metrics that can be rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._families: dict[str, tuple[str, str, list]] = {}
+
+    def _add(self, name: str, help_text: str, metric):
+        kind, _, metrics = self._families.setdefault(name, (metric.kind, help_text, []))
+        if kind != metric.kind:
+            raise ValueError(f"Metric {name} already registered as a {kind}")
+        metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._add(name, help_text, Counter(labels))
+
+    def gauge(self, name: str, help_text: str, **labels) -> Gauge:
+        return self._add(name, help_text, Gauge(labels))
+
+    def rolling_gauge(self, name: str, help_text: str, window: int = 50, **labels):
+        return self._add(name, help_text, RollingGauge(labels, window))
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        return self._add(name, help_text, Histogram(labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, metrics) in list(self._families.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in list(metrics):
+                for sample_name, value in metric.samples(name):
+                    lines.append(f"{sample_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class PipelineMetrics:
+    """The metrics exported by the inspection loop."""
+
+    STAGES = ("grab", "analysis", "publish", "display", "plot", "save")
+
+    def __init__(self, n_regions: int = 4):
+        self.registry = MetricsRegistry()
+        r = self.registry
+        self.frames_grabbed = r.counter("encirc_frames_grabbed", "Frames retrieved from the camera")
+        self.frames_processed = r.counter("encirc_frames_processed", "Frames fully inspected")
+        self.frames_dropped = r.counter(
+            "encirc_frames_dropped", "Frames lost, failed to grab or failed to analyse"
+        )
+        self.stage_latency = {
+            stage: r.histogram("encirc_stage_latency_seconds", "Time spent per stage", stage=stage)
+            for stage in self.STAGES
+        }
+        self.results = {
+            result: r.counter("encirc_results", "Inspection results", result=result.name)
+            for result in Result
+        }
+        self.exposure = r.gauge("encirc_exposure_ms", "Current exposure time")
+        self.analysis_over_budget = r.counter(
+            "encirc_analysis_over_budget", "Frames whose analysis took longer than the frame period"
+        )
+        self.analyzer_latencies: dict[str, Histogram] = {}
+        self.region_sums = []
+        for i in range(n_regions):
+            self.region_sum(i)
+
+    def region_sum(self, index: int) -> RollingGauge:
+        """Rolling sum gauge of the region at `index`, created on first use."""
+        while len(self.region_sums) <= index:
+            self.region_sums.append(
+                self.registry.rolling_gauge(
+                    "encirc_region_sum_rolling", "Mean region sum over the last 50 frames",
+                    region=str(len(self.region_sums) + 1),
+                )
+            )
+        return self.region_sums[index]
+
+    def analyzer_latency(self, name: str) -> Histogram:
+        """Latency histogram of the analyzer called `name`, created on first use."""
+        if name not in self.analyzer_latencies:
+            self.analyzer_latencies[name] = self.registry.histogram(
+                "encirc_analyzer_latency_seconds", "Time spent per analyzer", analyzer=name
+            )
+        return self.analyzer_latencies[name]
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.stage_latency[stage].observe(seconds)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """
+    Serves a MetricsRegistry over HTTP from a background thread.
+    Requests only read metric values, they never call into the GUI.
+    """
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9108):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="metrics-server", daemon=True
+        )
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self.thread.start()
+        print("Serving metrics on http://{}:{}/metrics".format(*self.address))
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    # Example usage:
+    import time
+    import urllib.request
+
+    metrics = PipelineMetrics()
+    server = MetricsServer(metrics.registry, port=0)
+    server.start()
+
+    for i in range(100):
+        metrics.frames_grabbed.inc()
+        metrics.observe_stage("analysis", 0.001 * (i % 7))
+        metrics.results[Result.ACCEPT].inc()
+        metrics.region_sums[0].set(i)
+        metrics.frames_processed.inc()
+    time.sleep(0.1)
+
+    url = "http://{}:{}/metrics".format(*server.address)
+    print(urllib.request.urlopen(url).read().decode())
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class Panorama:
+    """
+    Unwrapped 360 degree image of a bottle, built one frame at a time.
+
+    The bottle turns once every `rotation_time` seconds. For every frame, a
+    narrow vertical strip around column `strip_x` is averaged into a single
+    column and written into the panorama at the angle the bottle has turned
+    to since the first frame. Columns the bottle passed between two frames
+    are filled with the same strip. Nothing but the panorama itself is kept.
+    """
+
+    def __init__(
+        self,
+        rotation_time: float = 36.0,
+        columns: int = 720,
+        strip_x: Optional[int] = None,
+        strip_width: int = 8,
+    ):
+        self.rotation_time = rotation_time
+        self.columns = columns
+        self.strip_x = strip_x
+        self.strip_width = strip_width
+        self.image = None
+        self.filled = np.zeros(columns, dtype=bool)
+        self.t0_ns = None
+        self._last_column = None
+
+    def reset(self):
+        """Starts a new panorama from the next frame."""
+        self.image = None
+        self.filled[:] = False
+        self.t0_ns = None
+        self._last_column = None
+
+    @property
+    def coverage(self) -> float:
+        """Fraction of the 360 degrees that has been filled."""
+        return float(np.count_nonzero(self.filled)) / self.columns
+
+    def column_at(self, t_ns: int) -> int:
+        angle = ((t_ns - self.t0_ns) / 1e9 / self.rotation_time) % 1.0
+        return int(angle * self.columns) % self.columns
+
+    def add(self, frame: np.ndarray, t_ns: int):
+        if frame.ndim == 3:
+            # Two channel (dart) cameras, the first channel is the image
+            frame = frame[:, :, 0]
+        if self.image is None:
+            self.image = np.zeros((frame.shape[0], self.columns), dtype=frame.dtype)
+            self.t0_ns = t_ns
+
+        width = frame.shape[1]
+        x = width // 2 if self.strip_x is None else self.strip_x
+        x_low = min(max(x - self.strip_width // 2, 0), width - 1)
+        x_high = min(x_low + max(self.strip_width, 1), width)
+        strip = frame[:, x_low:x_high]
+        if strip.dtype not in (np.uint8, np.uint16):
+            strip = strip.astype(np.float32)
+        line = cv2.reduce(strip, 1, cv2.REDUCE_AVG, dtype=cv2.CV_32F).ravel()
+
+        column = self.column_at(t_ns)
+        # Fill every column passed since the last frame, unless the gap is so
+        # large (a stalled camera) that it would paint over most of the bottle
+        start = column
+        if self._last_column is not None:
+            gap = (column - self._last_column) % self.columns
+            if 0 < gap < self.columns // 4:
+                start = self._last_column + 1
+        passed = np.arange(start, start + (column - start) % self.columns + 1) % self.columns
+        self.image[:, passed] = line.astype(self.image.dtype)[:, None]
+        self.filled[passed] = True
+        self._last_column = column
+
+    def to_8bit(self) -> Optional[np.ndarray]:
+        if self.image is None:
+            return None
+        if self.image.dtype == np.uint8:
+            return self.image
+        return cv2.normalize(self.image, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+    def save(self, path) -> Optional[Path]:
+        """Saves the panorama as an 8-bit PNG. Does nothing if it is empty."""
+        image = self.to_8bit()
+        if image is None:
+            return None
+        path = Path(path)
+        cv2.imwrite(str(path), image)
+        return path
+
+
+def main():
+    # Example usage: a bottle with a bright stripe every 90 degrees
+    panorama = Panorama(rotation_time=4.0, columns=360)
+    fps = 25
+    for i in range(4 * fps):
+        t_ns = int(i * 1e9 / fps)
+        frame = np.full((100, 200), 80, dtype=np.uint8)
+        if (i // 5) % 5 == 0:
+            frame[:, 90:110] = 250
+        panorama.add(frame, t_ns)
+    print(f"Coverage {panorama.coverage:.0%}, shape {panorama.image.shape}")
+    print(panorama.image[50, ::20])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import Callable
+
+import numpy as np
+
+from analysis import region_sums, region_statistics
+
+
+def _worker(slot_names: list[str], analyze: Callable, tasks, results):
+    """Analyses frames from shared memory slots until it receives None."""
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, shape, dtype, regions, options = task
+            frame = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            try:
+                results.put((seq, slot, analyze(frame, regions, **options), None))
+            except Exception as e:
+                results.put((seq, slot, None, repr(e)))
+            del frame
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class ParallelAnalyzer:
+    """
+    Runs the per-frame analysis in worker processes.
+
+    Frames are copied into a fixed pool of shared memory slots, so only the
+    slot index and the regions are sent to a worker, never the pixels.
+    A slot is reused once its result has come back. When every slot is in
+    use, `submit` waits for results first, which slows the grab loop down
+    to the speed of the workers instead of queueing frames without limit.
+
+    Results are returned strictly in the order the frames were submitted,
+    whichever worker finishes first.
+
+    The slots are sized from the first frame. A larger frame, e.g. from a
+    wider camera connected later, restarts the workers with larger slots
+    once the frames in flight are done.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        slots: int = 8,
+        analyze: Callable = region_statistics,
+        timeout: float = 5.0,
+    ):
+        if slots < workers:
+            raise ValueError("Need at least one slot per worker")
+        self.n_workers = workers
+        self.n_slots = slots
+        self.analyze = analyze
+        self.timeout = timeout
+        self.slot_bytes = 0
+        self._slots: list[shared_memory.SharedMemory] = []
+        self._free: list[int] = []
+        self._processes = []
+        # Spawn rather than fork, the GUI process has threads and a camera open
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = None
+        self._results = None
+        self._next_seq = 0
+        self._next_out = 0
+        self._done: dict[int, list] = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._processes)
+
+    @property
+    def in_flight(self) -> int:
+        """Frames submitted but not yet returned by `collect`."""
+        return self._next_seq - self._next_out
+
+    def start(self, slot_bytes: int):
+        """Creates the shared memory slots and starts the workers."""
+        if self.running:
+            return
+        self.slot_bytes = slot_bytes
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=slot_bytes)
+            for _ in range(self.n_slots)
+        ]
+        self._free = list(range(self.n_slots))
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        names = [shm.name for shm in self._slots]
+        for i in range(self.n_workers):
+            process = self._context.Process(
+                target=_worker,
+                args=(names, self.analyze, self._tasks, self._results),
+                name=f"analysis-{i}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+    def _receive(self, block: bool) -> bool:
+        try:
+            seq, slot, value, error = self._results.get(block, self.timeout)
+        except queue.Empty:
+            if block:
+                for process in self._processes:
+                    if not process.is_alive():
+                        raise RuntimeError(f"Analysis worker {process.name} exited")
+                raise RuntimeError("Timed out waiting for the analysis workers")
+            return False
+        if error is not None:
+            # The frame keeps its place in the order, with no result
+            print(f"Analysis of frame {seq} failed: {error}")
+        self._free.append(slot)
+        self._done[seq] = value
+        return True
+
+    def submit(self, frame: np.ndarray, regions, **options) -> int:
+        """
+        Queues `frame` for analysis of `regions`, waiting for a free slot if
+        necessary. `options` are passed on to the analysis function.
+        Returns the sequence number of the frame.
+        """
+        if not self.running:
+            self.start(frame.nbytes)
+        elif frame.nbytes > self.slot_bytes:
+            self._restart(frame.nbytes)
+        while not self._free:
+            self._receive(block=True)
+        slot = self._free.pop()
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._slots[slot].buf)[...] = frame
+
+        seq = self._next_seq
+        self._next_seq += 1
+        # Config regions are read-only mappings, which cannot be pickled
+        regions = [dict(roi) for roi in regions]
+        self._tasks.put((seq, slot, frame.shape, frame.dtype.str, regions, options))
+        return seq
+
+    def collect(self, wait: bool = False) -> list[tuple[int, list]]:
+        """
+        Returns the (sequence number, analysis result) pairs that are ready,
+        in submission order. A result is held back until all earlier frames
+        have finished. The result is None if the analysis raised an error.
+        With `wait`, blocks until every submitted frame is done.
+        """
+        while self._receive(block=False):
+            pass
+        while wait and self.in_flight > len(self._done):
+            self._receive(block=True)
+
+        ready = []
+        while self._next_out in self._done:
+            ready.append((self._next_out, self._done.pop(self._next_out)))
+            self._next_out += 1
+        return ready
+
+    def _restart(self, slot_bytes: int):
+        """
+        Restarts the workers with slots of `slot_bytes`, once the frames in
+        flight are done. Their results are still returned by `collect`.
+        """
+        while self.in_flight > len(self._done):
+            self._receive(block=True)
+        self._stop_workers()
+        self.start(slot_bytes)
+
+    def _stop_workers(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+        self._free = []
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        if not self.running:
+            return
+        self._stop_workers()
+        self._done = {}
+        self._next_out = self._next_seq
+
+
+def main():
+    # Example usage:
+    frames = np.random.randint(0, 256, (64, 400, 1024), dtype=np.uint8)
+    regions = [
+        {"x_low": 300, "y_low": 120, "x_high": 500, "y_high": 320},
+        {"x_low": 500, "y_low": 120, "x_high": 850, "y_high": 320},
+    ]
+
+    analyzer = ParallelAnalyzer(workers=2, slots=4, analyze=region_sums)
+    t_start = time.perf_counter()
+    results = []
+    for frame in frames:
+        analyzer.submit(frame, regions)
+        results += analyzer.collect()
+    results += analyzer.collect(wait=True)
+    elapsed = time.perf_counter() - t_start
+    analyzer.close()
+
+    assert [seq for seq, _ in results] == list(range(len(frames)))
+    assert all(sums == region_sums(frames[seq], regions) for seq, sums in results)
+    print(f"Analysed {len(results)} frames in order in {elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
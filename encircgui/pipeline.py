@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from analysis import RegionStats
+from result import Result, classify, combine_results
+from config import ConfigService, ConfigSnapshot
+from jsonsaver import JSONSaver
+from metrics import PipelineMetrics
+from publisher import ResultPublisher, LatencyTracker, FLAG_BOTTLE
+from parallel import ParallelAnalyzer
+from panorama import Panorama
+from analyzers import (
+    Analyzer,
+    AnalyzerScheduler,
+    PanoramaAnalyzer,
+    RegionStatisticsAnalyzer,
+    statistics_options,
+)
+from summary import SessionSummary
+from camera import FrameInfo, DropDetector
+
+
+@dataclass
+class FrameRecord:
+    """Everything the pipeline knows about one inspected frame."""
+
+    # Host time the frame was grabbed, in nanoseconds since the epoch
+    timestamp_ns: int
+    camera_timestamp: int
+    frame_id: Optional[int]
+    # Angle of the bottle in degrees, None unless sampling by rotation
+    angle: Optional[float]
+    # Number of frames lost just before this one
+    dropped: int
+    config_version: int
+    # Exposure in ms, which varies from frame to frame when bracketing
+    exposure: float
+    sampletime: int
+    sums: list[int]
+    stats: list[RegionStats]
+    region_results: list[Result]
+    overall_result: Result
+    result: Result
+    # Outputs of the other analyzers that ran on this frame, e.g. "focus"
+    extras: dict = field(default_factory=dict)
+    # Position of the exposure in the bracket, None unless bracketing
+    exposure_index: Optional[int] = None
+
+    @property
+    def timestamp(self) -> str:
+        seconds, ns = divmod(self.timestamp_ns, 10**9)
+        now = datetime.datetime.fromtimestamp(seconds).replace(microsecond=ns // 1000)
+        return now.strftime(r"%Y-%m-%d %H:%M:%S.%f")
+
+    @property
+    def part_result(self) -> Result:
+        return combine_results(self.region_results)
+
+    def to_dict(self) -> dict:
+        """Returns the record in the format saved to the measurement files."""
+        data_dict = {}
+        data_dict["timestamp_ns"] = self.timestamp_ns
+        data_dict["camera_timestamp"] = self.camera_timestamp
+        data_dict["frame_id"] = self.frame_id
+        data_dict["angle"] = self.angle
+        data_dict["dropped"] = self.dropped
+        data_dict["exposure"] = self.exposure
+        data_dict["exposure_index"] = self.exposure_index
+        data_dict["sampletime"] = self.sampletime
+        data_dict["config_version"] = self.config_version
+        for i, data_sum in enumerate(self.sums):
+            data_dict[f"dataSum{i + 1}"] = int(data_sum)
+        for i, stats in enumerate(self.stats):
+            data_dict[f"dataMean{i + 1}"] = round(stats.mean, 3)
+            data_dict[f"dataMax{i + 1}"] = stats.max
+            data_dict[f"dataPercentile{i + 1}"] = stats.percentile
+            data_dict[f"dataSaturated{i + 1}"] = stats.saturated
+            data_dict[f"dataCentroid{i + 1}"] = (
+                None if stats.centroid is None else [round(c, 2) for c in stats.centroid]
+            )
+        data_dict.update(self.extras)
+        data_dict["result"] = self.result.name
+        return data_dict
+
+
+def classify_region(stats: RegionStats, thresholds) -> Result:
+    """
+    Classifies a region by its sum and, if there are "saturated" thresholds,
+    by its number of saturated pixels, so a small bright defect is caught
+    even when it barely changes the sum.
+    """
+    result = classify(stats.sum, thresholds)
+    if "saturated" in thresholds:
+        result = combine_results([result, classify(stats.saturated, thresholds["saturated"])])
+    return result
+
+
+def exposure_thresholds(thresholds, exposure: Optional[float], reference: float):
+    """
+    Thresholds for a frame taken at `exposure` ms, when they are set for the
+    `reference` exposure. Sums grow with the exposure, so the limits are
+    scaled with it. Saturated pixel limits only hold at the reference
+    exposure and are left out at the others.
+    """
+    if exposure is None or exposure == reference:
+        return thresholds
+    scale = exposure / reference
+    return {"accept": thresholds["accept"] * scale, "inspect": thresholds["inspect"] * scale}
+
+
+class InspectionPipeline:
+    """
+    Turns frames into results: measures the regions of interest, classifies them,
+    publishes the result, and saves the record.
+
+    The result is published as soon as it is known, before anything is drawn,
+    so the reject actuator does not wait for the GUI.
+
+    Settings come from the config service's current snapshot, taken once per
+    frame, so a config change never applies to half a frame.
+
+    With an `analyzer`, frames are analysed in worker processes by `submit`.
+    Records are still classified, published and saved one at a time, in the
+    order the frames were submitted.
+
+    Each frame is measured by the `analyzers` (by default only the region
+    statistics), run by an AnalyzerScheduler. With a PanoramaAnalyzer, the
+    unwrapped image of the bottle is saved at the end of the session.
+    """
+
+    def __init__(
+        self,
+        config_service: ConfigService,
+        metrics: Optional[PipelineMetrics] = None,
+        publisher: Optional[ResultPublisher] = None,
+        analyzer: Optional[ParallelAnalyzer] = None,
+        analyzers: Optional[list[Analyzer]] = None,
+    ):
+        self.config_service = config_service
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.publisher = publisher
+        self.analyzer = analyzer
+        if analyzers is None:
+            analyzers = [RegionStatisticsAnalyzer()]
+        self.scheduler = AnalyzerScheduler(analyzers, self.metrics)
+        # The worker processes compute the region statistics
+        self._exclude = (RegionStatisticsAnalyzer.name,) if analyzer is not None else ()
+        # Frames submitted to the analyzer, by sequence number
+        self._pending: dict[int, tuple] = {}
+        self.jsonsaver = None
+        self.session_dir = None
+        self.summary = SessionSummary()
+        self.drop_detector = DropDetector()
+        self.bottle_result = Result.NO_BOTTLE
+        self.last_camera_timestamp = 0
+
+    def start_session(self, session_dir: Path):
+        self.session_dir = Path(session_dir)
+        self.jsonsaver = JSONSaver(str(self.session_dir / "measurement"))
+        self.summary = SessionSummary()
+        self.drop_detector.reset()
+        self.bottle_result = Result.NO_BOTTLE
+        if self.publisher is not None:
+            self.publisher.latency = LatencyTracker()
+        self.scheduler.reset()
+
+    @property
+    def panorama(self) -> Optional[Panorama]:
+        analyzer = self.scheduler.get(PanoramaAnalyzer.name)
+        return analyzer.panorama if analyzer is not None else None
+
+    def _begin(self, frame, frame_info, t_grabbed, snapshot) -> tuple:
+        """
+        Checks for lost frames and runs the analyzers. Returns the analyzer
+        outputs and the arguments for `_complete`.
+        """
+        t_start = time.perf_counter()
+        if frame_info is None:
+            frame_info = FrameInfo(time.time_ns())
+        if t_grabbed is None:
+            t_grabbed = t_start
+        if snapshot is None:
+            snapshot = self.config_service.snapshot
+        dropped = self.drop_detector.check(frame_info)
+        if dropped:
+            self.frame_dropped(dropped)
+        context = {"frame": frame, "frame_info": frame_info, "snapshot": snapshot}
+        self.scheduler.run(context, self._exclude)
+        extras = self.scheduler.saved_outputs(context)
+        return context, (frame_info, dropped, t_grabbed, snapshot, t_start, extras)
+
+    def process(
+        self,
+        frame: np.ndarray,
+        frame_info: Optional[FrameInfo] = None,
+        t_grabbed: Optional[float] = None,
+        snapshot: Optional[ConfigSnapshot] = None,
+    ) -> FrameRecord:
+        """
+        Inspects one (cropped) frame. `frame_info` identifies the frame, and is
+        used to detect frames lost before it. `t_grabbed` is the
+        time.perf_counter value taken when the frame was retrieved, used to
+        measure latency. `snapshot` is the config the frame was grabbed with,
+        by default the current one.
+        """
+        context, meta = self._begin(frame, frame_info, t_grabbed, snapshot)
+        return self._complete(context["stats"], *meta)
+
+    def submit(
+        self,
+        frame: np.ndarray,
+        frame_info: Optional[FrameInfo] = None,
+        t_grabbed: Optional[float] = None,
+        snapshot: Optional[ConfigSnapshot] = None,
+    ) -> list[FrameRecord]:
+        """
+        Like `process`, but hands the analysis to the analyzer if there is one.
+        Returns the records of every frame finished since the last call, in
+        frame order. This may be empty, or include frames from earlier calls.
+        """
+        if self.analyzer is None:
+            return [self.process(frame, frame_info, t_grabbed, snapshot)]
+
+        context, meta = self._begin(frame, frame_info, t_grabbed, snapshot)
+        snapshot = context["snapshot"]
+        options = statistics_options(snapshot, context["frame_info"].bit_depth)
+        seq = self.analyzer.submit(frame, snapshot.regions, **options)
+        self._pending[seq] = meta
+        return self._collect()
+
+    def _collect(self, wait: bool = False) -> list[FrameRecord]:
+        records = []
+        for seq, stats in self.analyzer.collect(wait):
+            meta = self._pending.pop(seq)
+            if stats is None:
+                # The analysis failed, there is no result to act on
+                self.frame_dropped()
+                continue
+            records.append(self._complete(stats, *meta))
+        return records
+
+    def skip(self, frame_info: FrameInfo):
+        """
+        Notes a frame that was grabbed but is deliberately not inspected, so
+        that it is not later mistaken for a lost frame.
+        """
+        dropped = self.drop_detector.check(frame_info)
+        if dropped:
+            self.frame_dropped(dropped)
+
+    def frame_dropped(self, count: int = 1):
+        """Counts frames that were lost, or failed to grab or to analyse."""
+        self.metrics.frames_dropped.inc(count)
+        self.summary.add_dropped(count)
+
+    def _complete(
+        self,
+        stats: list[RegionStats],
+        frame_info: FrameInfo,
+        dropped: int,
+        t_grabbed: float,
+        snapshot: ConfigSnapshot,
+        t_start: float,
+        extras: dict,
+    ) -> FrameRecord:
+        sums = [region.sum for region in stats]
+        exposure = frame_info.exposure if frame_info.exposure is not None else snapshot.exposure
+        individual = exposure_thresholds(
+            snapshot.thresholds_individual, frame_info.exposure, snapshot.exposure
+        )
+        overall = exposure_thresholds(
+            snapshot.thresholds_overall, frame_info.exposure, snapshot.exposure
+        )
+        region_results = [classify_region(region, individual) for region in stats]
+        overall_result = classify(sum(sums), overall)
+        result = combine_results([combine_results(region_results), overall_result])
+        t_analysed = time.perf_counter()
+
+        if self.publisher is not None:
+            self.publisher.publish(
+                result, frame_info.camera_timestamp, region_results, t_grabbed=t_grabbed
+            )
+        t_published = time.perf_counter()
+
+        record = FrameRecord(
+            timestamp_ns=frame_info.host_timestamp_ns,
+            camera_timestamp=frame_info.camera_timestamp,
+            frame_id=frame_info.frame_id,
+            angle=frame_info.angle,
+            dropped=dropped,
+            config_version=snapshot.version,
+            exposure=exposure,
+            sampletime=snapshot.sampletime,
+            sums=sums,
+            stats=stats,
+            region_results=region_results,
+            overall_result=overall_result,
+            result=result,
+            extras=extras,
+            exposure_index=frame_info.exposure_index,
+        )
+        self.bottle_result = combine_results([self.bottle_result, result])
+        self.last_camera_timestamp = frame_info.camera_timestamp
+        self.summary.add(record)
+
+        if self.jsonsaver is not None:
+            self.jsonsaver.add_data(record.to_dict())
+        t_saved = time.perf_counter()
+
+        self.metrics.observe_stage("analysis", t_analysed - t_start)
+        self.metrics.observe_stage("publish", t_published - t_grabbed)
+        self.metrics.observe_stage("save", t_saved - t_published)
+        self.metrics.results[result].inc()
+        for i, data_sum in enumerate(sums):
+            self.metrics.region_sum(i).set(data_sum)
+        self.metrics.frames_processed.inc()
+        return record
+
+    def flush(self) -> list[FrameRecord]:
+        """
+        Waits for the frames still being analysed, and returns their records
+        in frame order.
+        """
+        if self.analyzer is None or not self._pending:
+            return []
+        return self._collect(wait=True)
+
+    def end_session(self) -> Optional[dict]:
+        """
+        Publishes the result of the whole sample period and saves remaining
+        data. Returns the session summary, or None if there was no session.
+        Records of frames still being analysed are saved but not returned,
+        call `flush` first to show them.
+        """
+        self.flush()
+        if self.publisher is not None and self.bottle_result != Result.NO_BOTTLE:
+            self.publisher.publish(
+                self.bottle_result, self.last_camera_timestamp, [], FLAG_BOTTLE
+            )
+            self.bottle_result = Result.NO_BOTTLE
+        if self.jsonsaver is not None:
+            self.jsonsaver.close()
+            self.jsonsaver = None
+        if self.panorama is not None and self.session_dir is not None:
+            path = self.panorama.save(self.session_dir / "panorama.png")
+            if path is not None:
+                print(f"Saved panorama ({self.panorama.coverage:.0%} of a rotation) to {path}")
+        if self.session_dir is not None:
+            with open(self.session_dir / "analyzer_timing.json", "w") as f:
+                json.dump(self.scheduler.report(), f, indent=4)
+        if self.publisher is not None and self.session_dir is not None:
+            report = self.publisher.report()
+            print(
+                "Grab to publish latency: p50 {p50_ms:.3f} ms, p99 {p99_ms:.3f} ms, "
+                "max {max_ms:.3f} ms".format(**report)
+            )
+            with open(self.session_dir / "publish_latency.json", "w") as f:
+                json.dump(report, f, indent=4)
+        summary = None
+        if self.session_dir is not None:
+            summary = self.summary.save(self.session_dir / "summary.json")
+        self.session_dir = None
+        return summary
+
+    def close(self):
+        self.end_session()
+        if self.analyzer is not None:
+            self.analyzer.close()
+        if self.publisher is not None:
+            self.publisher.close()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+from typing import Optional
+
+import numpy as np
+
+# Significant bits of each monochrome pixel format
+BIT_DEPTHS = {
+    "Mono8": 8,
+    "Mono10": 10,
+    "Mono10p": 10,
+    "Mono12": 12,
+    "Mono12p": 12,
+    "Mono16": 16,
+}
+# Packed formats: pixels per group, and bytes per group
+PACKED_FORMATS = {"Mono10p": (4, 5), "Mono12p": (2, 3)}
+
+
+def bit_depth(pixel_format: Optional[str]) -> int:
+    """Significant bits per pixel of a pixel format, 8 if unknown."""
+    return BIT_DEPTHS.get(pixel_format, 8)
+
+
+def scale_level(level, bits: int):
+    """
+    Converts a pixel value on the 8-bit scale (0-255), such as the saturation
+    level, to the scale of pixels with `bits` significant bits.
+    """
+    if bits == 8:
+        return level
+    scaled = level * ((1 << bits) - 1) / 255
+    return round(scaled) if isinstance(level, int) else scaled
+
+
+def to_8bit(image: np.ndarray, bits: int = 8) -> np.ndarray:
+    """Scales an image with `bits` significant bits per pixel to 8 bits, for display."""
+    if image.dtype == np.uint8:
+        return image
+    if bits > 8:
+        image = image >> (bits - 8)
+    return np.minimum(image, 255).astype(np.uint8)
+
+
+def _layout(bits: int, pixels: int) -> list[list[tuple[int, int, int, int]]]:
+    """
+    Where the bits of each pixel of a group are, least significant bit
+    first: for each pixel, a (byte, right shift, mask, left shift) per byte
+    it has bits in.
+    """
+    layout = []
+    for pixel in range(pixels):
+        start = pixel * bits
+        terms = []
+        for byte in range(start // 8, (start + bits - 1) // 8 + 1):
+            low = max(start, 8 * byte) - 8 * byte
+            high = min(start + bits, 8 * byte + 8) - 8 * byte
+            terms.append((byte, low, (1 << (high - low)) - 1, 8 * byte + low - start))
+        layout.append(terms)
+    return layout
+
+
+class Unpacker:
+    """
+    Unpacks frames of a packed pixel format (Mono10p or Mono12p) into a
+    uint16 image. Packed formats send 10 or 12 bits per pixel instead of 16,
+    least significant bit first: Mono10p packs 4 pixels into 5 bytes, and
+    Mono12p 2 pixels into 3 bytes.
+
+    Only the rows that are inspected are unpacked, straight from the grab
+    buffer, with a few vectorized shifts per pixel of a group. The image is
+    unpacked into a buffer reused from frame to frame, so it is only valid
+    until the next call.
+
+    pypylon's `Array` and `GetArrayZeroCopy` unpack the whole of a packed
+    frame themselves, so `unpack_result` reads the raw bytes through
+    `GetMemoryView` instead.
+    """
+
+    def __init__(self, pixel_format: str):
+        if pixel_format not in PACKED_FORMATS:
+            raise ValueError(f"{pixel_format} is not a packed pixel format")
+        self.pixel_format = pixel_format
+        self.bits = BIT_DEPTHS[pixel_format]
+        self.pixels, self.group_bytes = PACKED_FORMATS[pixel_format]
+        self._layout = _layout(self.bits, self.pixels)
+        self._image = None
+        self._scratch = None
+
+    def unpack(
+        self,
+        packed: np.ndarray,
+        width: int,
+        height: int,
+        rows: Optional[tuple[int, int]] = None,
+        padding: int = 0,
+    ) -> np.ndarray:
+        """
+        Unpacks the rows `rows` (first, last) of a packed frame of `width` ×
+        `height` pixels, given as a flat uint8 array. Rows are `padding`
+        bytes longer than the pixels in them.
+        """
+        if width % self.pixels:
+            raise ValueError(f"{self.pixel_format} needs a width divisible by {self.pixels}")
+        first, last = rows if rows is not None else (0, height)
+        last = min(last, height)
+        groups_per_row = width // self.pixels
+        row_bytes = groups_per_row * self.group_bytes + padding
+        data = packed[first * row_bytes : last * row_bytes].reshape(last - first, row_bytes)
+        groups = data[:, : groups_per_row * self.group_bytes].reshape(
+            last - first, groups_per_row, self.group_bytes
+        )
+
+        shape = (last - first, width)
+        if self._image is None or self._image.shape != shape:
+            self._image = np.empty(shape, np.uint16)
+            self._scratch = np.empty(shape[:1] + (groups_per_row,), np.uint16)
+        pixels = self._image.reshape(shape[0], groups_per_row, self.pixels)
+        scratch = self._scratch
+        for index, terms in enumerate(self._layout):
+            pixel = pixels[:, :, index]
+            for n, (byte, right, mask, left) in enumerate(terms):
+                target = pixel if n == 0 else scratch
+                source = groups[:, :, byte]
+                if right:
+                    np.right_shift(source, right, out=target, dtype=np.uint16)
+                    source = target
+                if mask != 0xFF:
+                    np.bitwise_and(source, mask, out=target, dtype=np.uint16)
+                    source = target
+                if left:
+                    np.left_shift(source, left, out=target, dtype=np.uint16)
+                    source = target
+                if source is not target:
+                    target[...] = source
+                if n:
+                    np.bitwise_or(pixel, scratch, out=pixel)
+        return self._image
+
+    def unpack_result(self, result, rows: Optional[tuple[int, int]] = None) -> np.ndarray:
+        """
+        Unpacks the rows `rows` of a pylon grab result (or PylonImage) of
+        the packed format, without copying the frame first.
+        """
+        with result.GetMemoryView() as view:
+            return self.unpack(
+                np.frombuffer(view, np.uint8), result.Width, result.Height, rows, result.PaddingX
+            )
+
+
+def pack(image: np.ndarray, pixel_format: str) -> np.ndarray:
+    """Packs a uint16 image into a flat uint8 array of a packed format, as a camera would."""
+    bits = BIT_DEPTHS[pixel_format]
+    pixels, group_bytes = PACKED_FORMATS[pixel_format]
+    values = image.reshape(-1, pixels).astype(np.uint64)
+    word = np.zeros(len(values), np.uint64)
+    for index in range(pixels):
+        word |= values[:, index] << np.uint64(index * bits)
+    shifts = np.arange(group_bytes, dtype=np.uint64) * np.uint64(8)
+    return ((word[:, None] >> shifts) & np.uint64(0xFF)).astype(np.uint8).ravel()
+
+
+def main():
+    # Example usage: unpack the inspected rows of packed frames, checked
+    # against pylon's own unpacking of the same buffer
+    import time
+
+    from pypylon import pylon
+
+    rng = np.random.default_rng(0)
+    for pixel_format in PACKED_FORMATS:
+        frame = rng.integers(0, 1 << bit_depth(pixel_format), (1040, 1024), dtype=np.uint16)
+        packed = pack(frame, pixel_format)
+        raw = packed.tobytes()
+        pylon_image = pylon.PylonImage()
+        pixel_type = getattr(pylon, f"PixelType_{pixel_format}")
+        pylon_image.AttachBytesObject(raw, pixel_type, 1024, 1040, 0)
+        assert np.array_equal(pylon_image.GetArray(), frame)
+
+        unpacker = Unpacker(pixel_format)
+        image = unpacker.unpack_result(pylon_image, rows=(400, 800))
+        assert np.array_equal(image, frame[400:800])
+
+        n = 100
+        t_start = time.perf_counter()
+        for _ in range(n):
+            unpacker.unpack_result(pylon_image, rows=(400, 800))
+        t_unpack = (time.perf_counter() - t_start) / n
+        print(
+            f"{pixel_format}: {packed.nbytes / frame.nbytes:.0%} of the bytes of Mono16, "
+            f"400 rows unpacked in {t_unpack * 1e3:.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
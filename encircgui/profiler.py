@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import argparse
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Low overhead sampling profiler. A background thread looks at the stack
+    of one thread every `interval` seconds and counts each distinct stack,
+    without slowing the profiled thread down in between.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # The profiled thread has exited
+                break
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path: Path):
+        """Writes the stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class Profiler:
+    """
+    Profiles the calling thread for a while: cProfile for exact call counts
+    and times, a StackSampler for a flame graph, and a tracemalloc snapshot
+    at the start and the end to find where memory was allocated in between.
+
+    `stop` writes to a directory:
+    - `profile.pstats`: the cProfile statistics, for pstats or snakeviz
+    - `profile.txt`: the functions with the highest cumulative time
+    - `profile.collapsed`: the sampled stacks, for flamegraph.pl or speedscope
+    - `allocations.txt`: the lines that allocated the most memory
+    """
+
+    def __init__(self, interval: float = 0.005, top: int = 30):
+        self.interval = interval
+        self.top = top
+        self._profile = None
+        self._sampler = None
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self.t_start = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._started_tracemalloc = not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._sampler = StackSampler(interval=self.interval)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        self.t_start = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self, output_dir: Path) -> Optional[Path]:
+        """Stops profiling and writes the results to `output_dir`, which is returned."""
+        if not self.running:
+            return None
+        self._profile.disable()
+        duration = time.perf_counter() - self.t_start
+        self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self._profile.dump_stats(str(output_dir / "profile.pstats"))
+        with open(output_dir / "profile.txt", "w") as f:
+            f.write(f"Profiled for {duration:.2f} s\n\n")
+            stats = pstats.Stats(self._profile, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        self._sampler.write_collapsed(output_dir / "profile.collapsed")
+        self._write_allocations(self._snapshot, snapshot, output_dir / "allocations.txt")
+
+        self._profile = None
+        self._sampler = None
+        self._snapshot = None
+        return output_dir
+
+    def _write_allocations(self, before, after, path: Path):
+        ignore = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        )
+        differences = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        with open(path, "w") as f:
+            f.write(f"Top {self.top} allocation sites, by memory allocated while profiling\n\n")
+            for difference in differences[: self.top]:
+                f.write(f"{difference}\n")
+
+
+def main():
+    # Example usage: profile a script
+    parser = argparse.ArgumentParser(description="Profile a Python script")
+    parser.add_argument("script", type=Path)
+    parser.add_argument("--output", type=Path, default=Path("profile"))
+    args = parser.parse_args()
+
+    sys.argv = [str(args.script)]
+    sys.path.insert(0, str(args.script.parent))
+    code = compile(args.script.read_text(), str(args.script), "exec")
+    profiler = Profiler()
+    profiler.start()
+    try:
+        exec(code, {"__name__": "__main__", "__file__": str(args.script)})
+    finally:
+        print(f"Saved profile to {profiler.stop(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
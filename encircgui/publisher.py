@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from result import Result
+
+# Message layout (little endian):
+#   magic "EC", version, flags, sequence number (uint32),
+#   camera timestamp (uint64), result, number of regions,
+#   followed by one byte per region result.
+HEADER = struct.Struct("<2sBBIQBB")
+MAGIC = b"EC"
+VERSION = 1
+
+FLAG_BOTTLE = 0x01  # Message is the combined result of a whole sample period
+
+# Unsent TCP data beyond this many bytes means the receiver is not keeping up
+MAX_PENDING_BYTES = 64 * 1024
+
+
+@dataclass
+class ResultMessage:
+    sequence: int
+    camera_timestamp: int
+    result: Result
+    region_results: list[Result]
+    flags: int = 0
+
+    @property
+    def is_bottle(self) -> bool:
+        return bool(self.flags & FLAG_BOTTLE)
+
+
+def encode_message(message: ResultMessage) -> bytes:
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        message.flags,
+        message.sequence & 0xFFFFFFFF,
+        message.camera_timestamp & 0xFFFFFFFFFFFFFFFF,
+        int(message.result),
+        len(message.region_results),
+    )
+    return header + bytes(int(result) for result in message.region_results)
+
+
+def decode_message(data: bytes, offset: int = 0) -> tuple[ResultMessage, int]:
+    """Decodes the message at `offset`. Returns the message and its size in bytes."""
+    magic, version, flags, sequence, camera_timestamp, result, n_regions = (
+        HEADER.unpack_from(data, offset)
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a result message: {data[offset:offset + HEADER.size]!r}")
+    start = offset + HEADER.size
+    regions = data[start : start + n_regions]
+    if len(regions) != n_regions:
+        raise ValueError("Truncated result message")
+    message = ResultMessage(
+        sequence=sequence,
+        camera_timestamp=camera_timestamp,
+        result=Result(result),
+        region_results=[Result(region) for region in regions],
+        flags=flags,
+    )
+    return message, HEADER.size + n_regions
+
+
+class LatencyTracker:
+    """Keeps the most recent `size` latencies (in seconds) for percentile reports."""
+
+    def __init__(self, size: int = 10000):
+        self.samples = np.zeros(size)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        n = min(self.count, len(self.samples))
+        if n == 0:
+            return 0.0
+        return float(np.percentile(self.samples[:n], q))
+
+    def report(self) -> dict:
+        n = min(self.count, len(self.samples))
+        window = self.samples[:n]
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": float(window.max()) * 1000 if n else 0.0,
+        }
+
+
+class ResultPublisher:
+    """
+    Sends each result as a compact binary message to the reject actuator.
+
+    Sending never blocks the inspection loop: UDP datagrams are fire and forget,
+    and TCP uses a non-blocking socket where anything the kernel does not accept
+    is kept and sent before the next message. If the connection is lost, messages
+    are dropped and a reconnect is attempted at most once per `retry_interval`.
+    """
+
+    def __init__(
+        self,
+        transport: str = "udp",
+        host: str = "127.0.0.1",
+        port: int = 9200,
+        connect_timeout: float = 0.05,
+        retry_interval: float = 1.0,
+    ):
+        if transport not in ("udp", "tcp"):
+            raise ValueError(f"Unknown transport {transport!r}, expected 'udp' or 'tcp'")
+        self.transport = transport
+        self.address = (host, port)
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+        self.latency = LatencyTracker()
+
+        self._sock = None
+        self._pending = b""
+        self._next_connect = 0.0
+        self._connect()
+
+    def _connect(self):
+        self._next_connect = time.monotonic() + self.retry_interval
+        try:
+            if self.transport == "udp":
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect(self.address)
+            else:
+                sock = socket.create_connection(self.address, self.connect_timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setblocking(False)
+        except OSError as e:
+            print(f"Result publisher could not connect to {self.address}: {e}")
+            return
+        self._sock = sock
+        self._pending = b""
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._pending = b""
+
+    def _send(self, data: bytes) -> bool:
+        if self._sock is None:
+            if time.monotonic() < self._next_connect:
+                return False
+            self._connect()
+            if self._sock is None:
+                return False
+        try:
+            if self.transport == "udp":
+                self._sock.send(data)
+                return True
+            data = self._pending + data
+            sent = self._sock.send(data)
+            self._pending = data[sent:]
+            if len(self._pending) > MAX_PENDING_BYTES:
+                print("Result receiver is not keeping up, reconnecting")
+                self._disconnect()
+            return True
+        except BlockingIOError:
+            if self.transport == "tcp":
+                # Socket buffer full, send with the next message
+                self._pending = data
+                return True
+            return False
+        except OSError:
+            # Connection refused/reset, try again later
+            self._disconnect()
+            return False
+
+    def publish(
+        self,
+        result: Result,
+        camera_timestamp: int,
+        region_results: list[Result],
+        flags: int = 0,
+        t_grabbed: float = None,
+    ) -> bool:
+        """
+        Publishes a result. If `t_grabbed` (a time.perf_counter value taken when
+        the frame was retrieved) is given, the grab to publish latency is recorded.
+        Returns False if the message had to be dropped.
+        """
+        message = ResultMessage(
+            self.sequence, camera_timestamp, result, region_results, flags
+        )
+        self.sequence += 1
+        ok = self._send(encode_message(message))
+        if ok:
+            self.sent += 1
+        else:
+            self.dropped += 1
+        if t_grabbed is not None:
+            self.latency.add(time.perf_counter() - t_grabbed)
+        return ok
+
+    def report(self) -> dict:
+        report = self.latency.report()
+        report["sent"] = self.sent
+        report["dropped"] = self.dropped
+        return report
+
+    def close(self):
+        self._disconnect()
+
+
+class ResultListener:
+    """
+    Minimal receiver for result messages, standing in for the reject gate when
+    testing the publisher. Received messages are appended to `messages`.
+    """
+
+    def __init__(self, transport: str = "udp", host: str = "127.0.0.1", port: int = 9200):
+        self.transport = transport
+        self.messages: list[ResultMessage] = []
+        kind = socket.SOCK_DGRAM if transport == "udp" else socket.SOCK_STREAM
+        self._sock = socket.socket(socket.AF_INET, kind)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._sock.bind((host, port))
+        if transport == "tcp":
+            self._sock.listen(1)
+        self._running = True
+        self.thread = threading.Thread(target=self._run, name="result-listener", daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._sock.getsockname()
+
+    def _run(self):
+        try:
+            if self.transport == "udp":
+                while self._running:
+                    data = self._sock.recv(65536)
+                    self.messages.append(decode_message(data)[0])
+            else:
+                conn, _ = self._sock.accept()
+                buf = b""
+                while self._running:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    buf += chunk
+                    while len(buf) >= HEADER.size:
+                        size = HEADER.size + buf[HEADER.size - 1]
+                        if len(buf) < size:
+                            break
+                        self.messages.append(decode_message(buf)[0])
+                        buf = buf[size:]
+                conn.close()
+        except OSError:
+            # Socket closed
+            pass
+
+    def close(self):
+        self._running = False
+        self._sock.close()
+
+
+def main():
+    # Example usage: publish to a local stand-in listener and report latency
+    for transport in ("udp", "tcp"):
+        listener = ResultListener(transport, port=0)
+        publisher = ResultPublisher(transport, *listener.address)
+
+        for i in range(1000):
+            t_grabbed = time.perf_counter()
+            result = Result.REJECT if i % 10 == 0 else Result.ACCEPT
+            publisher.publish(result, i * 1000, [result] * 4, t_grabbed=t_grabbed)
+        publisher.publish(Result.REJECT, 1000 * 1000, [Result.REJECT] * 4, FLAG_BOTTLE)
+
+        time.sleep(0.2)
+        publisher.close()
+        listener.close()
+        rejects = sum(m.result == Result.REJECT for m in listener.messages)
+        print(
+            f"{transport}: received {len(listener.messages)} messages "
+            f"({rejects} rejects), latency {publisher.report()}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,3 +12,13 @@ class Result(IntEnum):
 
 def combine_results(results: list[Result]) -> Result:
     return max(results)
+
+
+def classify(value: float, thresholds: dict) -> Result:
+    """Classifies `value` against a dict with "accept" and "inspect" thresholds."""
+    if value < thresholds["accept"]:
+        return Result.ACCEPT
+    elif value <= thresholds["inspect"]:
+        return Result.INSPECT
+    else:
+        return Result.REJECT
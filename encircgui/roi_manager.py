@@ -10,11 +10,15 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QSpinBox,
     QApplication,
-    QComboBox
+    QComboBox,
+    QPushButton,
+    QSizePolicy,
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QRect, QPoint, pyqtSignal
 import qimage2ndarray
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor
+
+from utils import region_dict, region_color
 
 
 @dataclass
@@ -24,160 +28,332 @@ class RegionOfInterest:
     x2: int = None
     y2: int = None
 
+    def normalized(self) -> "RegionOfInterest":
+        """Returns the same region with (x1, y1) as the top left corner."""
+        return RegionOfInterest(
+            min(self.x1, self.x2), min(self.y1, self.y2),
+            max(self.x1, self.x2), max(self.y1, self.y2),
+        )
+
+    def contains(self, x: int, y: int) -> bool:
+        roi = self.normalized()
+        return roi.x1 <= x <= roi.x2 and roi.y1 <= y <= roi.y2
+
+    def to_region_dict(self) -> dict:
+        roi = self.normalized()
+        return region_dict(roi.x1, roi.y1, roi.x2, roi.y2)
+
+    @classmethod
+    def from_region_dict(cls, reg_dict) -> "RegionOfInterest":
+        return cls(reg_dict["x_low"], reg_dict["y_low"], reg_dict["x_high"], reg_dict["y_high"])
+
+
+class ROICanvas(QWidget):
+    """
+    Shows an image with the regions of interest drawn on top.
+
+    The image is scaled to the widget size once, when it is set or the widget is
+    resized, and cached as a QPixmap. The ROIs are painted over it with QPainter,
+    and dragging only repaints the area around the ROI being edited, so editing
+    does not depend on the size of the source image.
+    """
+
+    # Emitted with (index, RegionOfInterest) while an ROI is dragged
+    roiEdited = pyqtSignal(int, object)
+    # Emitted with (index, RegionOfInterest) when the drag is finished
+    roiFinished = pyqtSignal(int, object)
+    # Emitted with the index of an ROI selected by clicking on it
+    roiSelected = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.rois: list[RegionOfInterest] = []
+        self.current_roi_index = 0
+        self._pixmap = None
+        self._scale = 1.0
+        self._offset = QPoint(0, 0)
+        self._drag_mode = None
+        self._drag_start = None
+        self._drag_roi = None
+        self.setMinimumSize(200, 100)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.setMouseTracking(False)
+
+    @property
+    def dragging(self) -> bool:
+        return self._drag_mode is not None
+
+    def set_image(self, image: np.ndarray):
+        self.image = image
+        self._rescale()
+        self.update()
+
+    def set_rois(self, rois: list[RegionOfInterest], current_roi_index: int = None):
+        self.rois = list(rois)
+        if current_roi_index is not None:
+            self.current_roi_index = current_roi_index
+        self.current_roi_index = min(self.current_roi_index, max(len(self.rois) - 1, 0))
+        self.update()
+
+    def resizeEvent(self, event):
+        self._rescale()
+        super().resizeEvent(event)
+
+    def _rescale(self):
+        """Scales the image to fit the widget and caches it as a pixmap."""
+        if self.image is None:
+            self._pixmap = None
+            return
+        image = self.image
+        if image.ndim == 3 and image.shape[2] == 2:
+            # Dart camera, show the first channel
+            image = image[:, :, 0]
+        height, width = image.shape[:2]
+        self._scale = min(self.width() / width, self.height() / height)
+        size = (max(int(width * self._scale), 1), max(int(height * self._scale), 1))
+        scaled = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if scaled.dtype != np.uint8:
+            scaled = cv2.normalize(scaled, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+        self._pixmap = QPixmap.fromImage(qimage2ndarray.array2qimage(scaled))
+        self._offset = QPoint(
+            (self.width() - self._pixmap.width()) // 2,
+            (self.height() - self._pixmap.height()) // 2,
+        )
+
+    def _to_image(self, pos: QPoint) -> tuple[int, int]:
+        x = (pos.x() - self._offset.x()) / self._scale
+        y = (pos.y() - self._offset.y()) / self._scale
+        if self.image is not None:
+            x = min(max(x, 0), self.image.shape[1])
+            y = min(max(y, 0), self.image.shape[0])
+        return int(round(x)), int(round(y))
+
+    def _to_widget(self, roi: RegionOfInterest) -> QRect:
+        roi = roi.normalized()
+        x1 = int(roi.x1 * self._scale) + self._offset.x()
+        y1 = int(roi.y1 * self._scale) + self._offset.y()
+        x2 = int(roi.x2 * self._scale) + self._offset.x()
+        y2 = int(roi.y2 * self._scale) + self._offset.y()
+        return QRect(QPoint(x1, y1), QPoint(x2, y2))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self._pixmap is not None:
+            painter.drawPixmap(self._offset, self._pixmap)
+        for i, roi in enumerate(self.rois):
+            if roi.x1 is None:
+                continue
+            pen = QPen(QColor(*region_color(i)))
+            pen.setWidth(3 if i == self.current_roi_index else 1)
+            painter.setPen(pen)
+            painter.drawRect(self._to_widget(roi))
+        painter.end()
+
+    def _update_roi(self, roi: RegionOfInterest):
+        old_rect = self._to_widget(self.rois[self.current_roi_index])
+        self.rois[self.current_roi_index] = roi
+        # Only repaint the area covered by the old and new rectangles
+        dirty = old_rect.united(self._to_widget(roi)).adjusted(-3, -3, 3, 3)
+        self.update(dirty)
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.LeftButton or self.image is None or not self.rois:
+            return
+        x, y = self._to_image(event.pos())
+        # Clicking inside an ROI selects it and moves it, anywhere else starts a new one
+        hits = [i for i, roi in enumerate(self.rois) if roi.x1 is not None and roi.contains(x, y)]
+        if self.current_roi_index in hits:
+            self._drag_mode = "move"
+        elif hits:
+            self.current_roi_index = hits[0]
+            self.roiSelected.emit(self.current_roi_index)
+            self._drag_mode = "move"
+            self.update()
+        else:
+            self._drag_mode = "draw"
+        self._drag_start = (x, y)
+        self._drag_roi = self.rois[self.current_roi_index].normalized() if hits else None
+
+    def mouseMoveEvent(self, event):
+        if self._drag_mode is None:
+            return
+        x, y = self._to_image(event.pos())
+        x0, y0 = self._drag_start
+        if self._drag_mode == "draw":
+            roi = RegionOfInterest(x0, y0, x, y).normalized()
+        else:
+            start = self._drag_roi
+            height, width = self.image.shape[:2]
+            dx = min(max(x - x0, -start.x1), width - start.x2)
+            dy = min(max(y - y0, -start.y1), height - start.y2)
+            roi = RegionOfInterest(start.x1 + dx, start.y1 + dy, start.x2 + dx, start.y2 + dy)
+        self._update_roi(roi)
+        self.roiEdited.emit(self.current_roi_index, roi)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() != Qt.LeftButton or self._drag_mode is None:
+            return
+        self._drag_mode = None
+        self.roiFinished.emit(self.current_roi_index, self.rois[self.current_roi_index])
+
 
 class ROIManager(QWidget):
+    """
+    Editor for any number of regions of interest, drawn over a frame.
+
+    Regions can be drawn and moved with the mouse or typed into the spin boxes.
+    `roisChanged` is emitted with the regions (as region dicts) when an edit is
+    finished.
+    """
+
+    roisChanged = pyqtSignal(list)
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        
+
         self.rois = [RegionOfInterest(0, 0, 0, 0) for _ in range(4)]
         self.current_roi_index = 0
         self.image = None
-        self.colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
-        
-        self.init_ui()
+        self.roi_controls = []
 
-        self.start_pos = None
-        self.end_pos = None
+        self.init_ui()
 
     def init_ui(self):
         main_layout = QVBoxLayout()
 
-        # Create the label for displaying images
-        self.roi_label = QLabel(self)
-        self.roi_label.setMouseTracking(True)
-        main_layout.addWidget(self.roi_label)
+        # Create the canvas for displaying images
+        self.roi_canvas = ROICanvas(self)
+        self.roi_canvas.roiEdited.connect(self._on_roi_edited)
+        self.roi_canvas.roiFinished.connect(self._on_roi_finished)
+        self.roi_canvas.roiSelected.connect(self._on_roi_selected)
+        main_layout.addWidget(self.roi_canvas, stretch=1)
 
         # Create the ROI selector combo box
+        selector_layout = QHBoxLayout()
         self.roi_selector_combo = QComboBox(self)
-        self.roi_selector_combo.addItems([f"ROI {i + 1}" for i in range(4)])
         self.roi_selector_combo.currentIndexChanged.connect(self.update_current_roi_index)
-        main_layout.addWidget(self.roi_selector_combo)
-
-        # Creating ROI control widgets for 4 ROIs
-        self.roi_controls = []
-        for i in range(4):
-            roi_layout = QHBoxLayout()
-            roi_label = QLabel(f"ROI {i + 1}")
-            roi_layout.addWidget(roi_label)
-
-            x1_spin = QSpinBox()
-            y1_spin = QSpinBox()
-            x2_spin = QSpinBox()
-            y2_spin = QSpinBox()
-            x1_spin.setRange(0, 2000)
-            y1_spin.setRange(0, 2000)
-            x2_spin.setRange(0, 2000)
-            y2_spin.setRange(0, 2000)
-
-            roi_layout.addWidget(QLabel("x1:"))
-            roi_layout.addWidget(x1_spin)
-            roi_layout.addWidget(QLabel("y1:"))
-            roi_layout.addWidget(y1_spin)
-            roi_layout.addWidget(QLabel("x2:"))
-            roi_layout.addWidget(x2_spin)
-            roi_layout.addWidget(QLabel("y2:"))
-            roi_layout.addWidget(y2_spin)
-
-            self.roi_controls.append((x1_spin, y1_spin, x2_spin, y2_spin))
-            main_layout.addLayout(roi_layout)
-
-            for spin in (x1_spin, y1_spin, x2_spin, y2_spin):
-                spin.valueChanged.connect(lambda _, idx=i: self.update_roi_from_spin(idx))
+        selector_layout.addWidget(self.roi_selector_combo)
+        self.add_roi_btn = QPushButton("Add ROI")
+        self.add_roi_btn.clicked.connect(self.add_roi)
+        selector_layout.addWidget(self.add_roi_btn)
+        self.remove_roi_btn = QPushButton("Remove ROI")
+        self.remove_roi_btn.clicked.connect(self.remove_roi)
+        selector_layout.addWidget(self.remove_roi_btn)
+        main_layout.addLayout(selector_layout)
+
+        # Spin boxes for the selected ROI
+        roi_layout = QHBoxLayout()
+        spins = []
+        for name in ("x1:", "y1:", "x2:", "y2:"):
+            spin = QSpinBox()
+            spin.setRange(0, 10000)
+            spin.valueChanged.connect(self.update_roi_from_spin)
+            roi_layout.addWidget(QLabel(name))
+            roi_layout.addWidget(spin)
+            spins.append(spin)
+        self.roi_controls = tuple(spins)
+        main_layout.addLayout(roi_layout)
 
         self.setLayout(main_layout)
-        
-        self.roi_label.mousePressEvent = self.mouse_press_event
-        self.roi_label.mouseMoveEvent = self.mouse_move_event
-        self.roi_label.mouseReleaseEvent = self.mouse_release_event
+        self._sync_widgets()
+
+    def _sync_widgets(self):
+        """Updates the combo box, spin boxes and canvas to match self.rois."""
+        self.current_roi_index = min(self.current_roi_index, max(len(self.rois) - 1, 0))
+        self.roi_selector_combo.blockSignals(True)
+        self.roi_selector_combo.clear()
+        self.roi_selector_combo.addItems([f"ROI {i + 1}" for i in range(len(self.rois))])
+        self.roi_selector_combo.setCurrentIndex(self.current_roi_index)
+        self.roi_selector_combo.blockSignals(False)
+        self.remove_roi_btn.setEnabled(len(self.rois) > 1)
+        self.roi_canvas.set_rois(self.rois, self.current_roi_index)
+        if self.rois:
+            self.update_spinbox(self.current_roi_index, self.rois[self.current_roi_index])
+
+    def _emit_rois_changed(self):
+        self.roisChanged.emit(self.get_region_dicts())
 
     def set_image(self, image: np.ndarray):
-        """Set the image and reset any existing ROIs."""
+        """Set the image shown behind the ROIs."""
         self.image = image
-        self.rois = [RegionOfInterest(0, 0, 0, 0) for _ in range(4)]
-        self.update_image()
+        self.roi_canvas.set_image(image)
+
+    @property
+    def dragging(self) -> bool:
+        return self.roi_canvas.dragging
 
     def update_current_roi_index(self, index):
         """Update the current ROI index based on the selection from the combo box."""
+        if index < 0:
+            return
         self.current_roi_index = index
-        self.update_image()
+        self.roi_canvas.set_rois(self.rois, index)
+        self.update_spinbox(index, self.rois[index])
 
-    def update_roi_from_spin(self, index):
-        """Update the ROI when the spin boxes change."""
-        self.rois[index] = self._spinbox_to_roi(index)
-        self.update_image()
+    def update_roi_from_spin(self, _=None):
+        """Update the current ROI when the spin boxes change."""
+        if not self.rois:
+            return
+        self.rois[self.current_roi_index] = self._spinbox_to_roi()
+        self.roi_canvas.set_rois(self.rois)
+        self._emit_rois_changed()
 
-    def _spinbox_to_roi(self, index: int) -> RegionOfInterest:
+    def _spinbox_to_roi(self) -> RegionOfInterest:
         """Get the values from spin boxes as a RegionOfInterest."""
-        roi_control = self.roi_controls[index]
-        roi = RegionOfInterest(
-            x1=roi_control[0].value(),
-            y1=roi_control[1].value(),
-            x2=roi_control[2].value(),
-            y2=roi_control[3].value(),
+        x1_spin, y1_spin, x2_spin, y2_spin = self.roi_controls
+        return RegionOfInterest(
+            x1=x1_spin.value(),
+            y1=y1_spin.value(),
+            x2=x2_spin.value(),
+            y2=y2_spin.value(),
         )
-        return roi
 
-    def update_image(self):
-        """Update the QLabel with the current image (with ROIs drawn)."""
-        if self.image is None:
-            return
+    def _on_roi_edited(self, index: int, roi: RegionOfInterest):
+        self.rois[index] = roi
+        self.update_spinbox(index, roi)
 
-        image_copy = self.image.copy()
-        for i, roi in enumerate(self.rois):
-            if roi.x1 is not None and roi.y1 is not None and roi.x2 is not None and roi.y2 is not None:
-                cv2.rectangle(image_copy, (roi.x1, roi.y1), (roi.x2, roi.y2), self.colors[i], 2)
-
-        qt_image = qimage2ndarray.array2qimage(image_copy)
-        self.roi_label.setPixmap(QPixmap.fromImage(qt_image))
-
-    def mouse_press_event(self, event):
-        if event.button() == Qt.LeftButton:
-            self.start_pos = event.pos()
-            self.end_pos = event.pos()  # Initialize end position
-
-    def mouse_move_event(self, event):
-        self.end_pos = event.pos()
-        self.update_image()  # Dynamically update the image
-        self.update_spin_box_from_drag() # Dynamically update the spin boxes
-
-    def mouse_release_event(self, event):
-        if event.button() == Qt.LeftButton:
-            self.end_pos = event.pos()
-            if self.start_pos is not None and self.end_pos is not None:  # Check before using the positions
-                # Store the final ROI in the list
-                self.rois[self.current_roi_index] = RegionOfInterest(
-                    x1=self.start_pos.x(), y1=self.start_pos.y(),
-                    x2=self.end_pos.x(), y2=self.end_pos.y()
-                )
-                self.update_image()
-                self.update_spin_box_from_drag()  # Ensure spin boxes reflect final ROI
-
-            # Reset positions
-            self.start_pos = None
-            self.end_pos = None
+    def _on_roi_finished(self, index: int, roi: RegionOfInterest):
+        self.rois[index] = roi
+        self.update_spinbox(index, roi)
+        self._emit_rois_changed()
+
+    def _on_roi_selected(self, index: int):
+        self.current_roi_index = index
+        self.roi_selector_combo.setCurrentIndex(index)
+
+    def add_roi(self):
+        """Adds an ROI covering the middle of the image."""
+        if self.image is not None:
+            height, width = self.image.shape[:2]
+            roi = RegionOfInterest(width // 4, height // 4, 3 * width // 4, 3 * height // 4)
+        else:
+            roi = RegionOfInterest(0, 0, 100, 100)
+        self.rois.append(roi)
+        self.current_roi_index = len(self.rois) - 1
+        self._sync_widgets()
+        self._emit_rois_changed()
+
+    def remove_roi(self):
+        if len(self.rois) <= 1:
+            return
+        del self.rois[self.current_roi_index]
+        self._sync_widgets()
+        self._emit_rois_changed()
 
     def update_spinbox(self, index: int, roi: RegionOfInterest):
-        """Update the spin boxes at the given index based on the provided ROI."""
-        x1_spin, y1_spin, x2_spin, y2_spin = self.roi_controls[index]
-        x1_spin.setValue(roi.x1)
-        y1_spin.setValue(roi.y1)
-        x2_spin.setValue(roi.x2)
-        y2_spin.setValue(roi.y2)
-
-    def update_spin_box_from_drag(self):
-        """Update the spin boxes based on the current drag positions."""
-        if self.start_pos is not None and self.end_pos is not None:
-            x1 = min(self.start_pos.x(), self.end_pos.x())
-            y1 = min(self.start_pos.y(), self.end_pos.y())
-            x2 = max(self.start_pos.x(), self.end_pos.x())
-            y2 = max(self.start_pos.y(), self.end_pos.y())
-
-            roi = RegionOfInterest(x1=x1, y1=y1, x2=x2, y2=y2)
-            self.update_spinbox(self.current_roi_index, roi)
+        """Update the spin boxes based on the provided ROI, if it is the current one."""
+        if index != self.current_roi_index:
+            return
+        for spin, value in zip(self.roi_controls, (roi.x1, roi.y1, roi.x2, roi.y2)):
+            # Don't feed the change back through update_roi_from_spin
+            spin.blockSignals(True)
+            spin.setValue(value)
+            spin.blockSignals(False)
 
     def get_roi(self, index: int):
         return self.rois[index]
-    
+
     def set_roi(self, index: int, roi: RegionOfInterest):
         """
         Set the RegionOfInterest at the specified index.
@@ -188,15 +364,22 @@ class ROIManager(QWidget):
             roi (RegionOfInterest): The RegionOfInterest object to set at the index.
         """
         self.rois[index] = roi
-        self.update_image()
+        self.roi_canvas.set_rois(self.rois)
         self.update_spinbox(index, roi)
 
     def get_rois(self):
         return self.rois
-    
-    def set_rois(self, rois: list[RegionOfInterest]):
-        for i, roi in enumerate(rois):
-            self.set_roi(i, roi)
+
+    def get_region_dicts(self) -> list[dict]:
+        return [roi.to_region_dict() for roi in self.rois]
+
+    def set_rois(self, rois: list):
+        """Replaces all ROIs. Accepts RegionOfInterest objects or region dicts."""
+        self.rois = [
+            roi if isinstance(roi, RegionOfInterest) else RegionOfInterest.from_region_dict(roi)
+            for roi in rois
+        ]
+        self._sync_widgets()
 
 
 if __name__ == "__main__":
@@ -209,10 +392,10 @@ if __name__ == "__main__":
     window = ROIManager()
 
     # Example of setting an image
-    image_bgr = cv2.imread(script_dir / "i3dr_logo.png")
+    image_bgr = cv2.imread(str(script_dir / "i3dr_logo.png"))
     image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
     window.set_image(image_rgb)
-    
+
     # Example of setting ROIs
     rois = [
         RegionOfInterest(x1=0, y1=0, x2=100, y2=100),
@@ -221,5 +404,6 @@ if __name__ == "__main__":
         RegionOfInterest(x1=300, y1=300, x2=400, y2=400),
     ]
     window.set_rois(rois)
+    window.roisChanged.connect(print)
     window.show()
     sys.exit(app.exec_())
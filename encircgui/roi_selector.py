@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import (
     QWidget,
     QLabel,
@@ -14,46 +14,70 @@ from utils import region_dict
 
 
 class ROISelector(QWidget):
-    def __init__(self, parent=None):
+    # Emitted with the new list of regions whenever a spin box is changed
+    roisChanged = pyqtSignal(list)
+
+    def __init__(self, parent=None, count: int = 4):
         super(ROISelector, self).__init__(parent)
+        self._setting_rois = False
 
-        main_layout = QVBoxLayout()
+        self.main_layout = QVBoxLayout()
 
-        # Creating ROI control widgets for 4 ROIs
+        # Creating ROI control widgets, one row per ROI
         self.roi_controls = []
-        for i in range(4):
-            roi_layout = QHBoxLayout()
-
-            # Label for the region
-            roi_label = QLabel(f"ROI {i+1}")
-            roi_layout.addWidget(roi_label)
-
-            self.x1_spin = QSpinBox()
-            self.y1_spin = QSpinBox()
-            self.x2_spin = QSpinBox()
-            self.y2_spin = QSpinBox()
-
-            # Setting min/max ranges
-            self.x1_spin.setRange(0, 2000)
-            self.y1_spin.setRange(0, 2000)
-            self.x2_spin.setRange(0, 2000)
-            self.y2_spin.setRange(0, 2000)
-
-            roi_layout.addWidget(QLabel("x1:"))
-            roi_layout.addWidget(self.x1_spin)
-            roi_layout.addWidget(QLabel("y1:"))
-            roi_layout.addWidget(self.y1_spin)
-            roi_layout.addWidget(QLabel("x2:"))
-            roi_layout.addWidget(self.x2_spin)
-            roi_layout.addWidget(QLabel("y2:"))
-            roi_layout.addWidget(self.y2_spin)
-
-            self.roi_controls.append(
-                (self.x1_spin, self.y1_spin, self.x2_spin, self.y2_spin)
-            )
-            main_layout.addLayout(roi_layout)
-
-        self.setLayout(main_layout)
+        self.roi_rows = []
+        for i in range(count):
+            self._add_row()
+
+        self.setLayout(self.main_layout)
+
+    def _add_row(self):
+        i = len(self.roi_controls)
+        row = QWidget()
+        roi_layout = QHBoxLayout()
+        roi_layout.setContentsMargins(0, 0, 0, 0)
+
+        # Label for the region
+        roi_label = QLabel(f"ROI {i+1}")
+        roi_layout.addWidget(roi_label)
+
+        x1_spin = QSpinBox()
+        y1_spin = QSpinBox()
+        x2_spin = QSpinBox()
+        y2_spin = QSpinBox()
+
+        # Setting min/max ranges
+        x1_spin.setRange(0, 2000)
+        y1_spin.setRange(0, 2000)
+        x2_spin.setRange(0, 2000)
+        y2_spin.setRange(0, 2000)
+
+        roi_layout.addWidget(QLabel("x1:"))
+        roi_layout.addWidget(x1_spin)
+        roi_layout.addWidget(QLabel("y1:"))
+        roi_layout.addWidget(y1_spin)
+        roi_layout.addWidget(QLabel("x2:"))
+        roi_layout.addWidget(x2_spin)
+        roi_layout.addWidget(QLabel("y2:"))
+        roi_layout.addWidget(y2_spin)
+
+        row.setLayout(roi_layout)
+        self.roi_controls.append((x1_spin, y1_spin, x2_spin, y2_spin))
+        self.roi_rows.append(row)
+        self.main_layout.addWidget(row)
+
+        for spin in (x1_spin, y1_spin, x2_spin, y2_spin):
+            spin.valueChanged.connect(self._emit_rois_changed)
+
+    def _remove_row(self):
+        row = self.roi_rows.pop()
+        self.roi_controls.pop()
+        self.main_layout.removeWidget(row)
+        row.deleteLater()
+
+    def _emit_rois_changed(self, _=None):
+        if not self._setting_rois:
+            self.roisChanged.emit(self.get_rois())
 
     def get_roi(self, index: int):
         # Get the values from spin boxes
@@ -82,8 +106,19 @@ class ROISelector(QWidget):
         roi_control[3].setValue(reg_dict["y_high"])
 
     def set_rois(self, rois: list[dict]):
-        for i, roi in enumerate(rois):
-            self.set_roi(i, roi)
+        # Emit a single roisChanged rather than one per spin box
+        self._setting_rois = True
+        try:
+            # Add or remove rows to match the number of ROIs
+            while len(self.roi_controls) < len(rois):
+                self._add_row()
+            while len(self.roi_controls) > len(rois):
+                self._remove_row()
+            for i, roi in enumerate(rois):
+                self.set_roi(i, roi)
+        finally:
+            self._setting_rois = False
+        self._emit_rois_changed()
 
 
 if __name__ == "__main__":
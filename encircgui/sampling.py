@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import math
+import time
+from typing import Optional
+
+from camera import FrameInfo
+
+
+class RotationSampler:
+    """
+    Samples a fixed number of evenly spaced frames over each rotation of the
+    bottle, rather than as many frames as the inspection loop manages.
+
+    With `configure_camera`, the camera itself is set to grab at exactly the
+    rate that gives one frame every `angle_step` degrees, and every frame is
+    used. Cameras that cannot be set this way (and frame sources that are not
+    cameras) are paced in software: frames keep arriving at their own rate,
+    and only the first frame at or after each angle is used.
+
+    Each used frame gets the index of its angle, counted from the first frame
+    of the session, so frames lost on the way leave a gap instead of shifting
+    the angles of the frames after them.
+    """
+
+    def __init__(self, rotation_time: float, angle_step: float = 1.0, rotations: int = 1):
+        self.rotation_time = rotation_time
+        self.frames_per_rotation = max(1, round(360 / angle_step))
+        self.angle_step = 360 / self.frames_per_rotation
+        self.rotations = rotations
+        self.hardware = False
+        self._saved_settings = None
+        self.reset()
+
+    @property
+    def period(self) -> float:
+        """Seconds between two frames."""
+        return self.rotation_time / self.frames_per_rotation
+
+    @property
+    def frame_rate(self) -> float:
+        return 1 / self.period
+
+    @property
+    def total_frames(self) -> int:
+        return self.frames_per_rotation * self.rotations
+
+    @property
+    def duration(self) -> float:
+        return self.rotation_time * self.rotations
+
+    def reset(self):
+        self._first_ns = None
+        self._first_id = None
+        self.next_index = 0
+        self.last_index = -1
+        self.used = 0
+
+    def configure_camera(self, camera) -> bool:
+        """
+        Sets the camera to grab at `frame_rate`. Returns False, and leaves the
+        pacing to software, if the camera does not support it.
+        """
+        try:
+            self._saved_settings = (
+                camera.AcquisitionFrameRateEnable.GetValue(),
+                camera.AcquisitionFrameRate.GetValue(),
+            )
+            camera.AcquisitionFrameRateEnable.SetValue(True)
+            camera.AcquisitionFrameRate.SetValue(self.frame_rate)
+            actual = camera.AcquisitionFrameRate.GetValue()
+        except Exception as e:
+            print(f"Cannot set the camera frame rate ({e}), pacing frames in software")
+            self.hardware = False
+            return False
+        if not math.isclose(actual, self.frame_rate, rel_tol=1e-3):
+            print(
+                f"The camera grabs at {actual:.3f} fps instead of {self.frame_rate:.3f} fps, "
+                "pacing frames in software"
+            )
+            self.hardware = False
+            return False
+        self.hardware = True
+        return True
+
+    def restore_camera(self, camera):
+        """Puts back the frame rate settings the camera had before `configure_camera`."""
+        if self._saved_settings is None:
+            return
+        enabled, frame_rate = self._saved_settings
+        try:
+            camera.AcquisitionFrameRate.SetValue(frame_rate)
+            camera.AcquisitionFrameRateEnable.SetValue(enabled)
+        except Exception:
+            pass
+        self._saved_settings = None
+
+    def accept(self, info: FrameInfo) -> Optional[int]:
+        """
+        Returns the angle index of the frame, or None if the frame is not
+        needed (it came before the next angle, or after the last one).
+        """
+        if self._first_ns is None:
+            self._first_ns = info.host_timestamp_ns
+            self._first_id = info.frame_id
+        if self.hardware and info.frame_id is not None and self._first_id is not None:
+            # Every frame is wanted, the frame counter says which one this is
+            index = info.frame_id - self._first_id
+        else:
+            elapsed = (info.host_timestamp_ns - self._first_ns) / 1e9
+            index = math.floor(elapsed / self.period + 1e-6)
+            if self.hardware:
+                index = max(index, self.next_index)
+        self.last_index = max(self.last_index, index)
+        if index < self.next_index or index >= self.total_frames:
+            return None
+        self.next_index = index + 1
+        self.used += 1
+        return index
+
+    def angle(self, index: int) -> float:
+        """Angle of the bottle, in degrees, at the frame with `index`."""
+        return round((index % self.frames_per_rotation) * self.angle_step, 6)
+
+    @property
+    def complete(self) -> bool:
+        """True once the last angle of the last rotation has been reached or passed."""
+        return self.last_index >= self.total_frames - 1
+
+    def timed_out(self, elapsed: float) -> bool:
+        """
+        True if the frames should long have arrived `elapsed` seconds into the
+        session, even allowing for frames waiting in the camera's buffers.
+        """
+        return elapsed > 2 * self.duration + 5
+
+
+def main():
+    # Example usage: a source grabbing at about 30 fps, sampled every 10°
+    sampler = RotationSampler(rotation_time=3.6, angle_step=10)
+    print(f"{sampler.total_frames} frames at {sampler.frame_rate:.1f} fps")
+    t0 = time.time_ns()
+    for i in range(120):
+        info = FrameInfo(t0 + i * 33_000_000, image_number=i + 1)
+        index = sampler.accept(info)
+        if index is not None:
+            print(f"Frame {info.frame_id}: {sampler.angle(index):.0f}°")
+    print(f"Used {sampler.used} frames, complete: {sampler.complete}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+from pypylon import pylon
+
+from config import (
+    DEFAULT_CONFIG_PATH,
+    ConfigError,
+    ConfigService,
+    ConfigSnapshot,
+    write_default_config,
+)
+from inspection import Inspection
+from metrics import MetricsServer, PipelineMetrics
+from pipeline import FrameRecord
+from pixelformat import to_8bit
+
+# Messages queued for a viewer beyond this are dropped, oldest first
+MAX_QUEUED_MESSAGES = 1000
+
+# Preview header: sequence number (odd while a frame is being written),
+# height, width, frame id, and height and width of the inspected image, as uint64
+_PREVIEW_HEADER = 6
+_PREVIEW_OFFSET = _PREVIEW_HEADER * 8
+
+
+def preview_image(image: np.ndarray, size: tuple[int, int], bits: int = 8) -> np.ndarray:
+    """
+    Scales an inspected image with `bits` significant bits per pixel to an
+    8-bit grayscale preview of `size` (width, height).
+    """
+    if image.ndim == 3:
+        # First channel of multi-channel (e.g. dart) images
+        image = image[:, :, 0]
+    return to_8bit(cv2.resize(image, size, interpolation=cv2.INTER_AREA), bits)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attaches to shared memory created by another process, without taking ownership."""
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # Otherwise the resource tracker unlinks it when this process exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class PreviewBuffer:
+    """
+    Latest preview frame in shared memory, written by the service and read by
+    any number of viewers. Writing never waits for readers: the sequence
+    number in the header is odd while a frame is being written, and readers
+    discard a frame if the number changed while they copied it.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.shm = shared_memory.SharedMemory(create=True, size=_PREVIEW_OFFSET + width * height)
+        self.header = np.ndarray(_PREVIEW_HEADER, dtype=np.uint64, buffer=self.shm.buf)
+        self.header[:] = (0, height, width, 0, height, width)
+        self.image = np.ndarray(
+            (height, width), dtype=np.uint8, buffer=self.shm.buf, offset=_PREVIEW_OFFSET
+        )
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, image: np.ndarray, source: np.ndarray, frame_id: Optional[int] = None):
+        """Writes a preview of `source`, the inspected image it was scaled from."""
+        self.header[0] += 1
+        self.image[...] = image
+        self.header[3:] = (frame_id or 0, source.shape[0], source.shape[1])
+        self.header[0] += 1
+
+    def close(self):
+        del self.header, self.image
+        self.shm.close()
+        self.shm.unlink()
+
+
+class PreviewReader:
+    """Reads the frames of a PreviewBuffer from another process."""
+
+    def __init__(self, name: str):
+        self.shm = _attach(name)
+        self.header = np.ndarray(_PREVIEW_HEADER, dtype=np.uint64, buffer=self.shm.buf)
+        height, width = int(self.header[1]), int(self.header[2])
+        self.image = np.ndarray(
+            (height, width), dtype=np.uint8, buffer=self.shm.buf, offset=_PREVIEW_OFFSET
+        )
+        self.sequence = 0
+        # Height and width of the inspected image of the latest frame
+        self.source_shape = (height, width)
+
+    def read(self) -> Optional[np.ndarray]:
+        """Returns a copy of the latest frame, or None if there is no new complete frame."""
+        sequence = int(self.header[0])
+        if sequence == self.sequence or sequence % 2:
+            return None
+        image = self.image.copy()
+        source_shape = (int(self.header[4]), int(self.header[5]))
+        if int(self.header[0]) != sequence:
+            # Overwritten while copying, the next read gets the newer frame
+            return None
+        self.sequence = sequence
+        self.source_shape = source_shape
+        return image
+
+    def close(self):
+        del self.header, self.image
+        self.shm.close()
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message).encode() + b"\n"
+
+
+def record_message(record: FrameRecord) -> dict:
+    """The parts of a record a viewer shows."""
+    return {
+        "type": "record",
+        "timestamp_ns": record.timestamp_ns,
+        "frame_id": record.frame_id,
+        "angle": record.angle,
+        "exposure": record.exposure,
+        "exposure_index": record.exposure_index,
+        "sums": [int(data_sum) for data_sum in record.sums],
+        "region_results": [int(result) for result in record.region_results],
+        "overall_result": int(record.overall_result),
+        "result": int(record.result),
+        "extras": record.extras,
+    }
+
+
+def config_message(snapshot: ConfigSnapshot, modified: bool) -> dict:
+    return {
+        "type": "config",
+        "version": snapshot.version,
+        "config": snapshot.to_dict(),
+        "modified": modified,
+    }
+
+
+class _Viewer:
+    """
+    One attached viewer. Messages are queued and sent from a thread of its
+    own, so a slow viewer only loses its own oldest messages.
+    """
+
+    def __init__(self, conn: socket.socket, on_command: Callable[[dict], None]):
+        self.conn = conn
+        self.on_command = on_command
+        self.address = conn.getpeername()
+        self.messages = collections.deque(maxlen=MAX_QUEUED_MESSAGES)
+        self.dropped = 0
+        self.closed = False
+        self._ready = threading.Condition()
+        self._sender = threading.Thread(target=self._send, name="viewer-send", daemon=True)
+        self._receiver = threading.Thread(target=self._receive, name="viewer-recv", daemon=True)
+
+    def start(self):
+        self._sender.start()
+        self._receiver.start()
+
+    def put(self, data: bytes):
+        with self._ready:
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(data)
+            self._ready.notify()
+
+    def _send(self):
+        try:
+            while True:
+                with self._ready:
+                    while not self.messages and not self.closed:
+                        self._ready.wait()
+                    if self.closed:
+                        break
+                    data = b"".join(self.messages)
+                    self.messages.clear()
+                self.conn.sendall(data)
+        except OSError:
+            pass
+        self.close()
+
+    def _receive(self):
+        try:
+            with self.conn.makefile("rb") as lines:
+                for line in lines:
+                    try:
+                        command = json.loads(line)
+                    except ValueError:
+                        print(f"Ignoring invalid command from viewer {self.address}: {line!r}")
+                        continue
+                    self.on_command(command)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        with self._ready:
+            if self.closed:
+                return
+            self.closed = True
+            self._ready.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class ViewerServer:
+    """
+    Accepts viewers on a local TCP socket. Each message is a line of JSON.
+    Messages from the service are broadcast to every viewer, and each viewer
+    gets `hello()` first. Lines from viewers are passed to `on_command`.
+    """
+
+    def __init__(
+        self,
+        on_command: Callable[[dict], None],
+        hello: Callable[[], dict],
+        host: str = "127.0.0.1",
+        port: int = 9300,
+    ):
+        self.on_command = on_command
+        self.hello = hello
+        self._viewers: list[_Viewer] = []
+        self._lock = threading.Lock()
+        self._sock = socket.create_server((host, port))
+        self.thread = threading.Thread(target=self._accept, name="viewer-server", daemon=True)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._sock.getsockname()[:2]
+
+    @property
+    def viewers(self) -> int:
+        with self._lock:
+            self._viewers = [viewer for viewer in self._viewers if not viewer.closed]
+            return len(self._viewers)
+
+    def start(self):
+        self.thread.start()
+        print("Serving viewers on {}:{}".format(*self.address))
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                # Server closed
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            viewer = _Viewer(conn, self.on_command)
+            with self._lock:
+                # Queued under the lock, so no broadcast can come before it
+                viewer.put(encode(self.hello()))
+                self._viewers.append(viewer)
+            viewer.start()
+            print(f"Viewer attached from {viewer.address[0]}:{viewer.address[1]}")
+
+    def broadcast(self, message: dict):
+        """Queues `message` for every viewer. Never blocks on a viewer."""
+        with self._lock:
+            if not self._viewers:
+                return
+            data = encode(message)
+            for viewer in self._viewers:
+                viewer.put(data)
+
+    def close(self):
+        self._sock.close()
+        with self._lock:
+            for viewer in self._viewers:
+                viewer.close()
+            self._viewers = []
+
+
+class InspectionService:
+    """
+    Runs an Inspection without a window, so inspection carries on whether or
+    not a GUI is open. Viewers attach over a local socket (see ViewerServer):
+    they are sent the config, the records of every inspected frame and the
+    session summaries, and can start and stop sessions and change the config.
+    Preview frames go through shared memory (see PreviewBuffer), at most
+    `preview_fps` times a second and only while a viewer is attached.
+
+    Sessions start on a command from a viewer, or on their own with `start`.
+    With `repeat`, a new session starts as soon as one ends.
+    """
+
+    def __init__(self, config_service: ConfigService, start: bool = False, repeat: bool = False):
+        self.config_service = config_service
+        self.start_on_launch = start
+        self.repeat = repeat
+        self._commands = queue.Queue()
+        self._stop = threading.Event()
+
+        initial_config = config_service.snapshot.raw
+        service_config = initial_config.get("service", {})
+        self.preview_interval = 1 / service_config.get("preview_fps", 15)
+        self._last_preview = 0.0
+
+        # Metrics are always collected, the HTTP endpoint is optional
+        self.metrics = PipelineMetrics()
+        self.metrics_server = None
+        metrics_config = initial_config.get("metrics", {})
+        if metrics_config.get("enabled", False):
+            self.metrics_server = MetricsServer(
+                self.metrics.registry,
+                metrics_config.get("host", "127.0.0.1"),
+                metrics_config.get("port", 9108),
+            )
+
+        self.inspection = Inspection(config_service, self.metrics)
+        self.preview = PreviewBuffer(*service_config.get("preview_size", [768, 160]))
+        self.server = ViewerServer(
+            self._commands.put,
+            self.hello,
+            service_config.get("host", "127.0.0.1"),
+            service_config.get("port", 9300),
+        )
+        config_service.subscribe(
+            lambda snapshot: self.server.broadcast(
+                config_message(snapshot, self.config_service.is_modified)
+            )
+        )
+
+    def hello(self) -> dict:
+        message = config_message(self.config_service.snapshot, self.config_service.is_modified)
+        message["type"] = "hello"
+        message["preview"] = self.preview.name
+        message["running"] = self.inspection.connected
+        return message
+
+    def run(self):
+        """Runs until `stop` is called, or the process is interrupted."""
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        self.server.start()
+        self.config_service.start()
+        if self.start_on_launch:
+            self.start_session()
+        try:
+            while not self._stop.is_set():
+                self._handle_commands(block=not self.inspection.connected)
+                if self.inspection.connected:
+                    self._step()
+        except KeyboardInterrupt:
+            print("Interrupted")
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+        self._commands.put({"command": "wake"})
+
+    def _handle_commands(self, block: bool):
+        try:
+            command = self._commands.get(block, 0.5)
+        except queue.Empty:
+            return
+        while command is not None:
+            self._handle(command)
+            try:
+                command = self._commands.get_nowait()
+            except queue.Empty:
+                command = None
+
+    def _handle(self, command: dict):
+        """Runs a command from a viewer, on the service thread."""
+        name = command.get("command")
+        try:
+            if name == "start":
+                self.start_session()
+            elif name == "stop":
+                self.stop_session(repeat=False)
+            elif name == "apply":
+                self.config_service.apply(command["changes"])
+            elif name == "select_recipe":
+                self.config_service.select_recipe(command.get("name"))
+            elif name == "auto_roi":
+                self.inspection.auto_roi.request()
+            elif name == "save":
+                self.config_service.save()
+                self.server.broadcast(config_message(self.config_service.snapshot, False))
+            elif name != "wake":
+                raise ValueError(f"Unknown command {name!r}")
+        except (ConfigError, KeyError, ValueError, RuntimeError, pylon.GenericException) as e:
+            print(f"Command {command} failed: {e}")
+            self.server.broadcast({"type": "error", "message": f"{name} failed: {e}"})
+
+    def start_session(self):
+        if self.inspection.connected:
+            return
+        self.inspection.connect()
+        print(f"Started session {self.inspection.pipeline.session_dir}")
+        self.server.broadcast(
+            {"type": "session", "running": True, "path": str(self.inspection.pipeline.session_dir)}
+        )
+
+    def stop_session(self, repeat: bool):
+        self._broadcast_records(self.inspection.flush())
+        summary = self.inspection.disconnect()
+        self._session_ended(summary)
+        if repeat:
+            self.start_session()
+
+    def _broadcast_records(self, records: list[FrameRecord]):
+        for record in records:
+            self.server.broadcast(record_message(record))
+
+    def _session_ended(self, summary: Optional[dict]):
+        self.server.broadcast({"type": "session", "running": False, "summary": summary})
+
+    def _step(self):
+        try:
+            grab = self.inspection.grab()
+        except pylon.RuntimeException as e:
+            # Disconnected while running
+            print(f"Camera lost: {e}")
+            self._broadcast_records(self.inspection.flush())
+            self._session_ended(self.inspection.camera_lost())
+            return
+        if grab is not None:
+            self._broadcast_records(grab.records)
+            now = time.perf_counter()
+            if now - self._last_preview >= self.preview_interval and self.server.viewers:
+                size = (self.preview.width, self.preview.height)
+                self.preview.write(
+                    preview_image(grab.image, size, self.inspection.bit_depth),
+                    grab.image,
+                    grab.frame_info.frame_id,
+                )
+                self._last_preview = now
+            self.server.broadcast(
+                {
+                    "type": "status",
+                    "elapsed": round(self.inspection.elapsed, 2),
+                    "dropped": self.inspection.pipeline.summary.dropped,
+                }
+            )
+        if self.inspection.sampling_finished():
+            self.stop_session(self.repeat)
+
+    def close(self):
+        self.config_service.stop()
+        self.inspection.close()
+        self.server.close()
+        self.preview.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+
+def main():
+    # Worker processes of a frozen build run their worker instead of the service
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(
+        description="Encirc inspection service. Runs without a window, the GUI attaches "
+        "to it with --attach."
+    )
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG_PATH, help="config file")
+    parser.add_argument("--start", action="store_true", help="start a session on launch")
+    parser.add_argument(
+        "--repeat", action="store_true", help="start a new session as soon as one ends"
+    )
+    args = parser.parse_args()
+
+    if args.config == DEFAULT_CONFIG_PATH and not args.config.exists():
+        write_default_config()
+    service = InspectionService(ConfigService(args.config), args.start, args.repeat)
+    # Stop cleanly, ending the session, when asked to by the system
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    service.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import math
+from pathlib import Path
+from typing import Optional
+
+from result import Result
+
+
+class RunningStats:
+    """Count, min, max, mean and standard deviation, updated one value at a time (Welford)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation."""
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {"min": self.min, "max": self.max, "mean": self.mean, "std": self.std}
+
+
+def _format_ns(timestamp_ns: Optional[int]) -> Optional[str]:
+    if timestamp_ns is None:
+        return None
+    seconds, ns = divmod(timestamp_ns, 10**9)
+    now = datetime.datetime.fromtimestamp(seconds).replace(microsecond=ns // 1000)
+    return now.strftime(r"%Y-%m-%d %H:%M:%S.%f")
+
+
+class SessionSummary:
+    """
+    Summary of one session, kept up to date as frames are inspected, so it
+    can be written as soon as the session ends without re-reading any of the
+    measurement files.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.start_ns = None
+        self.end_ns = None
+        self.results = {result: 0 for result in Result}
+        self.regions: list[RunningStats] = []
+        self.worst = None
+
+    def add(self, record):
+        """Adds a FrameRecord."""
+        self.frames += 1
+        if self.start_ns is None:
+            self.start_ns = record.timestamp_ns
+        self.end_ns = record.timestamp_ns
+        self.results[record.result] += 1
+
+        while len(self.regions) < len(record.sums):
+            self.regions.append(RunningStats())
+        for stats, data_sum in zip(self.regions, record.sums):
+            stats.add(data_sum)
+
+        # The worst frame has the worst result, then the highest total sum
+        key = (record.result, sum(record.sums))
+        if self.worst is None or key > self.worst[0]:
+            self.worst = (key, record.timestamp_ns, list(record.sums))
+
+    def add_dropped(self, count: int = 1):
+        self.dropped += count
+
+    @property
+    def duration(self) -> float:
+        if self.start_ns is None:
+            return 0.0
+        return (self.end_ns - self.start_ns) / 1e9
+
+    @property
+    def fps(self) -> float:
+        # n frames span n - 1 frame intervals
+        if self.frames < 2 or self.duration == 0:
+            return 0.0
+        return (self.frames - 1) / self.duration
+
+    def to_dict(self) -> dict:
+        worst = None
+        if self.worst is not None:
+            (result, _), timestamp_ns, sums = self.worst
+            worst = {"timestamp": _format_ns(timestamp_ns), "result": result.name, "sums": sums}
+        return {
+            "start": _format_ns(self.start_ns),
+            "end": _format_ns(self.end_ns),
+            "frames": self.frames,
+            "dropped_frames": self.dropped,
+            "duration_s": self.duration,
+            "fps": self.fps,
+            "results": {
+                result.name: {
+                    "count": count,
+                    "percent": 100 * count / self.frames if self.frames else 0.0,
+                }
+                for result, count in self.results.items()
+            },
+            "regions": [stats.to_dict() for stats in self.regions],
+            "worst_frame": worst,
+        }
+
+    def save(self, path) -> dict:
+        """Writes the summary to `path` as JSON and returns it."""
+        summary = self.to_dict()
+        with open(Path(path), "w") as f:
+            json.dump(summary, f, indent=4)
+        return summary
+
+
+def format_summary(summary: dict) -> str:
+    """Formats a summary dict as plain text."""
+    lines = [
+        f"Frames: {summary['frames']} ({summary['dropped_frames']} dropped)",
+        f"Duration: {summary['duration_s']:.1f} s at {summary['fps']:.1f} fps",
+        "",
+    ]
+    for name, result in summary["results"].items():
+        lines.append(f"{name.replace('_', ' ').title()}: {result['count']} ({result['percent']:.1f}%)")
+    lines.append("")
+    for i, region in enumerate(summary["regions"]):
+        lines.append(
+            f"Region {i + 1}: min {region['min']}, max {region['max']}, "
+            f"mean {region['mean']:.0f}, std {region['std']:.0f}"
+        )
+    worst = summary["worst_frame"]
+    if worst is not None:
+        lines.append("")
+        lines.append(f"Worst frame: {worst['timestamp']} ({worst['result']})")
+    return "\n".join(lines)
+
+
+def main():
+    # Example usage:
+    import time
+    from types import SimpleNamespace
+
+    summary = SessionSummary()
+    t0 = time.time_ns()
+    for i in range(100):
+        sums = [1000 + i, 2000 - i, 500 * (i % 3)]
+        result = Result.REJECT if i == 42 else Result.ACCEPT
+        summary.add(SimpleNamespace(timestamp_ns=t0 + i * 40_000_000, sums=sums, result=result))
+    summary.add_dropped(2)
+    print(format_summary(summary.to_dict()))
+
+
+if __name__ == "__main__":
+    main()
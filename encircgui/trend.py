@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import datetime
+from typing import Optional
+
+import numpy as np
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QApplication
+
+
+class _Level:
+    """One level of a MinMaxPyramid: bucket start times and per-series min/max."""
+
+    def __init__(self, n_series: int, capacity: int, raw: bool = False):
+        self.raw = raw
+        self.size = 0
+        self.t = np.empty(capacity, dtype=np.int64)
+        self.vmin = np.empty((capacity, n_series), dtype=np.float32)
+        # The raw level has no separate max, every bucket is a single sample
+        self.vmax = self.vmin if raw else np.empty_like(self.vmin)
+
+    def _grow(self):
+        capacity = 2 * len(self.t)
+        self.t = np.resize(self.t, capacity)
+        vmin = np.empty((capacity, self.vmin.shape[1]), dtype=self.vmin.dtype)
+        vmin[: self.size] = self.vmin[: self.size]
+        if self.raw:
+            self.vmin = self.vmax = vmin
+        else:
+            vmax = np.empty_like(vmin)
+            vmax[: self.size] = self.vmax[: self.size]
+            self.vmin, self.vmax = vmin, vmax
+
+    def append(self, t: int, vmin, vmax):
+        if self.size == len(self.t):
+            self._grow()
+        self.t[self.size] = t
+        self.vmin[self.size] = vmin
+        if not self.raw:
+            self.vmax[self.size] = vmax
+        self.size += 1
+
+
+class MinMaxPyramid:
+    """
+    Multi-resolution min/max summary of a set of time series sharing timestamps.
+
+    Level 0 holds the raw samples. Each bucket of level k+1 holds the min and
+    max of `factor` consecutive buckets of level k, and is added as soon as
+    those buckets are complete, so appending a sample is amortised O(1).
+    """
+
+    def __init__(self, n_series: int, factor: int = 4, capacity: int = 1024):
+        self.n_series = n_series
+        self.factor = factor
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.levels = [_Level(self.n_series, self.capacity, raw=True)]
+
+    def __len__(self) -> int:
+        return self.levels[0].size
+
+    @property
+    def time_range(self) -> Optional[tuple[int, int]]:
+        raw = self.levels[0]
+        if raw.size == 0:
+            return None
+        return int(raw.t[0]), int(raw.t[raw.size - 1])
+
+    def append(self, t_ns: int, values):
+        """Appends one sample per series at time `t_ns` (nanoseconds, increasing)."""
+        self.levels[0].append(t_ns, values, values)
+
+        index = 0
+        while self.levels[index].size % self.factor == 0:
+            lower = self.levels[index]
+            if index + 1 == len(self.levels):
+                capacity = max(self.capacity // self.factor, 16)
+                self.levels.append(_Level(self.n_series, capacity))
+            start = lower.size - self.factor
+            self.levels[index + 1].append(
+                lower.t[start],
+                lower.vmin[start : lower.size].min(axis=0),
+                lower.vmax[start : lower.size].max(axis=0),
+            )
+            index += 1
+
+    def query(self, t0: int, t1: int, max_points: int):
+        """
+        Returns (t, vmin, vmax) covering [t0, t1] using the finest level that
+        has at most `max_points` buckets in that range. Samples not yet summarised
+        by the chosen level are taken from the finer levels below it.
+        """
+        chosen = len(self.levels) - 1
+        for index, level in enumerate(self.levels):
+            t = level.t[: level.size]
+            count = np.searchsorted(t, t1, "right") - np.searchsorted(t, t0, "left")
+            if count <= max_points:
+                chosen = index
+                break
+
+        ts, mins, maxs = [], [], []
+        start = 0
+        for index in range(chosen, -1, -1):
+            level = self.levels[index]
+            t = level.t[start : level.size]
+            # Include the bucket that contains t0
+            lo = max(np.searchsorted(t, t0, "right") - 1, 0) + start
+            hi = np.searchsorted(t, t1, "right") + start
+            ts.append(level.t[lo:hi])
+            mins.append(level.vmin[lo:hi])
+            maxs.append(level.vmax[lo:hi])
+            start = level.size * self.factor
+
+        return np.concatenate(ts), np.concatenate(mins), np.concatenate(maxs)
+
+
+class TrendView(QWidget):
+    """
+    Long-history plot of the region sums against time.
+
+    Samples are added to a MinMaxPyramid as they arrive. Each redraw asks the
+    pyramid for about one bucket per horizontal pixel of the visible range,
+    and draws each bucket as a vertical min-max stroke. Zooming and panning with
+    the toolbar re-query the pyramid for the new range.
+    """
+
+    def __init__(self, labels, colors, refresh_ms: int = 500, parent=None):
+        super().__init__(parent)
+        self._dirty = False
+        self._setting_xlim = False
+
+        self.canvas = FigureCanvas(plt.Figure(figsize=(5, 2)))
+        self.ax = self.canvas.figure.subplots()
+        self.ax.set(xlabel="time", ylabel="Intensity", title="Intensity Trend")
+        # Times are plotted as UTC datetime64, label them in local time
+        local_tz = datetime.datetime.now().astimezone().tzinfo
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M:%S", tz=local_tz))
+        self.lines = []
+        self.set_series(labels, colors)
+        self.ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        self.follow_checkbox = QCheckBox("Follow live")
+        self.follow_checkbox.setChecked(True)
+        self.follow_checkbox.stateChanged.connect(self._on_follow_changed)
+
+        toolbar_layout = QHBoxLayout()
+        toolbar_layout.addWidget(self.toolbar)
+        toolbar_layout.addWidget(self.follow_checkbox)
+        layout = QVBoxLayout()
+        layout.addLayout(toolbar_layout)
+        layout.addWidget(self.canvas)
+        self.setLayout(layout)
+
+        # Redraws are coalesced, adding samples only marks the view as dirty
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._refresh)
+        self.timer.start(refresh_ms)
+
+    def set_series(self, labels, colors, linestyles=None):
+        """Replaces the plotted series. This clears the history."""
+        self.pyramid = MinMaxPyramid(len(labels))
+        for line in self.lines:
+            line.remove()
+        if linestyles is None:
+            linestyles = ["-"] * len(labels)
+        self.lines = [
+            self.ax.plot([], [], color=color, label=label, linestyle=style, linewidth=1)[0]
+            for label, color, style in zip(labels, colors, linestyles)
+        ]
+        self.ax.legend(handles=self.lines, loc="upper right")
+        self.canvas.draw_idle()
+
+    def append(self, t_ns: int, values):
+        self.pyramid.append(t_ns, values)
+        self._dirty = True
+
+    def clear(self):
+        self.pyramid.clear()
+        for line in self.lines:
+            line.set_data([], [])
+        self.canvas.draw_idle()
+
+    def _on_follow_changed(self, state):
+        self._dirty = True
+        self._refresh()
+
+    def _plot_width(self) -> int:
+        return max(int(self.ax.get_window_extent().width), 1)
+
+    def _set_xlim(self, t0: int, t1: int):
+        self._setting_xlim = True
+        try:
+            self.ax.set_xlim(np.datetime64(t0, "ns"), np.datetime64(t1, "ns"))
+        finally:
+            self._setting_xlim = False
+
+    def _update_lines(self, t0: int, t1: int):
+        t, vmin, vmax = self.pyramid.query(t0, t1, self._plot_width())
+        # Interleave min and max so each bucket is drawn as a vertical stroke
+        x = np.repeat(t, 2).astype("datetime64[ns]")
+        for i, line in enumerate(self.lines):
+            y = np.column_stack((vmin[:, i], vmax[:, i])).ravel()
+            line.set_data(x, y)
+
+    def _on_xlim_changed(self, ax):
+        if self._setting_xlim or len(self.pyramid) == 0:
+            return
+        # Zoomed or panned by the user
+        self.follow_checkbox.setChecked(False)
+        x0, x1 = (mdates.num2date(x).timestamp() for x in ax.get_xlim())
+        self._update_lines(int(x0 * 1e9), int(x1 * 1e9))
+
+    def _refresh(self):
+        if not self._dirty or not self.isVisible() or len(self.pyramid) == 0:
+            return
+        self._dirty = False
+        if self.follow_checkbox.isChecked():
+            t0, t1 = self.pyramid.time_range
+            if t1 == t0:
+                t1 = t0 + 1
+            self._set_xlim(t0, t1)
+        else:
+            x0, x1 = (mdates.num2date(x).timestamp() for x in self.ax.get_xlim())
+            t0, t1 = int(x0 * 1e9), int(x1 * 1e9)
+        self._update_lines(t0, t1)
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        self.canvas.draw_idle()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    app = QApplication(sys.argv)
+    window = TrendView(["Region 1", "Region 2"], ["red", "green"])
+
+    # Example of a long history: eight hours at 50 frames per second
+    start = time.time_ns()
+    rng = np.random.default_rng()
+    for i in range(8 * 3600 * 50):
+        t = start + i * 20_000_000
+        window.append(t, rng.normal([1e5, 2e5], 1e4))
+    window.show()
+    sys.exit(app.exec_())
@@ -5,10 +5,33 @@ from pathlib import Path
 import sys
 
 
+# RGB colours used to draw and plot each region: red, green, blue, yellow, ...
+REGION_COLORS = [
+    (255, 0, 0),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 255, 0),
+    (255, 0, 255),
+    (0, 255, 255),
+    (255, 128, 0),
+    (128, 0, 255),
+]
+
+
 def region_dict(x_low: int, y_low: int, x_high: int, y_high: int) -> dict[str, int]:
     return {"x_low": x_low, "y_low": y_low, "x_high": x_high, "y_high": y_high}
 
 
+def region_color(index: int) -> tuple[int, int, int]:
+    """RGB colour of the region at `index`."""
+    return REGION_COLORS[index % len(REGION_COLORS)]
+
+
+def region_plot_color(index: int) -> tuple[float, float, float]:
+    """Colour of the region at `index` for matplotlib."""
+    return tuple(c / 255 for c in region_color(index))
+
+
 def set_qdarkstyle_plot_theme():
     plt.rcParams["axes.facecolor"] = "#19232D"
     plt.rcParams["savefig.facecolor"] = "#19232D"
@@ -33,3 +56,7 @@ def is_frozen() -> bool:
 
 def get_config_path(config_name: str = "config.json") -> Path:
     return get_main_script_path().parent / config_name
+
+
+def get_data_dir() -> Path:
+    return Path(__file__).parent.absolute().parent / "data"
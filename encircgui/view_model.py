@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+from typing import Any, Callable
+
+from PyQt5.QtCore import QObject, QSize, QTimer, Qt
+from PyQt5.QtGui import QBrush, QColor, QPainter, QPen
+from PyQt5.QtWidgets import QApplication, QHBoxLayout, QLabel, QWidget
+
+from result import Result
+
+# Brushes for each result, created once rather than per update
+RESULT_BRUSHES = {
+    Result.NO_BOTTLE: QBrush(QColor(69, 83, 100)),
+    Result.ACCEPT: QBrush(QColor("green")),
+    Result.INSPECT: QBrush(QColor("orange")),
+    Result.REJECT: QBrush(QColor("red")),
+}
+_BORDER_PEN = QPen(QColor(69, 83, 100), 1)
+
+_MISSING = object()
+
+
+class ResultLight(QWidget):
+    """
+    Square light showing a Result. It paints itself with a precomputed brush,
+    so changing the result only schedules a repaint, unlike setStyleSheet
+    which re-polishes the widget.
+    """
+
+    def __init__(self, size: int = 100, parent=None):
+        super().__init__(parent)
+        self.result = Result.NO_BOTTLE
+        self.setFixedSize(QSize(size, size))
+
+    def set_result(self, result: Result):
+        if result != self.result:
+            self.result = result
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setPen(_BORDER_PEN)
+        painter.setBrush(RESULT_BRUSHES[self.result])
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+
+
+class ViewModel(QObject):
+    """
+    Last known state of the widgets of the inspection panel.
+
+    The inspection loop calls `set` with new values for named properties as
+    often as it likes. Values are only kept if they differ from what is on
+    screen, and are applied to the widgets together, at most `rate_hz` times
+    a second, by a timer on the GUI thread.
+    """
+
+    def __init__(self, rate_hz: float = 30, parent=None):
+        super().__init__(parent)
+        self._setters: dict[str, Callable[[Any], None]] = {}
+        self._rendered: dict[str, Any] = {}
+        self._pending: dict[str, Any] = {}
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(1000 / rate_hz))
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def bind(self, name: str, setter: Callable[[Any], None]):
+        """Binds a property to the function that shows it, e.g. a label's setText."""
+        self._setters[name] = setter
+        self._rendered.pop(name, None)
+
+    def unbind(self, name: str):
+        self._setters.pop(name, None)
+        self._rendered.pop(name, None)
+        self._pending.pop(name, None)
+
+    def set(self, name: str, value):
+        if self._rendered.get(name, _MISSING) == value:
+            self._pending.pop(name, None)
+        else:
+            self._pending[name] = value
+
+    def flush(self):
+        """Applies every changed property to its widget."""
+        pending, self._pending = self._pending, {}
+        for name, value in pending.items():
+            setter = self._setters.get(name)
+            if setter is not None:
+                setter(value)
+                self._rendered[name] = value
+
+
+def main():
+    # Example usage:
+    import itertools
+    import sys
+
+    app = QApplication(sys.argv)
+    window = QWidget()
+    layout = QHBoxLayout(window)
+    label = QLabel()
+    light = ResultLight()
+    layout.addWidget(label)
+    layout.addWidget(light)
+
+    view_model = ViewModel()
+    view_model.bind("count", lambda value: label.setText(f"Frame {value}"))
+    view_model.bind("result", light.set_result)
+
+    # Far more updates than are shown
+    counter = itertools.count()
+    results = itertools.cycle([Result.ACCEPT] * 50 + [Result.INSPECT] * 50 + [Result.REJECT] * 50)
+
+    def frame():
+        view_model.set("count", next(counter) // 10)
+        view_model.set("result", next(results))
+
+    timer = QTimer()
+    timer.timeout.connect(frame)
+    timer.start(1)
+    window.show()
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
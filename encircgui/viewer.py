@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import json
+import queue
+import socket
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from config import ConfigError, ConfigSnapshot
+from result import Result
+from service import PreviewReader
+
+
+@dataclass
+class RemoteRecord:
+    """The parts of a FrameRecord sent to viewers by the inspection service."""
+
+    timestamp_ns: int
+    frame_id: Optional[int]
+    angle: Optional[float]
+    exposure: float
+    exposure_index: Optional[int]
+    sums: list[int]
+    region_results: list[Result]
+    overall_result: Result
+    result: Result
+    extras: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_message(cls, message: dict) -> "RemoteRecord":
+        return cls(
+            timestamp_ns=message["timestamp_ns"],
+            frame_id=message["frame_id"],
+            angle=message["angle"],
+            exposure=message["exposure"],
+            exposure_index=message["exposure_index"],
+            sums=message["sums"],
+            region_results=[Result(result) for result in message["region_results"]],
+            overall_result=Result(message["overall_result"]),
+            result=Result(message["result"]),
+            extras=message["extras"],
+        )
+
+
+class ServiceClient:
+    """
+    Connection of a viewer to the inspection service. Messages are received
+    on a background thread and kept until `receive` is called, so the viewer
+    reads them whenever it is ready to draw. The first message, `hello`, is
+    waited for on connecting.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9300, timeout: float = 5.0):
+        self.address = (host, port)
+        self._sock = socket.create_connection(self.address, timeout)
+        self._sock.settimeout(None)
+        self._messages = queue.Queue()
+        self.connected = True
+        self._thread = threading.Thread(target=self._run, name="service-client", daemon=True)
+        self._thread.start()
+        try:
+            self.hello = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise ConnectionError(f"No reply from the inspection service at {host}:{port}")
+
+    def _run(self):
+        try:
+            with self._sock.makefile("rb") as lines:
+                for line in lines:
+                    self._messages.put(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        self.connected = False
+
+    def receive(self) -> list[dict]:
+        """Returns the messages received since the last call."""
+        messages = []
+        while True:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def send(self, command: str, **arguments):
+        """Sends a command to the service. Fails silently if the service has gone."""
+        try:
+            self._sock.sendall(json.dumps({"command": command, **arguments}).encode() + b"\n")
+        except OSError:
+            self.connected = False
+
+    def preview_reader(self) -> PreviewReader:
+        return PreviewReader(self.hello["preview"])
+
+    def close(self):
+        self.connected = False
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+class RemoteConfig:
+    """
+    Stands in for the ConfigService of a viewer. The config belongs to the
+    service: changes are sent to it as commands, and the snapshots it sends
+    back are published to subscribers with `update`.
+    """
+
+    def __init__(self, client: ServiceClient):
+        self.client = client
+        self._subscribers: list[Callable[[ConfigSnapshot], None]] = []
+        self.is_modified = False
+        self.update(client.hello)
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot], None]):
+        self._subscribers.append(callback)
+
+    def update(self, message: dict):
+        """Publishes the snapshot in a hello or config message from the service."""
+        self.snapshot = ConfigSnapshot.from_config(message["config"], message["version"])
+        self.is_modified = message["modified"]
+        for callback in self._subscribers:
+            callback(self.snapshot)
+
+    def apply(self, changes: dict):
+        if not self.client.connected:
+            raise ConfigError("not attached to the inspection service")
+        self.client.send("apply", changes=changes)
+
+    def select_recipe(self, name: Optional[str]):
+        self.client.send("select_recipe", name=name)
+
+    def save(self):
+        self.client.send("save")
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def main():
+    # Example usage: print the results of a running service
+    import time
+
+    client = ServiceClient()
+    print(f"Attached to config version {client.hello['version']}")
+    while client.connected:
+        for message in client.receive():
+            if message["type"] == "record":
+                record = RemoteRecord.from_message(message)
+                print(f"Frame {record.frame_id}: {record.result.name}")
+            elif message["type"] == "session":
+                print("Session started" if message["running"] else "Session ended")
+        time.sleep(0.1)
+
+
+if __name__ == "__main__":
+    main()